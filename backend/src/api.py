@@ -1,16 +1,68 @@
 """API module."""
 
+import base64
+import binascii
+import dataclasses
+import hashlib
 import logging
 import math
 import operator
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterable
+from decimal import Decimal, InvalidOperation
+from functools import cache, lru_cache
+from http import HTTPStatus
 from itertools import groupby
-from typing import Annotated
+from typing import Annotated, Any, Literal, Self
 
-from fastapi import FastAPI, Query
+import anyio
+import orjson
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from peewee import JOIN, fn
 
-from orm.models import Hall, Movie, MoviePlace, User, WantToWatch, Watched
+from orm.connection import scoped_connection
+from orm.geo import GridIndex
+from orm.models import (
+    MAX_CONNECTIONS,
+    DataVersion,
+    Hall,
+    MovieStatus,
+    Screening,
+    Status,
+)
+
+CACHE_SIZE = 256
+MAX_CACHED_SIZE = 4 * 1024 * 1024
+LETTERBOXD_ID = "alexiszam"
+MAX_LIMIT = 100
+STREAM_MOVIES = 50
+
+_COLUMNS = (
+    Screening.movie,
+    Screening.title,
+    Screening.original_title,
+    Screening.imdb_url,
+    Screening.rating,
+    Screening.votes,
+    Screening.critics_rating,
+    Screening.critics_votes,
+    Screening.hall,
+    Screening.hall_name,
+    Screening.lat,
+    Screening.lng,
+    Screening.date,
+    Screening.time,
+)
+_MOVIE = operator.itemgetter(0, 1, 2, 3, 4, 5, 6, 7)
+_HALL = operator.itemgetter(8, 9, 10, 11)
+_DATE = operator.itemgetter(12)
+_TIME = operator.itemgetter(13)
+
+_cache: OrderedDict[tuple[Any, ...], bytes] = OrderedDict()
+_cache_lock = threading.Lock()
 
 logging.basicConfig(level=logging.INFO)
 
@@ -25,150 +77,362 @@ app.add_middleware(
 )
 
 
+@dataclasses.dataclass(slots=True)
+class Filters:
+    """Filters of the screenings of a query string."""
+
+    date: Annotated[list[str] | None, Query()] = None
+    min_time: str = "00:00"
+    max_time: str = "23:59"
+    dubbed: str | None = None
+    subbed: str | None = None
+    open_air: str | None = None
+    closed: str | None = None
+    min_rating: float | None = None
+    min_critics_rating: float | None = None
+    cinobo_pass: str | None = None
+    watched: str | None = None
+    want_to_watch: str | None = None
+    unlisted: str | None = None
+    user: str = LETTERBOXD_ID
+
+    def key(self: Self) -> tuple[Any, ...]:
+        """Get the filters as a cache key, the same for any order of dates."""
+        return (tuple(sorted(set(self.date or []))), *dataclasses.astuple(self)[1:])
+
+
+@dataclasses.dataclass(slots=True)
+class Page:
+    """Page and location of a query string."""
+
+    limit: Annotated[int | None, Query(ge=1, le=MAX_LIMIT)] = None
+    cursor: str | None = None
+    lat: Annotated[float | None, Query(ge=-90, le=90)] = None
+    lng: Annotated[float | None, Query(ge=-180, le=180)] = None
+    max_distance: Annotated[float | None, Query(gt=0)] = None
+    sort: Literal["score", "distance"] = "score"
+
+
 @app.get("/api")
-def root(
-    *,
-    date: Annotated[list[str] | None, Query()] = None,
-    min_time: str = "00:00",
-    max_time: str = "23:59",
-    dubbed: str | None = None,
-    subbed: str | None = None,
-    open_air: str | None = None,
-    closed: str | None = None,
-    min_rating: float | None = None,
-    min_critics_rating: float | None = None,
-    cinobo_pass: str | None = None,
-    watched: str | None = None,
-    want_to_watch: str | None = None,
-    unlisted: str | None = None,
-) -> JSONResponse:
-    if date is None:
-        date = []
-    user_watched = (
-        User.select(Movie.imdb_url)
-        .join(Watched)
-        .join(Movie)
-        .where(User.letterboxd_id == "alexiszam")
+async def root(
+    filters: Annotated[Filters, Depends()],
+    page: Annotated[Page, Depends()],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    after = _decode_cursor(page.cursor) if page.cursor is not None else None
+    lat, lng, max_distance = page.lat, page.lng, page.max_distance
+    if (lat is None) != (lng is None) or (
+        lat is None and (max_distance is not None or page.sort == "distance")
+    ):
+        raise HTTPException(HTTPStatus.BAD_REQUEST, "Distances need both lat and lng")
+    version = await _run_db(DataVersion.get_version)
+    key = (version, *dataclasses.astuple(page), *filters.key())
+    # The body only depends on the data version, the page and the filters.
+    etag = f'"{hashlib.sha256(repr(key).encode()).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and etag in {
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    }:
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+    if body is not None:
+        return Response(body, media_type="application/json", headers=headers)
+    distances = None
+    if lat is not None and lng is not None:
+        halls = await _run_db(_get_halls, version)
+        distances = dict(halls.within(lat, lng, max_distance))
+    query, movies, next_cursor = await _run_db(
+        _fetch,
+        filters,
+        page.limit,
+        after,
+        list(distances) if distances is not None and max_distance is not None else None,
+    )
+    extra = {"next_cursor": next_cursor} if page.limit is not None else {}
+    return StreamingResponse(
+        _stream(
+            key, query, movies, extra, distances, by_distance=page.sort == "distance"
+        ),
+        media_type="application/json",
+        headers=headers,
     )
-    user_want_to_watch = (
-        User.select(Movie.imdb_url)
-        .join(WantToWatch)
-        .join(Movie)
-        .where(User.letterboxd_id == "alexiszam")
+
+
+@lru_cache(maxsize=1)
+def _get_halls(version: int) -> GridIndex[str]:  # noqa: ARG001
+    """Get the spatial index of the hall URLs as of a data version."""
+    return GridIndex.from_points(Hall.select(Hall.url, Hall.lat, Hall.lng).tuples())
+
+
+def _encode_cursor(score: Decimal, movie: str) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([str(score), movie])).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[Decimal, str]:
+    """Get the score and movie URL of the last movie of a page."""
+    try:
+        score, movie = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return Decimal(score), str(movie)
+    except (
+        binascii.Error,
+        orjson.JSONDecodeError,
+        InvalidOperation,
+        TypeError,
+        ValueError,
+    ) as e:
+        raise HTTPException(HTTPStatus.BAD_REQUEST, "Invalid cursor") from e
+
+
+@cache
+def _get_limiter() -> anyio.CapacityLimiter:
+    """Get the limiter of database threads, one per pooled connection."""
+    return anyio.CapacityLimiter(MAX_CONNECTIONS)
+
+
+async def _run_db[T](function: Callable[..., T], *args: Any) -> T:  # noqa: ANN401
+    """Run a database call in a worker thread, off the event loop."""
+    return await anyio.to_thread.run_sync(
+        _with_connection, function, *args, limiter=_get_limiter()
     )
-    user_unlisted = Movie.select(Movie.imdb_url).where(
-        (Movie.imdb_url.not_in(user_watched))
-        & (Movie.imdb_url.not_in(user_want_to_watch))
+
+
+def _with_connection[T](function: Callable[..., T], *args: Any) -> T:  # noqa: ANN401
+    """Call a function with a connection that goes back to the pool after."""
+    with scoped_connection(Screening._meta.database):  # noqa: SLF001
+        return function(*args)
+
+
+def _fetch(
+    filters: Filters,
+    limit: int | None,
+    after: tuple[Decimal, str] | None,
+    halls: list[str] | None,
+) -> tuple[Any | None, list[str], str | None]:
+    """Get the query and movies of a page of some filters, and the next cursor.
+
+    Pages are over movies, not rows, in score order. A movie's rows are all in
+    the same page, after the movie of the cursor if any. Rows can be limited to
+    some halls.
+    """
+    query = _get_screenings(filters)
+    if query is None:
+        return None, [], None
+    if halls is not None:
+        query = query.where(Screening.hall.in_(halls))
+    if after is not None:
+        score, movie = after
+        query = query.where(
+            (Screening.score < score)
+            | ((Screening.score == score) & (Screening.movie > movie))
+        )
+    movies = (
+        query.select(Screening.score, Screening.movie)
+        .distinct()
+        .order_by(Screening.score.desc(), Screening.movie)
+        .tuples()
     )
+    if limit is not None:
+        movies = movies.limit(limit + 1)
+    movies = list(movies)
+    next_cursor = None
+    if limit is not None and len(movies) > limit:
+        movies = movies[:limit]
+        next_cursor = _encode_cursor(*movies[-1])
+    return query, [movie for _, movie in movies], next_cursor
+
+
+def _get_rows(query: Any, movies: list[str]) -> list[tuple[Any, ...]]:  # noqa: ANN401
+    """Get the rows of some movies of a query."""
+    return list(query.where(Screening.movie.in_(movies)).select(*_COLUMNS).tuples())
+
+
+async def _stream(  # noqa: PLR0913
+    key: tuple[Any, ...],
+    query: Any,  # noqa: ANN401
+    movies: list[str],
+    extra: dict[str, Any],
+    distances: dict[str, float] | None,
+    *,
+    by_distance: bool,
+) -> AsyncIterator[bytes]:
+    """Stream the body of a response, caching it if it is small enough.
+
+    The data version is part of the cache key, so entries of older versions
+    are never hit again and age out of the cache.
+    """
+    chunks: list[bytes] | None = []
+    size = 0
+    async for chunk in _render(
+        query, movies, extra, distances, by_distance=by_distance
+    ):
+        if chunks is not None:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > MAX_CACHED_SIZE:
+                chunks = None
+        yield chunk
+    if chunks is not None:
+        with _cache_lock:
+            _cache[key] = b"".join(chunks)
+            if len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+
+async def _render(
+    query: Any,  # noqa: ANN401
+    movies: list[str],
+    extra: dict[str, Any],
+    distances: dict[str, float] | None,
+    *,
+    by_distance: bool,
+) -> AsyncIterator[bytes]:
+    """Serialize some movies of a query one at a time, then the extra fields.
+
+    Rows are fetched a few movies at a time, so memory and time to first byte
+    stay flat however many screenings match, and no connection is held while
+    the client reads.
+    """
+    yield b'{"movies":['
+    separator = b""
+    for start in range(0, len(movies), STREAM_MOVIES):
+        rows = await _run_db(_get_rows, query, movies[start : start + STREAM_MOVIES])
+        for movie, group in groupby(rows, key=_MOVIE):
+            movie_ = _get_movie(movie, group, distances, by_distance=by_distance)
+            yield separator + orjson.dumps(movie_)
+            separator = b","
+    yield b"]"
+    for name, value in extra.items():
+        yield b"," + orjson.dumps(name) + b":" + orjson.dumps(value)
+    yield b"}"
+
+
+def _get_movie(
+    movie: tuple[Any, ...],
+    rows: Iterable[tuple[Any, ...]],
+    distances: dict[str, float] | None = None,
+    *,
+    by_distance: bool = False,
+) -> dict[str, Any]:
+    (
+        url,
+        title,
+        original_title,
+        imdb_url,
+        rating,
+        votes,
+        critics_rating,
+        critics_votes,
+    ) = movie
+    if by_distance and distances is not None:
+        # Stable, so each hall's dates and times stay in order.
+        rows = sorted(rows, key=lambda row: distances.get(_HALL(row)[0], math.inf))
+    return {
+        "title": title,
+        "original_title": original_title,
+        "url": url,
+        "imdb_url": imdb_url,
+        "rating": float(rating),
+        "votes": int(votes),
+        "critics_rating": float(critics_rating),
+        "critics_votes": int(critics_votes),
+        "halls": [
+            _get_hall(hall, hall_rows, distances)
+            for hall, hall_rows in groupby(rows, key=_HALL)
+        ],
+    }
+
+
+def _get_hall(
+    hall: tuple[Any, ...],
+    rows: Iterable[tuple[Any, ...]],
+    distances: dict[str, float] | None,
+) -> dict[str, Any]:
+    url, name, lat, lng = hall
+    hall_ = {
+        "name": name,
+        "url": url,
+        "lat": float(lat),
+        "lng": float(lng),
+        "dates": [
+            {
+                "date": str(date),
+                "times": [{"time": str(_TIME(row))} for row in date_rows],
+            }
+            for date, date_rows in groupby(rows, key=_DATE)
+        ],
+    }
+    if distances is not None:
+        hall_["distance"] = distances.get(url)
+    return hall_
+
+
+def _get_screenings(filters: Filters) -> Any | None:  # noqa: ANN401
+    """Build the query of the screenings of some filters, None if there are none."""
+    movie_status = fn.COALESCE(MovieStatus.status, Status.UNLISTED.value)
     movie_places = (
-        MoviePlace.select()
-        .join(Hall)
-        .switch(MoviePlace)
-        .join(Movie)
+        Screening.select()
+        .join(
+            MovieStatus,
+            JOIN.LEFT_OUTER,
+            on=(MovieStatus.movie == Screening.imdb_url)
+            & (MovieStatus.user == filters.user),
+        )
         .where(
-            # & (MoviePlace.time >= now.time())
-            MoviePlace.date.in_(date)
-            & (MoviePlace.time >= min_time)
-            & (MoviePlace.time <= max_time)
+            # & (Screening.time >= now.time())
+            Screening.date.in_(filters.date or [])
+            & (Screening.time >= filters.min_time)
+            & (Screening.time <= filters.max_time)
         )
         .order_by(
-            -(
-                MoviePlace.movie.rating * MoviePlace.movie.rating
-                + (
-                    (MoviePlace.movie.critics_rating * 2)
-                    * (MoviePlace.movie.critics_rating * 2)
-                )
-            ),
-            MoviePlace.movie,
-            MoviePlace.hall,
-            MoviePlace.date,
-            MoviePlace.time,
+            Screening.score.desc(),
+            Screening.movie,
+            Screening.hall,
+            Screening.date,
+            Screening.time,
         )
     )
 
-    match (open_air, closed):
+    match (filters.open_air, filters.closed):
         case ("on", None):
-            movie_places = movie_places.where(MoviePlace.hall.open_air)
+            movie_places = movie_places.where(Screening.open_air)
         case (None, "on"):
-            movie_places = movie_places.where(~MoviePlace.hall.open_air)
+            movie_places = movie_places.where(~Screening.open_air)
         case (None, None):
-            return JSONResponse(content={"movies": []})
+            return None
 
-    match (dubbed, subbed):
+    match (filters.dubbed, filters.subbed):
         case ("on", None):
-            movie_places = movie_places.where(MoviePlace.dubbed)
+            movie_places = movie_places.where(Screening.dubbed)
         case (None, "on"):
-            movie_places = movie_places.where(~MoviePlace.dubbed)
+            movie_places = movie_places.where(~Screening.dubbed)
         case (None, None):
-            return JSONResponse(content={"movies": []})
+            return None
 
-    if cinobo_pass == "on":  # noqa: S105
-        movie_places = movie_places.where(MoviePlace.cinobo_pass)
+    if filters.cinobo_pass == "on":  # noqa: S105
+        movie_places = movie_places.where(Screening.cinobo_pass)
 
-    if min_rating is not None:
+    if filters.min_rating is not None:
         movie_places = movie_places.where(
-            (MoviePlace.movie.rating == 0) | (MoviePlace.movie.rating >= min_rating)
+            (Screening.rating == 0) | (Screening.rating >= filters.min_rating)
         )
-    if min_critics_rating is not None:
+    if filters.min_critics_rating is not None:
         movie_places = movie_places.where(
-            (MoviePlace.movie.critics_rating == 0)
-            | (MoviePlace.movie.critics_rating >= min_critics_rating)
+            (Screening.critics_rating == 0)
+            | (Screening.critics_rating >= filters.min_critics_rating)
         )
 
-    match (want_to_watch, watched, unlisted):
-        case (None, None, None):
-            return JSONResponse(content={"movies": []})
-        case (None, None, "on"):
-            movie_places = movie_places.where(Movie.imdb_url.in_(user_unlisted))
-        case (None, "on", None):
-            movie_places = movie_places.where(Movie.imdb_url.in_(user_watched))
-        case (None, "on", "on"):
-            movie_places = movie_places.where(
-                Movie.imdb_url.in_(user_watched) | Movie.imdb_url.in_(user_unlisted)
-            )
-        case ("on", None, None):
-            movie_places = movie_places.where(Movie.imdb_url.in_(user_want_to_watch))
-        case ("on", None, "on"):
-            movie_places = movie_places.where(
-                Movie.imdb_url.in_(user_want_to_watch)
-                | Movie.imdb_url.in_(user_unlisted)
-            )
-        case ("on", "on", None):
-            movie_places = movie_places.where(
-                (Movie.imdb_url.in_(user_watched))
-                | (Movie.imdb_url.in_(user_want_to_watch))
-            )
-    movie_places = {
-        "movies": [
-            {
-                "title": movie.title,
-                "original_title": movie.original_title,
-                "url": movie.url,
-                "imdb_url": movie.imdb_url,
-                "rating": float(movie.rating),
-                "votes": int(movie.votes),
-                "critics_rating": float(movie.critics_rating),
-                "critics_votes": int(movie.critics_votes),
-                "halls": [
-                    {
-                        "name": hall.name,
-                        "url": hall.url,
-                        "lat": float(hall.lat),
-                        "lng": float(hall.lng),
-                        "dates": [
-                            {
-                                "date": str(date),
-                                "times": [{"time": str(item.time)} for item in __group],
-                            }
-                            for date, __group in groupby(
-                                _group, key=operator.attrgetter("date")
-                            )
-                        ],
-                    }
-                    for hall, _group in groupby(group, key=operator.attrgetter("hall"))
-                ],
-            }
-            for movie, group in groupby(movie_places, key=operator.attrgetter("movie"))
-        ]
-    }
-    return JSONResponse(content=movie_places)
+    statuses = [
+        status.value
+        for status, on in (
+            (Status.WANT_TO_WATCH, filters.want_to_watch),
+            (Status.WATCHED, filters.watched),
+            (Status.UNLISTED, filters.unlisted),
+        )
+        if on == "on"
+    ]
+    if not statuses:
+        return None
+    return movie_places.where(movie_status.in_(statuses))
@@ -0,0 +1,275 @@
+from collections.abc import Iterator
+from datetime import date, time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from peewee import SqliteDatabase
+from src import api
+
+from orm.models import (
+    DataVersion,
+    Hall,
+    Movie,
+    MoviePlace,
+    MovieStatus,
+    Screening,
+    User,
+    WantToWatch,
+    Watched,
+)
+
+MODELS = [
+    DataVersion,
+    Hall,
+    Movie,
+    MoviePlace,
+    MovieStatus,
+    Screening,
+    User,
+    WantToWatch,
+    Watched,
+]
+PARAMS = {
+    "date": ["2024-08-02", "2024-08-01"],
+    "subbed": "on",
+    "open_air": "on",
+    "unlisted": "on",
+}
+
+
+@pytest.fixture()
+def calls(monkeypatch: pytest.MonkeyPatch) -> list[api.Filters]:
+    calls: list[api.Filters] = []
+    get_screenings = api._get_screenings  # noqa: SLF001
+
+    def _get_screenings(filters: api.Filters) -> object:
+        calls.append(filters)
+        return get_screenings(filters)
+
+    monkeypatch.setattr(api, "_get_screenings", _get_screenings)
+    return calls
+
+
+@pytest.fixture()
+def client(tmp_path: Path) -> Iterator[TestClient]:
+    database = SqliteDatabase(tmp_path / "test.db")
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        Movie.create(
+            url="m",
+            title="Vertigo",
+            rating=8.3,
+            votes=1,
+            critics_rating=5,
+            critics_votes=1,
+            imdb_url="http://www.imdb.com/title/tt0052357/",
+        )
+        Hall.create(url="h", name="Hall", lat=0, lng=0, open_air=True)
+        MoviePlace.create(
+            movie="m",
+            hall="h",
+            date=date(2024, 8, 1),
+            time=time(21),
+            dubbed=False,
+            cinobo_pass=False,
+        )
+        Screening.refresh()
+        api._cache.clear()  # noqa: SLF001
+        api._get_halls.cache_clear()  # noqa: SLF001
+        yield TestClient(api.app)
+
+
+def test_responses_are_cached_by_canonical_params(
+    client: TestClient, calls: list[api.Filters]
+) -> None:
+    response = client.get("/api", params=PARAMS)
+    assert response.status_code == 200
+    assert [movie["title"] for movie in response.json()["movies"]] == ["Vertigo"]
+    reordered = {**PARAMS, "date": [*reversed(PARAMS["date"]), PARAMS["date"][0]]}
+    assert client.get("/api", params=reordered).content == response.content
+    assert len(calls) == 1
+
+
+def test_not_modified(client: TestClient, calls: list[api.Filters]) -> None:
+    etag = client.get("/api", params=PARAMS).headers["ETag"]
+    response = client.get("/api", params=PARAMS, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert not response.content
+    assert len(calls) == 1
+
+
+def test_data_version_invalidates(client: TestClient, calls: list[api.Filters]) -> None:
+    etag = client.get("/api", params=PARAMS).headers["ETag"]
+    Movie.update(title="Vertigo (1958)").execute()
+    Screening.refresh()
+    DataVersion.bump()
+    response = client.get("/api", params=PARAMS, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["movies"][0]["title"] == "Vertigo (1958)"
+    assert len(calls) == 2
+
+
+def test_status_filters(client: TestClient) -> None:
+    user = User.create(letterboxd_id=api.LETTERBOXD_ID)
+    Watched.create(user=user, movie="http://www.imdb.com/title/tt0052357/")
+    MovieStatus.sync(user)
+    params = {key: value for key, value in PARAMS.items() if key != "unlisted"}
+    assert client.get("/api", params=params).json() == {"movies": []}
+    unlisted = client.get("/api", params=PARAMS).json()["movies"]
+    assert unlisted == []
+    watched = client.get("/api", params={**params, "watched": "on"}).json()["movies"]
+    assert [movie["title"] for movie in watched] == ["Vertigo"]
+
+
+def test_statuses_are_per_user(client: TestClient) -> None:
+    for letterboxd_id in ("a", "b"):
+        User.create(letterboxd_id=letterboxd_id)
+    Watched.create(user="a", movie="http://www.imdb.com/title/tt0052357/")
+    for letterboxd_id in ("a", "b"):
+        MovieStatus.sync(letterboxd_id)
+    params = {**PARAMS, "unlisted": None, "watched": "on"}
+    assert client.get("/api", params={**params, "user": "a"}).json()["movies"]
+    assert not client.get("/api", params={**params, "user": "b"}).json()["movies"]
+
+
+def test_streamed_body(client: TestClient) -> None:
+    assert client.get("/api", params=PARAMS).json() == {
+        "movies": [
+            {
+                "title": "Vertigo",
+                "original_title": None,
+                "url": "m",
+                "imdb_url": "http://www.imdb.com/title/tt0052357/",
+                "rating": 8.3,
+                "votes": 1,
+                "critics_rating": 5.0,
+                "critics_votes": 1,
+                "halls": [
+                    {
+                        "name": "Hall",
+                        "url": "h",
+                        "lat": 0.0,
+                        "lng": 0.0,
+                        "dates": [
+                            {"date": "2024-08-01", "times": [{"time": "21:00:00"}]}
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def test_large_bodies_are_not_cached(
+    client: TestClient, calls: list[api.Filters], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(api, "MAX_CACHED_SIZE", 10)
+    client.get("/api", params=PARAMS)
+    client.get("/api", params=PARAMS)
+    assert len(calls) == 2
+
+
+def test_pages_follow_score_order(client: TestClient) -> None:
+    for url, rating in (("n", 9), ("o", 8.3), ("p", 1)):
+        Movie.create(
+            url=url,
+            title=url,
+            rating=rating,
+            votes=1,
+            critics_rating=5,
+            critics_votes=1,
+            imdb_url=f"http://www.imdb.com/title/{url}/",
+        )
+        for day in (1, 2):
+            MoviePlace.create(
+                movie=url,
+                hall="h",
+                date=date(2024, 8, day),
+                time=time(21),
+                dubbed=False,
+                cinobo_pass=False,
+            )
+    Screening.refresh()
+    movies = client.get("/api", params=PARAMS).json()["movies"]
+    assert [movie["url"] for movie in movies] == ["n", "m", "o", "p"]
+    page = client.get("/api", params={**PARAMS, "limit": 2}).json()
+    pages = [page["movies"]]
+    while (cursor := page["next_cursor"]) is not None:
+        page = client.get(
+            "/api", params={**PARAMS, "limit": 1, "cursor": cursor}
+        ).json()
+        pages.append(page["movies"])
+    urls = [[movie["url"] for movie in page] for page in pages]
+    assert urls == [["n", "m"], ["o"], ["p"]]
+    assert [movie for page in pages for movie in page] == movies
+
+
+def test_invalid_cursor(client: TestClient) -> None:
+    response = client.get("/api", params={**PARAMS, "limit": 1, "cursor": "x"})
+    assert response.status_code == 400
+
+
+def test_near_me(client: TestClient) -> None:
+    Hall.create(url="g", name="Far", lat=1, lng=0, open_air=True)
+    MoviePlace.create(
+        movie="m",
+        hall="g",
+        date=date(2024, 8, 2),
+        time=time(21),
+        dubbed=False,
+        cinobo_pass=False,
+    )
+    Screening.refresh()
+    near = {**PARAMS, "lat": 0.1, "lng": 0}
+    (movie,) = client.get("/api", params={**near, "max_distance": 50}).json()["movies"]
+    assert [hall["url"] for hall in movie["halls"]] == ["h"]
+    assert movie["halls"][0]["distance"] == pytest.approx(11.1, abs=0.1)
+    far = {**PARAMS, "lat": 0.9, "lng": 0, "sort": "distance"}
+    (movie,) = client.get("/api", params=far).json()["movies"]
+    assert [hall["url"] for hall in movie["halls"]] == ["g", "h"]
+    (movie,) = client.get("/api", params=PARAMS).json()["movies"]
+    assert [hall["url"] for hall in movie["halls"]] == ["g", "h"]
+    assert "distance" not in movie["halls"][0]
+
+
+def test_distances_need_a_location(client: TestClient) -> None:
+    for params in ({"sort": "distance"}, {"max_distance": 1}, {"lat": 0}):
+        assert client.get("/api", params={**PARAMS, **params}).status_code == 400
+
+
+def test_rows_are_streamed_in_chunks(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    for url in "no":
+        Movie.create(
+            url=url,
+            title=url,
+            rating=1,
+            votes=1,
+            critics_rating=5,
+            critics_votes=1,
+            imdb_url=f"http://www.imdb.com/title/{url}/",
+        )
+        MoviePlace.create(
+            movie=url,
+            hall="h",
+            date=date(2024, 8, 1),
+            time=time(21),
+            dubbed=False,
+            cinobo_pass=False,
+        )
+    Screening.refresh()
+    body = client.get("/api", params=PARAMS).json()
+    api._cache.clear()  # noqa: SLF001
+    get_rows = api._get_rows  # noqa: SLF001
+    chunks = []
+
+    def _get_rows(query: object, movies: list[str]) -> object:
+        chunks.append(movies)
+        return get_rows(query, movies)
+
+    monkeypatch.setattr(api, "STREAM_MOVIES", 2)
+    monkeypatch.setattr(api, "_get_rows", _get_rows)
+    assert client.get("/api", params=PARAMS).json() == body
+    assert chunks == [["m", "n"], ["o"]]
@@ -1,23 +1,6 @@
 import html from "./index.html";
 import "./index.css";
 
-function cosineDistanceBetweenPoints(lat1, lon1, lat2, lon2) {
-  const R = 6371e3;
-  const p1 = (lat1 * Math.PI) / 180;
-  const p2 = (lat2 * Math.PI) / 180;
-  const deltaP = p2 - p1;
-  const deltaLon = lon2 - lon1;
-  const deltaLambda = (deltaLon * Math.PI) / 180;
-  const a =
-    Math.sin(deltaP / 2) * Math.sin(deltaP / 2) +
-    Math.cos(p1) *
-      Math.cos(p2) *
-      Math.sin(deltaLambda / 2) *
-      Math.sin(deltaLambda / 2);
-  const d = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a)) * R;
-  return d;
-}
-
 const WEEKDAYS = [
   "Κυριακή",
   "Δευτέρα",
@@ -37,7 +20,10 @@ const WEEKDAYS_CINEMA = [
   "Τετάρτη",
 ];
 
+const PAGE_SIZE = 20;
+
 let lat, lng;
+let submission = 0;
 
 navigator.geolocation.getCurrentPosition(
   async ({ coords: { latitude, longitude } }) => {
@@ -59,15 +45,18 @@ function getLastThursday() {
 }
 
 async function submit() {
+  const current = ++submission;
   const form = document.querySelector("form");
   const formData = new FormData(form);
 
   // console.log(formData.entries()[0]);
+  if (!(lat && lng)) formData.delete("max_distance");
   let query = Array.from(formData)
+    .filter(([, value]) => value !== "")
     .map(([name, value]) => `${name}=${value}`)
     .join("&");
 
-  //   if (lat && lng) query += `&lat=${lat}&lng=${lng}`;
+  if (lat && lng) query += `&lat=${lat}&lng=${lng}&sort=distance`;
 
   // const data = {
   //     name: input.name,
@@ -80,11 +69,6 @@ async function submit() {
   //     },
   //     body: JSON.stringify(data)
   // })
-  const url = `/api?${query}`;
-  console.log(url);
-  const response = await fetch(url);
-  const json = await response.json();
-
   function setTime(time) {
     const li = document.createElement("li");
     li.textContent = time.time.split(":").slice(0, -1).join(":");
@@ -160,14 +144,6 @@ async function submit() {
     const ol = document.createElement("ol");
     ol.classList.add("hall");
 
-    if (lat && lng) {
-      movie.halls = movie.halls.sort((a, b) => {
-        const aDistance = cosineDistanceBetweenPoints(lat, lng, a.lat, a.lng);
-        const bDistance = cosineDistanceBetweenPoints(lat, lng, b.lat, b.lng);
-        return aDistance - bDistance;
-      });
-    }
-
     movie.halls.forEach((hall) => {
       hall = setHall(hall);
       ol.appendChild(hall);
@@ -183,18 +159,32 @@ async function submit() {
   const ol = document.createElement("ol");
   ol.classList.add("movie");
 
-  console.log(json.movies);
-  json.movies.forEach((movie) => {
-    movie = setMovie(movie);
-    ol.appendChild(movie);
-  });
+  // Render the first page as soon as it arrives, then append the rest.
+  let cursor = null;
+  do {
+    let url = `/api?${query}&limit=${PAGE_SIZE}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+    console.log(url);
+    const response = await fetch(url);
+    const json = await response.json();
+    // A newer submission replaced this one while it was loading.
+    if (current !== submission) return;
+
+    json.movies.forEach((movie) => {
+      movie = setMovie(movie);
+      ol.appendChild(movie);
+    });
 
-  const output = document.querySelector("#output");
-  if (output.firstChild) {
-    output.replaceChild(ol, output.firstChild);
-  } else {
-    output.appendChild(ol);
-  }
+    const output = document.querySelector("#output");
+    if (output.firstChild !== ol) {
+      if (output.firstChild) {
+        output.replaceChild(ol, output.firstChild);
+      } else {
+        output.appendChild(ol);
+      }
+    }
+    cursor = json.next_cursor;
+  } while (cursor);
 }
 
 document.addEventListener("DOMContentLoaded", async () => {
@@ -295,7 +285,7 @@ document.addEventListener("DOMContentLoaded", async () => {
   ratingDiv.appendChild(criticsRating);
   ratingDiv.appendChild(critcsRatingOutput);
 
-  const inputs = document.querySelectorAll("input");
+  const inputs = document.querySelectorAll("input, select");
 
   inputs.forEach((input) => {
     input.addEventListener("change", submit);
@@ -1,26 +1,98 @@
 """Load data from Athinorama and IMDb."""
 
 import abc
+import asyncio
 import dataclasses
+import hashlib
+import itertools
 import logging
+import os
 from abc import ABC
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor
+from datetime import UTC, datetime
 from pathlib import PurePath
-from typing import ClassVar, Self
+from typing import Any, ClassVar, Self
 from urllib import parse
 
-from orm.models import BaseModel, Hall, Movie, MoviePlace
+from orm.connection import scoped_connection
+from orm.models import BaseModel, CrawlState, Hall, Movie, MoviePlace, database
+from orm.writer import BatchWriter
 
-from .bs4 import get_href, load_beautiful_soup
-from .foo import parse_datetimes
-from .imdb import get_movie, search_movie
-from .letterboxd import get_rating
-from .maps import get_lat_lng
+from . import imdb, metrics
+from .cache import afetch, fetch
+from .extract import get_href, get_text, has_class, parse_document, select, select_one
+from .foo import parse_all
+from .imdb import MovieInfo, Resolver
+from .letterboxd import aget_rating, get_ratings
+from .maps import get_lat_lng, get_lat_lngs
+from .pipeline import BatchStage, Pipeline, Stage
+from .session import AsyncSession
+
+IMDB_CONCURRENCY = 8
+STAGE_WORKERS = {
+    "fetch": 16,
+    "parse": os.cpu_count() or 2,
+    "resolve": IMDB_CONCURRENCY,
+    "enrich": 2,
+    "write": 2,
+}
+
+_LINKS = select("//a[starts-with(@href, $path)]")
+
+_REVIEW_TITLE = select(f"//*[{has_class("review-title")}]")
+_TITLE = select(".//h1")
+_ORIGINAL_TITLE = select(f".//*[{has_class("original-title")}]")
+_YEAR = select(f".//*[{has_class("year")}]")
+_CRITIC_RATINGS = select(f"//*[{has_class("critic")}]/div/span")
+_IMDB_LINK = select(f"//*[{has_class("imdb")}]")
+_EVENT_PLACES_LINK = select("//*[@id='eventPlacesLink']")
+
+_HALL_MAPS_LINK = select(f".//*[{has_class("infos-item")}]/nav/a")
+_HALL_OPEN_AIR = select(".//img[@src='/Content/images/summerRoom.png']")
+
+_PLACES_MOVIE_LINK = select(
+    f"//*[{has_class("item-image")} and {has_class("poster-image")}]/a"
+)
+_PLACES_ITEMS = select(f"//*[{has_class("item")} and {has_class("card-item")}]")
+_PLACES_HALL_LINK = select(f".//*[{has_class("item-title")}]/a")
+_PLACES_DATETIMES = select(f".//*[{has_class("inner")}]")
+
+
+def _record_flush(num_rows: int, seconds: float) -> None:
+    metrics.observe("db_write", seconds, table="batch")
+    metrics.count("db_rows_written", num_rows, table="batch")
 
 
 def _get_url_path(url: str) -> str:
     return parse.urlparse(url).path
 
 
+@dataclasses.dataclass(slots=True)
+class AsyncRun:
+    """Event loop state of an async load, created for each run on its loop."""
+
+    session: AsyncSession
+    imdb_semaphore: asyncio.Semaphore = dataclasses.field(
+        default_factory=lambda: asyncio.Semaphore(IMDB_CONCURRENCY)
+    )
+
+
+@dataclasses.dataclass(slots=True)
+class Job:
+    """Page of a loader on its way through the pipeline."""
+
+    loader: "Loader"
+    incremental: bool = False
+    body: bytes = b""
+    digest: str = ""
+    unchanged: bool = False
+    page: Any = None
+    info: MovieInfo | None = None
+    rating: tuple[float, int] = (0.0, 0)
+    children: list["Loader"] = dataclasses.field(default_factory=list)
+
+
 @dataclasses.dataclass(slots=True)
 class Loader(ABC):
     """Data loader."""
@@ -28,8 +100,11 @@ class Loader(ABC):
     BASE_URL = "https://www.athinorama.gr/cinema/"
     base_path: ClassVar[str]
     model = BaseModel
+    writer: ClassVar[BatchWriter] = BatchWriter(on_flush=_record_flush)
+    executor: ClassVar[Executor | None] = None
 
     name: str
+    parent: str | None = None
 
     @classmethod
     def _cls_url(cls) -> str:
@@ -41,57 +116,207 @@ class Loader(ABC):
         return parse.urljoin(self._cls_url(), self.name)
 
     @classmethod
-    def list(cls) -> list[Self]:
-        """List URLs."""
-        soup = load_beautiful_soup(cls.BASE_URL)
+    def _list(cls, body: bytes) -> list[Self]:
         path = _get_url_path(cls._cls_url())
-        anchors = soup.select(f"a[href^='{path}']")
+        anchors = _LINKS(parse_document(body), path=path)
         hrefs = {_get_url_path(get_href(anchor)) for anchor in anchors}
         return [cls(href) for href in hrefs]
 
+    @classmethod
+    async def alist(cls, run: AsyncRun) -> list[Self]:
+        """List URLs on the event loop."""
+        return cls._list(await afetch(cls.BASE_URL, run.session))
+
+    @staticmethod
     @abc.abstractmethod
-    def _load(self: Self) -> None:
+    def _parse(body: bytes) -> Any:  # noqa: ANN401
         pass
 
-    def load(self: Self) -> None:
-        """Load data."""
+    def _extract(self: Self, body: bytes) -> Any:  # noqa: ANN401
+        """Parse a page, in a worker process if there is an executor."""
+        with metrics.timed("parse", page=type(self).__name__):
+            if self.executor is None:
+                return self._parse(body)
+            return self.executor.submit(self._parse, body).result()
+
+    async def _aextract(self: Self, body: bytes) -> Any:  # noqa: ANN401
+        """Parse a page on the executor, or a thread if there is none."""
+        loop = asyncio.get_running_loop()
+        with metrics.timed("parse", page=type(self).__name__):
+            return await loop.run_in_executor(self.executor, self._parse, body)
+
+    @abc.abstractmethod
+    async def _aload(
+        self: Self, body: bytes, run: AsyncRun, *, incremental: bool
+    ) -> bool:
+        """Load a page on the event loop, returning whether it can be marked crawled."""
+
+    async def _aload_unchanged(self: Self, body: bytes, run: AsyncRun) -> None:  # noqa: B027
+        pass
+
+    def _get_unchanged_children(  # noqa: PLR6301
+        self: Self,
+        body: bytes,  # noqa: ARG002
+    ) -> list["Loader"]:
+        return []
+
+    @abc.abstractmethod
+    def _write_page(self: Self, job: Job) -> list["Loader"]:
+        pass
+
+    def _is_unchanged(self: Self, digest: str) -> bool:
+        with scoped_connection(database):
+            state = CrawlState.get_or_none(CrawlState.url == self.url)
+        return state is not None and state.digest == digest
+
+    def _set_crawled(self: Self, digest: str) -> None:
+        self.writer.add(
+            CrawlState,
+            {
+                "url": self.url,
+                "digest": digest,
+                "parent": self.parent,
+                "crawled_at": datetime.now(tz=UTC),
+            },
+            conflict_target=[CrawlState.url],
+        )
+
+    def _upsert(self: Self, **fields: Any) -> None:  # noqa: ANN401
+        self.writer.add(
+            self.model, {"url": self.url, **fields}, conflict_target=[self.model.url]
+        )
+
+    async def aload(self: Self, run: AsyncRun, *, incremental: bool = False) -> None:
+        """Load data on the event loop.
+
+        Database queries and writes, which may flush the writer, run in worker
+        threads so they do not stall the other loaders.
+        """
         logging.info("Loading %s", self.url)
-        self._load()
+        body = await afetch(self.url, run.session)
+        digest = hashlib.sha256(body).hexdigest()
+        if incremental and await asyncio.to_thread(self._is_unchanged, digest):
+            logging.info("Unchanged %s", self.url)
+            await self._aload_unchanged(body, run)
+            return
+        if not await self._aload(body, run, incremental=incremental):
+            logging.warning("Not marking %s as crawled, to retry it", self.url)
+            return
+        await asyncio.to_thread(self._set_crawled, digest)
         logging.info("Loaded %s", self.url)
 
+    def fetch_page(self: Self, job: Job) -> Job:
+        """Fetch the page of a job, noting whether it changed since the last crawl."""
+        logging.info("Loading %s", self.url)
+        job.body = fetch(self.url)
+        job.digest = hashlib.sha256(job.body).hexdigest()
+        job.unchanged = job.incremental and self._is_unchanged(job.digest)
+        return job
+
+    def parse_page(self: Self, job: Job) -> Job | None:
+        """Parse the page of a job, dropping it if it cannot be parsed."""
+        body, job.body = job.body, b""
+        if job.unchanged:
+            job.children = self._get_unchanged_children(body)
+            return job
+        job.page = self._extract(body)
+        return job if job.page is not None else None
+
+    def resolve_page(self: Self, job: Job) -> Job | None:  # noqa: PLR6301
+        """Match the page of a job to other sources."""
+        return job
+
+    @classmethod  # noqa: B027
+    def enrich_pages(cls, jobs: list[Job]) -> None:
+        """Add data from other sources to the pages of a batch of jobs."""
+
+    def write_page(self: Self, job: Job) -> list["Loader"]:
+        """Queue the rows of a job, returning the loaders of its subpages."""
+        if job.unchanged:
+            logging.info("Unchanged %s", self.url)
+            return job.children
+        children = self._write_page(job)
+        self._set_crawled(job.digest)
+        logging.info("Loaded %s", self.url)
+        return children
+
+    @classmethod
+    def _get_gone(cls, loaders: Iterable[Self]) -> list[str]:
+        urls = {loader.url for loader in loaders}
+        states = CrawlState.select(CrawlState.url).where(
+            CrawlState.url.startswith(cls._cls_url()) & CrawlState.parent.is_null()
+        )
+        return [state.url for state in states if state.url not in urls]
+
+    @classmethod
+    def prune(cls, loaders: Iterable[Self]) -> None:
+        """Delete the screenings of pages that are no longer listed."""
+        cls.writer.flush()
+        gone = cls._get_gone(loaders)
+        if not gone:
+            return
+        with database.atomic(), metrics.timed("db_write", table="prune"):
+            num_rows = cls._delete_screenings(gone)
+            CrawlState.delete().where(
+                CrawlState.url.in_(gone) | CrawlState.parent.in_(gone)
+            ).execute()
+        logging.info("Pruned %d pages and %d screenings", len(gone), num_rows)
+
+    @classmethod
+    def _delete_screenings(cls, urls: list[str]) -> int:  # noqa: ARG003
+        return 0
+
+    @classmethod
+    def list(cls) -> list[Self]:
+        """List URLs."""
+        return cls._list(fetch(cls.BASE_URL))
+
+
+@dataclasses.dataclass(slots=True)
+class MoviePage:
+    """Data scraped from an Athinorama movie page."""
+
+    titles: list[str]
+    year: int
+    critics_rating: float
+    critics_votes: int
+    imdb_id: str | None
+    places_path: str | None
+
 
 class MovieLoader(Loader):
     """Athinorama movie data loader."""
 
     base_path = "movie/"
     model = Movie
+    resolver: ClassVar[Resolver] = imdb
 
-    def _load(self: Self) -> None:
-        soup = load_beautiful_soup(self.url)
-
-        review_title = soup.select_one(".review-title")
+    @staticmethod
+    def _parse(body: bytes) -> MoviePage | None:
+        document = parse_document(body)
+        review_title = select_one(_REVIEW_TITLE, document)
         if review_title is None:
             logging.error("Review title not found")
-            return
-        title = review_title.select_one("h1")
+            return None
+        title = select_one(_TITLE, review_title)
         if title is None:
             logging.error("Title not found")
-            return
-        titles = [title.get_text(strip=True)]
-        if (original_title := review_title.select_one(".original-title")) is not None:
-            titles += original_title.get_text(strip=True).split("/")
-        _year = review_title.select_one(".year")
+            return None
+        titles = [get_text(title)]
+        if (original_title := select_one(_ORIGINAL_TITLE, review_title)) is not None:
+            titles += get_text(original_title).split("/")
+        _year = select_one(_YEAR, review_title)
         if _year is None:
             logging.error("Year not found")
-            return
-        __year = _year.get_text(strip=True) or None
+            return None
+        __year = get_text(_year) or None
         if __year is None:
             logging.error("Year not found")
-            return
+            return None
         year = int(__year)
 
-        spans = soup.select(".critic > div > span")
-        ratings = [float(span.get_text(strip=True).replace(",", ".")) for span in spans]
+        spans = _CRITIC_RATINGS(document)
+        ratings = [float(get_text(span).replace(",", ".")) for span in spans]
         critics_votes = 0
         critics_rating = 0.0
         if ratings:
@@ -99,21 +324,50 @@ class MovieLoader(Loader):
             if critics_votes:
                 critics_rating = sum(ratings) / critics_votes
 
-        imdb_movie_url = soup.select_one(".imdb")
+        imdb_id = None
+        imdb_movie_url = select_one(_IMDB_LINK, document)
         if imdb_movie_url is not None and (
-            imdb_id := PurePath(
+            _imdb_id := PurePath(
                 parse.urlparse(get_href(imdb_movie_url)).path
             ).name.strip()
         ).startswith("tt"):
-            info = get_movie(imdb_id.removeprefix("tt"), titles, year)
-        else:
-            info = search_movie(titles, year)
+            imdb_id = _imdb_id.removeprefix("tt")
+
+        places_path = None
+        event_places_link = select_one(_EVENT_PLACES_LINK, document)
+        if event_places_link is not None:
+            places_path = _get_url_path(get_href(event_places_link))
+
+        return MoviePage(
+            titles=titles,
+            year=year,
+            critics_rating=critics_rating,
+            critics_votes=critics_votes,
+            imdb_id=imdb_id,
+            places_path=places_path,
+        )
+
+    @classmethod
+    def _resolve(cls, page: MoviePage) -> MovieInfo | None:
+        with metrics.timed("resolve"):
+            if page.imdb_id is not None:
+                info = cls.resolver.get_movie(page.imdb_id, page.titles, page.year)
+            else:
+                info = cls.resolver.search_movie(page.titles, page.year)
+        metrics.count(
+            "resolutions", found=str(info is not None).lower(), source="athinorama"
+        )
         if info is None:
-            logging.error("Athinorama movie not found: %s", titles)
-            return
+            logging.error("Athinorama movie not found: %s", page.titles)
+        return info
 
-        imdb_id = info.imdb_url.split("/")[-2]
-        letterboxd_rating, letterboxd_votes = get_rating(imdb_id)
+    def _write(
+        self: Self,
+        page: MoviePage,
+        info: MovieInfo,
+        letterboxd_rating: float,
+        letterboxd_votes: int,
+    ) -> None:
         votes = info.imdb_votes + letterboxd_votes
         rating = 0.0
         if votes:
@@ -121,22 +375,94 @@ class MovieLoader(Loader):
                 info.imdb_rating * info.imdb_votes
                 + letterboxd_rating * 2 * letterboxd_votes
             ) / votes
-        self.model.create(
-            url=self.url,
+        self._upsert(
             title=info.title,
             original_title=info.original_title,
             rating=rating,
             votes=votes,
-            critics_rating=critics_rating,
-            critics_votes=critics_votes,
+            critics_rating=page.critics_rating,
+            critics_votes=page.critics_votes,
             imdb_url=info.imdb_url,
         )
-        event_places_link = soup.select_one("#eventPlacesLink")
-        if event_places_link is None:
+
+    async def _aload(
+        self: Self, body: bytes, run: AsyncRun, *, incremental: bool
+    ) -> bool:
+        page = await self._aextract(body)
+        if page is None:
+            return False
+        async with run.imdb_semaphore:
+            info = await asyncio.to_thread(self._resolve, page)
+        if info is None:
+            return False
+        rating = await aget_rating(info.imdb_id, run.session)
+        await asyncio.to_thread(self._write, page, info, *rating)
+        if page.places_path is None:
             logging.error("Event places link not found")
-            return
-        movie_places_url = _get_url_path(get_href(event_places_link))
-        MoviePlacesLoader(movie_places_url).load()
+            return True
+        await MoviePlacesLoader(page.places_path, parent=self.url).aload(
+            run, incremental=incremental
+        )
+        return True
+
+    def _get_places_loader(
+        self: Self, page: MoviePage | None
+    ) -> "MoviePlacesLoader | None":
+        if page is None or page.places_path is None:
+            return None
+        return MoviePlacesLoader(page.places_path, parent=self.url)
+
+    async def _aload_unchanged(self: Self, body: bytes, run: AsyncRun) -> None:
+        page = await self._aextract(body)
+        if (loader := self._get_places_loader(page)) is not None:
+            await loader.aload(run, incremental=True)
+
+    def _get_unchanged_children(self: Self, body: bytes) -> list[Loader]:
+        loader = self._get_places_loader(self._extract(body))
+        return [loader] if loader is not None else []
+
+    def resolve_page(self: Self, job: Job) -> Job | None:
+        """Match the page of a job to its IMDb movie."""
+        if job.unchanged:
+            return job
+        job.info = self._resolve(job.page)
+        return job if job.info is not None else None
+
+    @classmethod
+    def enrich_pages(cls, jobs: list[Job]) -> None:
+        """Add the Letterboxd ratings of the movies of a batch of jobs."""
+        resolved = [
+            (job, job.info)
+            for job in jobs
+            if not job.unchanged and job.info is not None
+        ]
+        ratings = get_ratings(info.imdb_id for _, info in resolved)
+        for job, info in resolved:
+            job.rating = ratings[info.imdb_id]
+
+    def _write_page(self: Self, job: Job) -> list[Loader]:
+        page: MoviePage = job.page
+        if job.info is None:
+            return []
+        self._write(page, job.info, *job.rating)
+        if page.places_path is None:
+            logging.error("Event places link not found")
+            return []
+        return [MoviePlacesLoader(page.places_path, parent=self.url)]
+
+    @classmethod
+    def _delete_screenings(cls, urls: list[str]) -> int:
+        return MoviePlace.delete().where(MoviePlace.movie.in_(urls)).execute()
+
+
+@dataclasses.dataclass(slots=True)
+class HallPage:
+    """Data scraped from an Athinorama hall page."""
+
+    name: str
+    lat: float
+    lng: float
+    open_air: bool
 
 
 @dataclasses.dataclass(slots=True)
@@ -146,33 +472,67 @@ class HallLoader(Loader):
     base_path = "halls/"
     model = Hall
 
-    def _load(self: Self) -> None:
-        soup = load_beautiful_soup(self.url)
-        tag = soup.select_one(".review-title")
+    @staticmethod
+    def _parse(body: bytes) -> HallPage | None:
+        tag = select_one(_REVIEW_TITLE, parse_document(body))
         if tag is None:
             logging.error("Hall not found")
-            return
-        name_ = tag.select_one("h1")
+            return None
+        name_ = select_one(_TITLE, tag)
         if name_ is None:
             logging.error("Hall name not found")
-            return
-        name = name_.get_text(strip=True)
-        maps = tag.select_one(".infos-item > nav > a")
+            return None
+        name = get_text(name_)
+        maps = select_one(_HALL_MAPS_LINK, tag)
         if maps is None:
             logging.error("Maps not found")
-            return
+            return None
         lat, lng = map(
             float,
             parse.parse_qs(parse.urlparse(get_href(maps)).query)["destination"][
                 0
             ].split(),
         )
-        if (lat, lng) == (0, 0):
-            lat, lng = get_lat_lng(name)
-        open_air = (
-            tag.select_one("img[src='/Content/images/summerRoom.png']") is not None
-        )
-        self.model.create(url=self.url, name=name, lat=lat, lng=lng, open_air=open_air)
+        open_air = select_one(_HALL_OPEN_AIR, tag) is not None
+        return HallPage(name=name, lat=lat, lng=lng, open_air=open_air)
+
+    def _write(self: Self, page: HallPage) -> None:
+        self._upsert(**dataclasses.asdict(page))
+
+    async def _aload(
+        self: Self,
+        body: bytes,
+        run: AsyncRun,  # noqa: ARG002
+        *,
+        incremental: bool,  # noqa: ARG002
+    ) -> bool:
+        page = await self._aextract(body)
+        if page is None:
+            return False
+        if (page.lat, page.lng) == (0, 0):
+            page.lat, page.lng = await asyncio.to_thread(get_lat_lng, page.name)
+        await asyncio.to_thread(self._write, page)
+        return True
+
+    @classmethod
+    def enrich_pages(cls, jobs: list[Job]) -> None:
+        """Geocode the halls of a batch of jobs whose pages have no coordinates."""
+        pages: list[HallPage] = [
+            job.page
+            for job in jobs
+            if job.page is not None and (job.page.lat, job.page.lng) == (0, 0)
+        ]
+        locations = get_lat_lngs(page.name for page in pages)
+        for page in pages:
+            page.lat, page.lng = locations[page.name]
+
+    def _write_page(self: Self, job: Job) -> list[Loader]:
+        self._write(job.page)
+        return []
+
+    @classmethod
+    def _delete_screenings(cls, urls: list[str]) -> int:
+        return MoviePlace.delete().where(MoviePlace.hall.in_(urls)).execute()
 
 
 @dataclasses.dataclass(slots=True)
@@ -182,31 +542,99 @@ class MoviePlacesLoader(Loader):
     base_path = "movie/places/"
     model = MoviePlace
 
-    def _load(self: Self) -> None:
-        beautiful_soup = load_beautiful_soup(self.url)
-        anchor = beautiful_soup.select_one(".item-image.poster-image > a")
+    @staticmethod
+    def _parse(body: bytes) -> tuple[str, list[dict[str, Any]]] | None:
+        document = parse_document(body)
+        anchor = select_one(_PLACES_MOVIE_LINK, document)
         if anchor is None:
             logging.error("Movie not found")
-            return
+            return None
         href = _get_url_path(get_href(anchor))
         movie = MovieLoader(href).url
-        items = beautiful_soup.select(".item.card-item")
-        for item in items:
-            anchor = item.select_one(".item-title > a")
+        halls = []
+        datetimess = []
+        for item in _PLACES_ITEMS(document):
+            anchor = select_one(_PLACES_HALL_LINK, item)
             if anchor is None:
                 logging.error("Hall not found")
                 continue
             href = _get_url_path(get_href(anchor))
             hall = HallLoader(href).url
-            datetimess = item.select(".inner")
-            for datetimes in datetimess:
-                datetimes_ = datetimes.get_text(separator=" ", strip=True)
-                for _datetime, dubbed in parse_datetimes(datetimes_):
-                    self.model.create(
-                        movie=movie,
-                        hall=hall,
-                        date=_datetime.date(),
-                        time=_datetime.time(),
-                        dubbed=dubbed,
-                        cinobo_pass=False,
-                    )
+            for datetimes in _PLACES_DATETIMES(item):
+                halls.append(hall)
+                datetimess.append(get_text(datetimes, separator=" "))
+        rows = [
+            {
+                "movie": movie,
+                "hall": hall,
+                "date": _datetime.date(),
+                "time": _datetime.time(),
+                "dubbed": dubbed,
+                "cinobo_pass": False,
+            }
+            for hall, datetimes in zip(halls, parse_all(datetimess), strict=True)
+            for _datetime, dubbed in datetimes
+        ]
+        return movie, rows
+
+    def _write(self: Self, parsed: tuple[str, list[dict[str, Any]]]) -> None:
+        movie, rows = parsed
+        self.writer.delete(self.model.delete().where(self.model.movie == movie))
+        for row in rows:
+            self.writer.add(self.model, row)
+
+    async def _aload(
+        self: Self,
+        body: bytes,
+        run: AsyncRun,  # noqa: ARG002
+        *,
+        incremental: bool,  # noqa: ARG002
+    ) -> bool:
+        if (parsed := await self._aextract(body)) is None:
+            return False
+        await asyncio.to_thread(self._write, parsed)
+        return True
+
+    def _write_page(self: Self, job: Job) -> list[Loader]:
+        self._write(job.page)
+        return []
+
+
+def _enrich_jobs(jobs: list[Job]) -> list[Job]:
+    batches: dict[type[Loader], list[Job]] = {}
+    for job in jobs:
+        batches.setdefault(type(job.loader), []).append(job)
+    for loader_cls, batch in batches.items():
+        loader_cls.enrich_pages(batch)
+    return jobs
+
+
+def get_pipeline(workers: dict[str, int] | None = None) -> Pipeline:
+    """Get the pipeline loading pages, with the given workers per stage.
+
+    Enrichment runs on batches of jobs, to look up their ratings and locations
+    together.
+    """
+    workers = {**STAGE_WORKERS, **(workers or {})}
+    stages: list[tuple[str, Callable[[Job], object]]] = [
+        ("fetch", lambda job: job.loader.fetch_page(job)),
+        ("parse", lambda job: job.loader.parse_page(job)),
+        ("resolve", lambda job: job.loader.resolve_page(job)),
+    ]
+    return Pipeline([
+        *(Stage(name, function, workers[name]) for name, function in stages),
+        BatchStage("enrich", _enrich_jobs, workers["enrich"]),
+        Stage("write", lambda job: job.loader.write_page(job), workers["write"]),
+    ])
+
+
+def load_all(
+    loaders: Iterable[Loader], pipeline: Pipeline, *, incremental: bool = False
+) -> None:
+    """Load pages through a pipeline, then the subpages they link to."""
+    loaders = list(loaders)
+    while loaders:
+        children = pipeline.run(
+            Job(loader, incremental=incremental) for loader in loaders
+        )
+        loaders = list(itertools.chain.from_iterable(children))
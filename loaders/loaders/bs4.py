@@ -2,18 +2,23 @@
 
 import logging
 
-import requests
 from bs4 import BeautifulSoup, Tag
 
-TIMEOUT = (3.05, 27)
+from . import metrics
+from .cache import fetch
+
 PARSER = "lxml"
 
 
+def parse_html(body: bytes) -> BeautifulSoup:
+    """Parse an HTML document into a BeautifulSoup object."""
+    with metrics.timed("parse", page="beautifulsoup"):
+        return BeautifulSoup(body, features=PARSER)
+
+
 def load_beautiful_soup(url: str) -> BeautifulSoup:
     """Load a URL and return a BeautifulSoup object."""
-    response = requests.get(url, timeout=TIMEOUT)
-    response.raise_for_status()
-    return BeautifulSoup(response.text, features=PARSER)
+    return parse_html(fetch(url))
 
 
 def get_href(tag: Tag) -> str:
@@ -0,0 +1,219 @@
+"""On-disk HTTP response cache with conditional revalidation."""
+
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import timedelta
+from http import HTTPStatus
+from pathlib import Path
+from typing import Self
+from urllib import parse
+
+from . import metrics
+from .session import SESSION, AsyncSession
+
+CACHE_DIR = Path(os.environ.get("LOADERS_CACHE_DIR", "~/.cache/loaders")).expanduser()
+DEFAULT_TTL = timedelta(hours=1)
+MAX_AGE = timedelta(days=30)
+TTLS = {
+    "www.athinorama.gr": timedelta(hours=1),
+    "letterboxd.com": timedelta(hours=12),
+    "cinobo.com": timedelta(hours=1),
+}
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        file.write(data)
+    Path(file.name).replace(path)
+
+
+def get_ttl(url: str) -> timedelta:
+    """Get the time to live of a URL's cache entry from its domain."""
+    return TTLS.get(parse.urlparse(url).hostname or "", DEFAULT_TTL)
+
+
+@dataclasses.dataclass(slots=True)
+class Entry:
+    """Cached response metadata, pointing to its body by content hash."""
+
+    url: str
+    digest: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+    def is_fresh(self: Self, ttl: timedelta) -> bool:
+        """Check whether the entry can be used without revalidation."""
+        return time.time() - self.fetched_at < ttl.total_seconds()
+
+    def conditional_headers(self: Self) -> dict[str, str]:
+        """Build the headers of a conditional request for the entry."""
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@dataclasses.dataclass(slots=True)
+class Cache:
+    """Response cache keyed by URL, storing bodies by content hash."""
+
+    path: Path = CACHE_DIR
+
+    def _entry_path(self: Self, url: str) -> Path:
+        return self.path / "entries" / f"{_sha256(url.encode())}.json"
+
+    def _body_path(self: Self, digest: str) -> Path:
+        return self.path / "bodies" / digest[:2] / digest
+
+    def get(self: Self, url: str) -> Entry | None:
+        """Get the entry of a URL, if it is cached."""
+        try:
+            entry = Entry(**json.loads(self._entry_path(url).read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError):
+            logging.warning("Corrupt cache entry for %s", url)
+            return None
+        if not self._body_path(entry.digest).exists():
+            return None
+        return entry
+
+    def read(self: Self, entry: Entry) -> bytes:
+        """Read the body of an entry."""
+        return self._body_path(entry.digest).read_bytes()
+
+    def put(
+        self: Self,
+        url: str,
+        body: bytes,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> Entry:
+        """Store a response body and its validators."""
+        entry = Entry(
+            url=url,
+            digest=_sha256(body),
+            etag=etag,
+            last_modified=last_modified,
+            fetched_at=time.time(),
+        )
+        body_path = self._body_path(entry.digest)
+        if not body_path.exists():
+            _write_atomic(body_path, body)
+        self._write(entry)
+        return entry
+
+    def touch(self: Self, entry: Entry) -> Entry:
+        """Mark an entry as revalidated now."""
+        entry = dataclasses.replace(entry, fetched_at=time.time())
+        self._write(entry)
+        return entry
+
+    def _write(self: Self, entry: Entry) -> None:
+        _write_atomic(
+            self._entry_path(entry.url), json.dumps(dataclasses.asdict(entry)).encode()
+        )
+
+    def collect(self: Self, max_age: timedelta = MAX_AGE) -> tuple[int, int]:
+        """Delete stale entries and unreferenced bodies, returning how many.
+
+        Entries not fetched or revalidated within `max_age` are deleted, then
+        the bodies no entry points to, such as those of refetched pages. Files
+        written since the collection started are kept, so running it alongside
+        fetches at worst makes a page be fetched again.
+        """
+        started_at = time.time()
+        digests = set()
+        num_entries = 0
+        for path in self.path.glob("entries/*.json"):
+            try:
+                entry = Entry(**json.loads(path.read_bytes()))
+            except (ValueError, TypeError):
+                entry = None
+            except FileNotFoundError:
+                continue
+            if entry is not None and entry.is_fresh(max_age):
+                digests.add(entry.digest)
+            elif path.stat().st_mtime < started_at:
+                path.unlink(missing_ok=True)
+                num_entries += 1
+        num_bodies = 0
+        for path in self.path.glob("bodies/*/*"):
+            if path.name not in digests and path.stat().st_mtime < started_at:
+                path.unlink(missing_ok=True)
+                num_bodies += 1
+        logging.info(
+            "Collected %d cache entries and %d bodies", num_entries, num_bodies
+        )
+        return num_entries, num_bodies
+
+
+CACHE = Cache()
+
+
+def _count(url: str, result: str) -> None:
+    metrics.count("http_cache", host=parse.urlparse(url).hostname or "", result=result)
+
+
+def fetch(url: str, cache: Cache = CACHE) -> bytes:
+    """Fetch a URL, revalidating or reusing its cached body when possible."""
+    entry = cache.get(url)
+    if entry is not None and entry.is_fresh(get_ttl(url)):
+        logging.debug("Cache hit %s", url)
+        _count(url, "hit")
+        return cache.read(entry)
+    headers = entry.conditional_headers() if entry is not None else {}
+    response = SESSION.get(url, headers=headers)
+    if entry is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+        logging.debug("Cache revalidated %s", url)
+        _count(url, "revalidated")
+        return cache.read(cache.touch(entry))
+    response.raise_for_status()
+    _count(url, "miss")
+    cache.put(
+        url,
+        response.content,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    return response.content
+
+
+async def afetch(url: str, session: AsyncSession, cache: Cache = CACHE) -> bytes:
+    """Fetch a URL on the event loop, like `fetch`, with disk IO in threads."""
+    entry = await asyncio.to_thread(cache.get, url)
+    if entry is not None and entry.is_fresh(get_ttl(url)):
+        logging.debug("Cache hit %s", url)
+        _count(url, "hit")
+        return await asyncio.to_thread(cache.read, entry)
+    headers = entry.conditional_headers() if entry is not None else {}
+    response = await session.get(url, headers=headers)
+    if entry is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+        logging.debug("Cache revalidated %s", url)
+        _count(url, "revalidated")
+        entry = await asyncio.to_thread(cache.touch, entry)
+        return await asyncio.to_thread(cache.read, entry)
+    response.raise_for_status()
+    _count(url, "miss")
+    await asyncio.to_thread(
+        cache.put,
+        url,
+        response.content,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    return response.content
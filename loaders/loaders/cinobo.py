@@ -1,16 +1,24 @@
 import logging
 import re
 from concurrent.futures import ThreadPoolExecutor
-from datetime import UTC, datetime, time, timedelta
+from datetime import UTC, date, datetime, time, timedelta
 
-from bs4 import BeautifulSoup
-from geopy import distance
+from bs4 import BeautifulSoup, Tag
+from peewee import Tuple
 
-from orm.models import Hall, Movie, MoviePlace
+from orm.connection import scoped_connection
+from orm.geo import GridIndex
+from orm.models import Hall, Movie, MoviePlace, database
 
+from . import metrics
 from .bs4 import load_beautiful_soup
-from .imdb import search_movie
-from .maps import get_lat_lng
+from .imdb import MAX_EDIT_DISTANCE, search_movie
+from .maps import get_lat_lngs
+from .titles import TitleIndex
+
+MAX_HALL_DISTANCE = 1.0
+
+type Showtime = tuple[str, str, date, time]
 
 today = datetime.now(tz=UTC).date()
 days_ = (today.weekday() - 3) % 7
@@ -51,57 +59,84 @@ def get_titles(soup: BeautifulSoup) -> dict[str, tuple[list[str], int]]:
     return titles
 
 
-def update_movie_place(
-    movie: Movie, hall: str, location: tuple[float, float], date: datetime, time: time
-) -> None:
-    halls = Hall.select()
-    _halls = sorted(
-        halls, key=lambda hall: distance.distance((hall.lat, hall.lng), location)
-    )
-    for hall_ in _halls:
-        num_rows = (
-            MoviePlace.update({MoviePlace.cinobo_pass: True})
+def get_candidates(halls: GridIndex[str], lat: float, lng: float) -> list[str]:
+    """Get the URLs of the halls that may be at a location, nearest first."""
+    candidates = [url for url, _ in halls.within(lat, lng, MAX_HALL_DISTANCE)]
+    if not candidates and (nearest := halls.nearest(lat, lng)) is not None:
+        candidates.append(nearest[0])
+    return candidates
+
+
+def update_movie_places(
+    showtimes: list[Showtime], candidates: dict[str, list[str]]
+) -> int:
+    """Mark the screenings of the Cinobo pass, returning how many were marked.
+
+    The screenings of every showtime are fetched with one join and matched to
+    the nearest of their hall's candidates, then marked with one update.
+    """
+    urls = {url for urls in candidates.values() for url in urls}
+    rows = {
+        (imdb_url, hall, day, time_): movie
+        for movie, imdb_url, hall, day, time_ in (
+            MoviePlace.select(
+                MoviePlace.movie,
+                Movie.imdb_url,
+                MoviePlace.hall,
+                MoviePlace.date,
+                MoviePlace.time,
+            )
+            .join(Movie)
             .where(
-                MoviePlace.movie == movie.url,
-                MoviePlace.hall == hall_.url,
-                MoviePlace.date == date,
-                MoviePlace.time == time,
+                Movie.imdb_url.in_({showtime[0] for showtime in showtimes})
+                & MoviePlace.hall.in_(urls)
+                & MoviePlace.date.in_({showtime[2] for showtime in showtimes})
             )
-            .execute()
+            .tuples()
         )
-        if num_rows == 1:
-            logging.info(
-                "Updated %s at %s on %s %s", movie.title, hall_.name, date, time
+    }
+    keys = set()
+    for imdb_url, hall, day, time_ in showtimes:
+        for url in candidates.get(hall, []):
+            if (movie := rows.get((imdb_url, url, day, time_))) is not None:
+                keys.add((movie, url, day, time_))
+                break
+        else:
+            logging.error(
+                "No hall found for %s at %s on %s %s", imdb_url, hall, day, time_
             )
-            break
-    else:
-        logging.error(
-            "No hall found for %s at %s on %s %s", movie.title, hall, date, time
+    with database.atomic(), metrics.timed("db_write", table="movieplace"):
+        MoviePlace.update({MoviePlace.cinobo_pass: False}).where(
+            MoviePlace.cinobo_pass
+        ).execute()
+        if not keys:
+            return 0
+        return (
+            MoviePlace.update({MoviePlace.cinobo_pass: True})
+            .where(
+                Tuple(
+                    MoviePlace.movie, MoviePlace.hall, MoviePlace.date, MoviePlace.time
+                ).in_(sorted(keys))
+            )
+            .execute()
         )
 
 
-def main() -> None:
-    """Get data from Cinobo."""
-    soup = load_beautiful_soup("https://cinobo.com/cinobo-pass")
+def _search_movie(titles: list[str], year: int | None = None) -> str | None:
+    with scoped_connection(database):
+        info = search_movie(titles, year)
+    metrics.count("resolutions", found=str(info is not None).lower(), source="cinobo")
+    return info.imdb_url if info is not None else None
 
-    titles = get_titles(soup)
 
-    table = soup.select_one("#program + table")
-    if table is None:
-        logging.error("Program table not found")
-        return
-    ths = table.select("th")
-    titless = [titles.get(th.text, [[th.text]]) for th in ths[1:]]
-    with ThreadPoolExecutor() as executor:
-        movies = list(
-            executor.map(
-                lambda titles_: info.imdb_url
-                if (info := search_movie(*titles_)) is not None
-                else None,
-                titless,
-            )
-        )
-    trs = table.select("tbody > tr")
+def _get_showtimes(
+    trs: list[Tag], movies: list[str | None]
+) -> tuple[list[Showtime], list[int]]:
+    """Get the showtimes of the Athens halls of the program table.
+
+    The columns of the movies that were not found are skipped and returned.
+    """
+    showtimes: list[Showtime] = []
     skipped = []
     for tr in trs:
         tds = tr.select("td")
@@ -110,21 +145,46 @@ def main() -> None:
         if city != "Αθήνα":
             continue
         hall = divs[0].text
-        location = get_lat_lng(hall)
         for i, td in enumerate(tds[1:]):
             divs = td.select("div > div")
             if not divs:
                 continue
-            if movies[i] is None:
-                skipped.append(titless[i][0])
+            if (movie := movies[i]) is None:
+                skipped.append(i)
                 continue
             dates = expand_days(divs[0].text)
-            time = datetime.strptime(divs[1].text, "%H:%M").astimezone().time()
-            for date in dates:
-                try:
-                    movie = Movie.get(Movie.imdb_url == movies[i])
-                    update_movie_place(movie, hall, location, date, time)
-                except Exception:
-                    logging.exception("")
-    for title_ in skipped:
-        logging.error("Cinobo movie not found: %s", title_)
+            time_ = datetime.strptime(divs[1].text, "%H:%M").astimezone().time()
+            showtimes.extend((movie, hall, day, time_) for day in dates)
+    return showtimes, skipped
+
+
+def main() -> None:
+    """Get data from Cinobo."""
+    soup = load_beautiful_soup("https://cinobo.com/cinobo-pass")
+
+    with metrics.timed("extract", page="cinobo"):
+        titles = TitleIndex.from_titles(get_titles(soup).items())
+
+    table = soup.select_one("#program + table")
+    if table is None:
+        logging.error("Program table not found")
+        return
+    ths = table.select("th")
+    titless = [
+        match[0]
+        if (match := titles.nearest(th.text, MAX_EDIT_DISTANCE - 1)) is not None
+        else ([th.text],)
+        for th in ths[1:]
+    ]
+    with ThreadPoolExecutor() as executor:
+        movies = list(executor.map(lambda titles_: _search_movie(*titles_), titless))
+    showtimes, skipped = _get_showtimes(table.select("tbody > tr"), movies)
+    for i in skipped:
+        logging.error("Cinobo movie not found: %s", titless[i][0])
+    locations = get_lat_lngs(showtime[1] for showtime in showtimes)
+    halls = GridIndex.from_points(Hall.select(Hall.url, Hall.lat, Hall.lng).tuples())
+    candidates = {
+        hall: get_candidates(halls, *location) for hall, location in locations.items()
+    }
+    num_rows = update_movie_places(showtimes, candidates)
+    logging.info("Marked %d of %d Cinobo pass showtimes", num_rows, len(showtimes))
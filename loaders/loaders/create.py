@@ -1,50 +1,203 @@
 """Load data from Athinorama and IMDb."""
 
+import argparse
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import os
+from contextlib import ExitStack
+from pathlib import Path
 
-from orm.models import Hall, Movie, MoviePlace, User, WantToWatch, Watched, database
+from orm.models import (
+    CrawlState,
+    DataVersion,
+    Geocode,
+    Hall,
+    ImdbResolution,
+    LetterboxdFilm,
+    LetterboxdList,
+    LetterboxdRating,
+    ListEntry,
+    Movie,
+    MoviePlace,
+    MovieStatus,
+    Screening,
+    User,
+    WantToWatch,
+    Watched,
+    database,
+)
 
-from .athinorama import HallLoader, MovieLoader
+from . import imdb, metrics
+from .athinorama import (
+    STAGE_WORKERS,
+    AsyncRun,
+    HallLoader,
+    Loader,
+    MovieLoader,
+    get_pipeline,
+    load_all,
+)
+from .cache import CACHE
 from .cinobo import main
-from .letterboxd import letterboxd
+from .extract import get_executor
+from .imdb_dataset import Index
+from .letterboxd import USER, letterboxd
+from .scheduler import run_bounded
+from .session import AsyncSession, log_stats
+
+CONCURRENCY = 64
+LOADERS: tuple[type[Loader], ...] = (HallLoader, MovieLoader)
 
 logging.basicConfig(level=logging.INFO)
 
 
+async def aload(concurrency: int, *, incremental: bool) -> None:
+    """Load halls and movies on the event loop."""
+    async with AsyncSession() as session:
+        run = AsyncRun(session)
+        for loader_cls in LOADERS:
+            loaders = await loader_cls.alist(run)
+            await run_bounded(
+                lambda loader: loader.aload(run, incremental=incremental),
+                loaders,
+                concurrency,
+            )
+            loader_cls.prune(loaders)
+
+
+def load(workers: dict[str, int], *, incremental: bool) -> None:
+    """Load halls and movies through a staged pipeline of worker threads."""
+    pipeline = get_pipeline(workers)
+    for loader_cls in LOADERS:
+        loaders = loader_cls.list()
+        load_all(loaders, pipeline, incremental=incremental)
+        loader_cls.prune(loaders)
+    pipeline.log_stats()
+
+
+def _parse_workers(value: str) -> tuple[str, int]:
+    stage, _, workers = value.partition("=")
+    if stage not in STAGE_WORKERS or not workers.isdigit() or not int(workers):
+        msg = f"expected STAGE=N with STAGE one of {", ".join(STAGE_WORKERS)}"
+        raise argparse.ArgumentTypeError(msg)
+    return stage, int(workers)
+
+
 if __name__ == "__main__":
-    database.create_tables([Hall, Movie, MoviePlace, User, WantToWatch, Watched])
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--async",
+        action="store_true",
+        dest="use_async",
+        help="fetch pages concurrently on an event loop instead of threads",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help="maximum number of pages loaded at once in async mode",
+    )
+    parser.add_argument(
+        "--workers",
+        type=_parse_workers,
+        action="append",
+        default=[],
+        metavar="STAGE=N",
+        help="number of threads of a pipeline stage (repeatable)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes parsing pages, 0 to parse them on the loader threads",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only reload pages that changed since the last run",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="recreate the screening view, after its query or fields changed",
+    )
+    parser.add_argument(
+        "--user",
+        action="append",
+        help=f"sync the lists of this Letterboxd user (repeatable), {USER} by default",
+    )
+    parser.add_argument(
+        "--imdb-index",
+        type=Path,
+        help="resolve IMDb movies from this dataset index, falling back to IMDb",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        help="write the timers and counters of the run to this OpenMetrics file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        help="sample the stacks of every thread of the run and dump them to this"
+        " file as collapsed stacks, for flame graphs",
+    )
+    args = parser.parse_args()
+
+    if args.imdb_index is not None:
+        MovieLoader.resolver = Index(args.imdb_index, fallback=imdb)
+
+    database.create_tables([
+        CrawlState,
+        DataVersion,
+        Geocode,
+        Hall,
+        ImdbResolution,
+        LetterboxdFilm,
+        LetterboxdList,
+        LetterboxdRating,
+        ListEntry,
+        Movie,
+        MoviePlace,
+        MovieStatus,
+        User,
+        WantToWatch,
+        Watched,
+    ])
+    Screening.create_view(replace=args.migrate)
 
     logging.info("Updating data")
 
-    for loader_cls in (HallLoader, MovieLoader):
-        loaders = loader_cls.list()
-        with ThreadPoolExecutor() as executor:
-            executor.map(lambda loader: loader.load(), loaders)
-
-    # main()
-
-    user = User.create(letterboxd_id="alexiszam")
-
-    letterboxd_queries = [
-        (list_name, imdb_id)
-        for list_name, imdb_ids in letterboxd()
-        for imdb_id in imdb_ids
-    ]
-
-    def safe_execute(t: tuple[str, str]) -> None:
-        list_name, imdb_id = t
-        movie = Movie.get_or_none(Movie.imdb_url == imdb_id)
-        if movie is None:
-            return
-        model = Watched if list_name == "films" else WantToWatch
-        model.create(user=user, movie=movie)
-        if list_name == "films":
-            logging.info("Watched %s", imdb_id)
-        else:
-            logging.info("Want to watch %s", imdb_id)
-
-    with ThreadPoolExecutor() as executor:
-        executor.map(safe_execute, letterboxd_queries)
+    with metrics.profiled(args.profile):
+        with metrics.timed("step", step="cache"):
+            CACHE.collect()
+
+        with ExitStack() as stack, metrics.timed("step", step="athinorama"):
+            if args.processes:
+                Loader.executor = stack.enter_context(get_executor(args.processes))
+            if args.use_async:
+                asyncio.run(aload(args.concurrency, incremental=args.incremental))
+            else:
+                load(dict(args.workers), incremental=args.incremental)
+
+        with metrics.timed("step", step="cinobo"):
+            try:
+                main()
+            except Exception:
+                logging.exception("Could not sync the Cinobo pass")
+
+        with metrics.timed("step", step="letterboxd"):
+            for letterboxd_id in args.user or [USER]:
+                User.get_or_create(letterboxd_id=letterboxd_id)
+            letterboxd([user.letterboxd_id for user in User.select()])
+
+        with metrics.timed("step", step="refresh"):
+            Screening.refresh()
+            logging.info("Bumped data version to %d", DataVersion.bump())
+
+    log_stats()
+    metrics.log_summary()
+    if args.metrics is not None:
+        args.metrics.write_text(metrics.to_openmetrics(), encoding="utf-8")
 
     logging.info("Updated data")
@@ -0,0 +1,63 @@
+"""Extract data from HTML with lxml and precompiled XPath selectors.
+
+Page parsers take the raw bytes of a page and return plain data, so they can
+run in worker processes and spread parsing across cores.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree, html  # noqa: S410
+
+type Selector = etree.XPath
+
+_EMPTY = b"<html></html>"
+
+
+def select(expression: str) -> Selector:
+    """Compile an XPath expression once, to be run on many documents."""
+    return etree.XPath(expression)
+
+
+def has_class(name: str) -> str:
+    """Get an XPath predicate matching elements with a CSS class."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def parse_document(body: bytes) -> html.HtmlElement:
+    """Parse an HTML document, empty if there is nothing to parse."""
+    try:
+        return html.document_fromstring(body.decode(errors="replace"))
+    except etree.ParserError:
+        return html.document_fromstring(_EMPTY)
+
+
+def select_one(
+    selector: Selector, element: html.HtmlElement, **variables: str
+) -> html.HtmlElement | None:
+    """Get the first element matched by a selector."""
+    elements = selector(element, **variables)
+    return elements[0] if elements else None
+
+
+def get_text(element: html.HtmlElement, separator: str = "") -> str:
+    """Get the stripped text of an element, like BeautifulSoup's `get_text`."""
+    return separator.join(
+        text for string in element.itertext() if (text := string.strip())
+    )
+
+
+def get_href(element: html.HtmlElement) -> str:
+    """Get the href of an element, raising `KeyError` if it has none."""
+    return element.attrib["href"]
+
+
+def get_executor(processes: int | None = None) -> ProcessPoolExecutor:
+    """Get a pool of processes to parse pages on.
+
+    Workers are started from a fork server, so they do not inherit the threads
+    and connections of the crawler.
+    """
+    return ProcessPoolExecutor(
+        processes, mp_context=multiprocessing.get_context("forkserver")
+    )
@@ -2,7 +2,9 @@
 
 import logging
 import re
-from datetime import UTC, datetime, timedelta
+from collections.abc import Iterable
+from datetime import UTC, datetime, time, timedelta
+from functools import cache, lru_cache
 
 DAYS_LIST = ["Πέμ.", "Παρ.", "Σάβ.", "Κυρ.", "Δευτ.", "Τρ.", "Τετ."]  # noqa: RUF001
 
@@ -25,42 +27,88 @@ today = datetime.now(tz=UTC).date()
 days = (today.weekday() - 3) % 7
 last_thursday = today - timedelta(days=days)
 
+CACHE_SIZE = 4096
+
+_ANNOTATED_DAYTIMES = re.compile(ANNOTATED_DAYTIMES)
+_DAYTIME = re.compile(f"({DAYS}) ({TIMES})")
+_DAY = re.compile(f"({DAY_SEP})?({DAY})")
+_TIME = re.compile(TIME)
+_DAY_INDEX = {day: i for i, day in enumerate(DAYS_LIST)}
+_DATES = [last_thursday + timedelta(days=i) for i in range(len(DAYS_LIST))]
+
+
+@cache
+def _parse_time(t: str) -> time:
+    return datetime.strptime(t, "%H.%M").astimezone().time()
+
+
+def _get_offset(day: str) -> int:
+    if (offset := _DAY_INDEX.get(day)) is None:
+        msg = f"Unknown day {day!r}"
+        raise ValueError(msg)
+    return offset
+
+
+def _expand_days(days: str) -> list[int]:
+    """Get the offsets from Thursday of some days, with ranges expanded."""
+    offsets = []
+    previous = None
+    for day_sep, day in _DAY.findall(days):
+        if day_sep == "-":
+            if previous is None:
+                logging.error("Malformed day range")
+                continue
+            offset = _get_offset(day)
+            offsets.extend(range(previous + 1, offset))
+        else:
+            offset = _get_offset(day)
+        offsets.append(offset)
+        previous = offset
+    return offsets
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(datetimes: str) -> tuple[tuple[datetime, bool], ...]:
+    _datetimes: list[tuple[datetime, bool]] = []
+    for match in _ANNOTATED_DAYTIMES.finditer(datetimes):
+        dts, sub = match.groups()
+        dubbed = sub == "μεταγλ."
+        for days, times in _DAYTIME.findall(dts):
+            times_ = [_parse_time(t) for t in _TIME.findall(times)]
+            _datetimes.extend(
+                (datetime.combine(_DATES[offset], t), dubbed)
+                for offset in _expand_days(days)
+                for t in times_
+            )
+    return tuple(_datetimes)
+
 
 def parse_datetimes(datetimes: str) -> list[tuple[datetime, bool]]:
-    """Parse datetimes from a string."""
-    datetimes = " ".join(datetimes.replace(": ", "").split())
-    _datetimes = []
-    for dts, sub in re.findall(ANNOTATED_DAYTIMES, datetimes):
-        for days, times in re.findall(f"({DAYS}) ({TIMES})", dts):
-            _days = []
-            _day = None
-            for day_sep, day in re.findall(f"({DAY_SEP})?({DAY})", days):
-                if day_sep == "-":
-                    if _day is None:
-                        logging.error("Malformed day range")
-                        continue
-                    for i in range(DAYS_LIST.index(_day) + 1, DAYS_LIST.index(day)):
-                        _days.append(DAYS_LIST[i])
-                    _days.append(day)
-                else:
-                    _days.append(day)
-                _day = day
-            for day in _days:
-                for t in re.findall(f"{TIME}", times):
-                    offset = DAYS_LIST.index(day)
-                    d = last_thursday + timedelta(days=offset)
-                    t_ = datetime.strptime(t, "%H.%M").astimezone()
-                    dt = datetime.combine(d, t_.time())
-                    dubbed = sub == "μεταγλ."
-                    _datetimes.append((dt, dubbed))
-    return _datetimes
+    """Parse datetimes from a string.
+
+    The patterns are compiled once and the results of a string are cached,
+    since the same schedules repeat across the halls and pages of a run.
+    """
+    return list(_parse(" ".join(datetimes.replace(": ", "").split())))
+
+
+def parse_all(datetimess: Iterable[str]) -> list[list[tuple[datetime, bool]]]:
+    """Parse the datetimes of many strings, such as all the blocks of a page."""
+    return [parse_datetimes(datetimes) for datetimes in datetimess]
 
 
 if __name__ == "__main__":
+    import timeit
+
     datetimes = (
         "Σάβ.-Κυρ. 15.15/ 17.30/ 19.50, "  # noqa: RUF001
         "Δευτ. 13.00/ 15.15/ 17.30/ 19.50 μεταγλ., "
         "Πέμ.-Τετ. 22.10 με υπότιτλους"
     )
-    for dt, dub in parse_datetimes(datetimes):
-        logging.debug(dt, dub)
+    logging.basicConfig(level=logging.INFO)
+    for name, stmt in (
+        ("uncached", lambda: _parse.__wrapped__(datetimes)),
+        ("cached", lambda: parse_datetimes(datetimes)),
+    ):
+        number, total = timeit.Timer(stmt).autorange()
+        logging.info("%s: %.2f us per string", name, total / number * 1e6)
@@ -1,13 +1,28 @@
+import argparse
 import dataclasses
 import logging
-import string
+import operator
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import UTC, datetime, timedelta
+from typing import Protocol
 
 from imdb import Cinemagoer, IMDbDataAccessError, Movie
-from nltk.metrics import distance as d
+from peewee import Expression
+
+from orm.connection import scoped_connection
+from orm.models import ImdbResolution, database
+
+from . import metrics
+from .titles import TitleIndex, normalize
 
 MAX_EDIT_DISTANCE = 3
 MAX_YEAR_DIFFERENCE = 3
+TOP_K = 3
+_TITLE_SEPARATOR = "|"
+
+POSITIVE_TTL = timedelta(days=7)
+NEGATIVE_TTL = timedelta(days=1)
 
 logging.getLogger("imdbpy").disabled = True
 
@@ -20,11 +35,21 @@ class MovieInfo:
     imdb_votes: int
     imdb_url: str
 
+    @property
+    def imdb_id(self) -> str:
+        return self.imdb_url.split("/")[-2]
 
-def _normalize(s: str) -> str:
-    return " ".join(
-        s.lower().translate(str.maketrans("", "", string.punctuation)).split()
-    )
+
+class Resolver(Protocol):
+    """Resolves Athinorama movies to IMDb, like this module does live."""
+
+    def get_movie(
+        self, imdb_id: str, titles: list[str], year: int
+    ) -> MovieInfo | None: ...
+
+    def search_movie(
+        self, titles: list[str], year: int | None = None
+    ) -> MovieInfo | None: ...
 
 
 def get_movie_info(movie: Movie) -> MovieInfo:
@@ -50,79 +75,204 @@ def _get_movie(imdb_id: str, titles: list[str], year: int) -> MovieInfo | None:
     movie = cinemagoer.get_movie(imdb_id)
     info = get_movie_info(movie)
     if titles is not None and year is not None:
-        _titles = [_normalize(t) for t in titles]
+        _titles = [normalize(t) for t in titles]
         imdb_titles = [info.title] + (
             [info.original_title] if info.original_title else []
         )
-        _imdb_titles = [_normalize(t) for t in imdb_titles]
+        _imdb_titles = [normalize(t) for t in imdb_titles]
         if not (any(t for t in _imdb_titles if t in _titles)):
             logging.warning("Mismatched titles: %s %s", imdb_titles, titles)
             return search_movie(titles, year)
     return get_movie_info(movie)
 
 
+def _get_cache_key(titles: list[str], year: int | None, imdb_id: str | None) -> str:
+    return f"{imdb_id or ""}|{_join_titles(titles)}|{year or ""}"
+
+
+def _join_titles(titles: list[str]) -> str:
+    return _TITLE_SEPARATOR.join(sorted({normalize(t) for t in titles}))
+
+
+def _has_title(title: str) -> Expression:
+    """Match the resolutions with a title among their joined titles.
+
+    Normalized titles have no punctuation, so they never contain the separator
+    or LIKE wildcards.
+    """
+    title = normalize(title)
+    titles = ImdbResolution.titles
+    return (
+        (titles == title)
+        | titles.startswith(f"{title}{_TITLE_SEPARATOR}")
+        | titles.endswith(f"{_TITLE_SEPARATOR}{title}")
+        | titles.contains(f"{_TITLE_SEPARATOR}{title}{_TITLE_SEPARATOR}")
+    )
+
+
+def _get_cached(key: str) -> tuple[bool, MovieInfo | None]:
+    # Resolving runs on worker threads, so connections are only held for the
+    # cache queries, not the requests and retries in between.
+    with scoped_connection(database):
+        resolution = ImdbResolution.get_or_none(ImdbResolution.key == key)
+    if resolution is None:
+        return False, None
+    ttl = NEGATIVE_TTL if resolution.imdb_url is None else POSITIVE_TTL
+    if datetime.now(tz=UTC) - resolution.resolved_at.replace(tzinfo=UTC) > ttl:
+        return False, None
+    if resolution.imdb_url is None:
+        return True, None
+    return True, MovieInfo(
+        title=resolution.title,
+        original_title=resolution.original_title,
+        imdb_rating=float(resolution.imdb_rating),
+        imdb_votes=resolution.imdb_votes,
+        imdb_url=resolution.imdb_url,
+    )
+
+
+def _set_cached(
+    key: str, titles: list[str], year: int | None, info: MovieInfo | None
+) -> None:
+    fields = dataclasses.asdict(info) if info is not None else {}
+    with scoped_connection(database), metrics.timed("db_write", table="imdbresolution"):
+        ImdbResolution.insert(
+            key=key,
+            titles=_join_titles(titles),
+            year=year,
+            resolved_at=datetime.now(tz=UTC).replace(tzinfo=None),
+            **fields,
+        ).on_conflict(
+            conflict_target=[ImdbResolution.key],
+            preserve=[
+                ImdbResolution.title,
+                ImdbResolution.original_title,
+                ImdbResolution.imdb_rating,
+                ImdbResolution.imdb_votes,
+                ImdbResolution.imdb_url,
+                ImdbResolution.resolved_at,
+            ],
+        ).execute()
+
+
+def invalidate(
+    title: str | None = None,
+    year: int | None = None,
+    imdb_url: str | None = None,
+    *,
+    negative: bool = False,
+) -> int:
+    """Delete cached resolutions, returning how many were deleted."""
+    query = ImdbResolution.delete()
+    if title is not None:
+        query = query.where(_has_title(title))
+    if year is not None:
+        query = query.where(ImdbResolution.year == year)
+    if imdb_url is not None:
+        query = query.where(ImdbResolution.imdb_url == imdb_url)
+    if negative:
+        query = query.where(ImdbResolution.imdb_url.is_null())
+    return query.execute()
+
+
 def get_movie(imdb_id: str, titles: list[str], year: int) -> MovieInfo | None:
+    key = _get_cache_key(titles, year, imdb_id)
+    hit, info = _get_cached(key)
+    if hit:
+        metrics.count("imdb_cache_hits", call="get_movie")
+        return info
     while True:
+        metrics.count("imdb_attempts", call="get_movie")
         try:
-            return _get_movie(imdb_id, titles, year)
+            with metrics.timed("imdb_request", call="get_movie"):
+                info = _get_movie(imdb_id, titles, year)
         except IMDbDataAccessError:
             logging.warning("503, retrying in 60 seconds")
-            time.sleep(60)
+            with metrics.timed("imdb_sleep", call="get_movie"):
+                time.sleep(60)
         except Exception:
             logging.exception(imdb_id, titles, year)
             return None
+        else:
+            _set_cached(key, titles, year, info)
+            return info
+
+
+def _get_imdb_titles(movie: Movie) -> list[str]:
+    akas = set(movie.get("akas", []) + movie.get("akas from release info", []))
+    greek_titles = ["(".join(aka.split("(")[:-1]) for aka in akas if "Greece" in aka]
+    return [movie.get("original title"), movie.get("localized title"), *greek_titles]
+
+
+def _rank_candidates(
+    results: list[Movie], titles: TitleIndex[str], year: int | None
+) -> list[tuple[Movie, int]]:
+    """Pick the search results worth fetching in full, best first.
+
+    Results outside the year window can never match, so they are dropped. The
+    rest are ranked by the edit distance of their search title, then by year
+    difference and search position, and only the top `TOP_K` are kept along
+    with their year difference.
+    """
+    candidates = []
+    for position, result in enumerate(results):
+        year_difference = 0
+        if year is not None:
+            _year = result.get("year")
+            if _year is None:
+                logging.warning("No year found for %s", result)
+                continue
+            year_difference = abs(int(_year) - year)
+            if year_difference >= MAX_YEAR_DIFFERENCE:
+                continue
+        match = titles.nearest(result.get("title", ""))
+        edit_distance = match[1] if match is not None else 0
+        candidates.append(((edit_distance, year_difference, position), result))
+    candidates.sort(key=operator.itemgetter(0))
+    return [(result, rank[1]) for rank, result in candidates[:TOP_K]]
+
+
+def _fetch_movie(imdb_id: str) -> Movie:
+    return Cinemagoer(timeout=10).get_movie(imdb_id)
+
+
+def _match(movie: Movie, titles: TitleIndex[str], year_difference: int) -> int | None:
+    """Get the distance of a movie to the titles, 0 if exact, None if too far."""
+    edit_distances = [
+        match[1]
+        for t in _get_imdb_titles(movie)
+        if t and (match := titles.nearest(t, MAX_EDIT_DISTANCE - 1)) is not None
+    ]
+    if not edit_distances:
+        return None
+    return min(edit_distances) ** 2 + year_difference**2
 
 
 def _search_movie(titles: list[str], year: int | None = None) -> MovieInfo | None:
     cinemagoer = Cinemagoer(timeout=10)
-    _titles = [_normalize(t) for t in titles]
+    _titles = TitleIndex.from_titles((t, t) for t in titles)
+    best_movie = None
+    best_distance = 99999
     for t in titles:
-        best_movie = None
-        best_distance = 99999
-        movies = cinemagoer.search_movie(t)
-        for _movie in movies:
-            if year is not None:
-                _year = _movie.get("year")
-                if _year is None:
-                    logging.warning("No year found for %s", _movie)
-                    continue
-                _year = int(_year)
-            imdb_id = _movie.movieID
-            movie = cinemagoer.get_movie(imdb_id)
-            _original_tile = movie.get("original title")
-            _title = movie.get("localized title")
-            akas = set(movie.get("akas", []) + movie.get("akas from release info", []))
-            greek_titles = [
-                "(".join(aka.split("(")[:-1]) for aka in akas if "Greece" in aka
-            ]
-            _greek_titles = [_normalize(t) for t in greek_titles]
-            if (
-                _normalize(_original_tile) in _titles
-                or _normalize(_title) in _titles
-                or any(t for t in _greek_titles if t in _titles)
-            ) and (year is None or _year == year):
-                return get_movie_info(movie)
-            min_edit_distance = 99999
-            _best_movie = None
-            for __title in _titles:
-                for _imdb_title in (
-                    _normalize(_original_tile),
-                    _normalize(_title),
-                    *_greek_titles,
-                ):
-                    edit_distance = d.edit_distance(__title, _imdb_title)
-                    if edit_distance < min_edit_distance:
-                        min_edit_distance = edit_distance
-                        _best_movie = movie
-            year_difference = 0 if year is None else abs(_year - year)
-            distance = min_edit_distance ^ 2 + year_difference ^ 2
-            if (
-                min_edit_distance < MAX_EDIT_DISTANCE
-                and year_difference < MAX_YEAR_DIFFERENCE
-                and distance < best_distance
-            ):
-                best_distance = min_edit_distance
-                best_movie = _best_movie
+        candidates = _rank_candidates(cinemagoer.search_movie(t), _titles, year)
+        if not candidates:
+            continue
+        executor = ThreadPoolExecutor(len(candidates))
+        try:
+            futures = {
+                executor.submit(_fetch_movie, candidate.movieID): year_difference
+                for candidate, year_difference in candidates
+            }
+            for future in as_completed(futures):
+                movie = future.result()
+                distance = _match(movie, _titles, futures[future])
+                if distance == 0:
+                    return get_movie_info(movie)
+                if distance is not None and distance < best_distance:
+                    best_distance = distance
+                    best_movie = movie
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
     if best_movie is not None:
         logging.warning(
             "Could not find exact match for %s (%s) but found %s",
@@ -131,17 +281,41 @@ def _search_movie(titles: list[str], year: int | None = None) -> MovieInfo | Non
             best_movie.get("localized title"),
         )
         return get_movie_info(best_movie)
-    # logging.error("IMDb URL not found for %s %s", titles, year)
     return None
 
 
 def search_movie(titles: list[str], year: int | None = None) -> MovieInfo | None:
+    key = _get_cache_key(titles, year, None)
+    hit, info = _get_cached(key)
+    if hit:
+        metrics.count("imdb_cache_hits", call="search_movie")
+        return info
     while True:
+        metrics.count("imdb_attempts", call="search_movie")
         try:
-            return _search_movie(titles, year)
+            with metrics.timed("imdb_request", call="search_movie"):
+                info = _search_movie(titles, year)
         except IMDbDataAccessError:
             logging.warning("503, retrying in 60 seconds")
-            time.sleep(60)
+            with metrics.timed("imdb_sleep", call="search_movie"):
+                time.sleep(60)
         except Exception:
             logging.exception(titles, year)
             return None
+        else:
+            _set_cached(key, titles, year, info)
+            return info
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invalidate cached IMDb resolutions.")
+    parser.add_argument("--title", help="delete resolutions of this title")
+    parser.add_argument("--year", type=int, help="delete resolutions of this year")
+    parser.add_argument("--imdb-url", help="delete resolutions to this IMDb URL")
+    parser.add_argument(
+        "--negative", action="store_true", help="only delete failed resolutions"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    num_rows = invalidate(args.title, args.year, args.imdb_url, negative=args.negative)
+    logging.info("Invalidated %d IMDb resolutions", num_rows)
@@ -0,0 +1,261 @@
+"""Resolve IMDb movies from a local index of the IMDb datasets.
+
+The index is built from the `title.basics`, `title.akas` and `title.ratings`
+TSV dumps of https://datasets.imdbws.com/ into an SQLite file, keyed by
+normalized title, and answers the same queries as the live resolver.
+"""
+
+import argparse
+import csv
+import dataclasses
+import gzip
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, Self
+
+from .cache import CACHE_DIR
+from .imdb import MAX_YEAR_DIFFERENCE, MovieInfo, Resolver
+from .titles import normalize
+
+INDEX_PATH = Path(os.environ.get("IMDB_INDEX_PATH", CACHE_DIR / "imdb.sqlite3"))
+TITLE_TYPES = frozenset({
+    "movie",
+    "short",
+    "tvMiniSeries",
+    "tvMovie",
+    "tvSpecial",
+    "video",
+})
+AKA_REGIONS = frozenset({"GR"})
+NULL = r"\N"
+
+_SCHEMA = """
+CREATE TABLE titles (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    original_title TEXT,
+    year INTEGER,
+    rating REAL NOT NULL DEFAULT 0,
+    votes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE names (
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (name, id)
+) WITHOUT ROWID;
+"""
+
+
+def _open(path: Path) -> IO[str]:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return path.open(encoding="utf-8", newline="")
+
+
+def _read_tsv(directory: Path, name: str) -> Iterator[dict[str, str | None]]:
+    """Read the rows of a dataset, gzipped or not, with `\\N` as None."""
+    path = directory / f"{name}.tsv.gz"
+    if not path.exists():
+        path = directory / f"{name}.tsv"
+    with _open(path) as file:
+        for row in csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE):
+            yield {key: None if value == NULL else value for key, value in row.items()}
+
+
+def _get_required(row: dict[str, str | None], *keys: str) -> tuple[str, ...] | None:
+    """Get the values of fields of a row, or None if any of them is null."""
+    values = tuple(value for key in keys if (value := row[key]) is not None)
+    return values if len(values) == len(keys) else None
+
+
+def _get_id(tconst: str) -> int:
+    return int(tconst.removeprefix("tt"))
+
+
+def _get_ratings(directory: Path) -> Iterator[tuple[float, int, int]]:
+    for row in _read_tsv(directory, "title.ratings"):
+        values = _get_required(row, "averageRating", "numVotes", "tconst")
+        if values is not None:
+            rating, votes, tconst = values
+            yield float(rating), int(votes), _get_id(tconst)
+
+
+def build(directory: Path, path: Path = INDEX_PATH) -> None:
+    """Build the index from the datasets in a directory, replacing it atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        temp_path = Path(file.name)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.executescript(_SCHEMA)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        for row in _read_tsv(directory, "title.basics"):
+            values = _get_required(row, "tconst", "primaryTitle")
+            if row["titleType"] not in TITLE_TYPES or values is None:
+                continue
+            id_, title = _get_id(values[0]), values[1]
+            original_title = row["originalTitle"]
+            connection.execute(
+                "INSERT INTO titles (id, title, original_title, year)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    id_,
+                    title,
+                    original_title if original_title != title else None,
+                    row["startYear"] and int(row["startYear"]),
+                ),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO names (name, id) VALUES (?, ?)",
+                [(normalize(t), id_) for t in (title, original_title) if t],
+            )
+        for row in _read_tsv(directory, "title.akas"):
+            values = _get_required(row, "titleId", "title")
+            if values is None or not (
+                row["region"] in AKA_REGIONS or row["isOriginalTitle"] == "1"
+            ):
+                continue
+            id_ = _get_id(values[0])
+            connection.execute(
+                "INSERT OR IGNORE INTO names (name, id)"
+                " SELECT ?, id FROM titles WHERE id = ?",
+                (normalize(values[1]), id_),
+            )
+        connection.executemany(
+            "UPDATE titles SET rating = ?, votes = ? WHERE id = ?",
+            _get_ratings(directory),
+        )
+        connection.commit()
+        (num_titles,) = connection.execute("SELECT count(*) FROM titles").fetchone()
+        (num_names,) = connection.execute("SELECT count(*) FROM names").fetchone()
+        logging.info("Indexed %d titles under %d names", num_titles, num_names)
+    finally:
+        connection.close()
+    temp_path.replace(path)
+
+
+def refresh_ratings(directory: Path, path: Path = INDEX_PATH) -> None:
+    """Update the ratings and votes of the index from `title.ratings`."""
+    with sqlite3.connect(path) as connection:
+        cursor = connection.executemany(
+            "UPDATE titles SET rating = ?, votes = ? WHERE id = ?",
+            _get_ratings(directory),
+        )
+        logging.info("Refreshed the ratings of %d titles", cursor.rowcount)
+
+
+@dataclasses.dataclass(slots=True)
+class Index:
+    """IMDb resolver reading the local index, optionally falling back."""
+
+    path: Path = INDEX_PATH
+    fallback: Resolver | None = None
+    _local: threading.local = dataclasses.field(
+        init=False, default_factory=threading.local
+    )
+
+    @property
+    def _connection(self: Self) -> sqlite3.Connection:
+        """Get this thread's read-only connection to the index."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(
+                f"{self.path.resolve().as_uri()}?mode=ro", uri=True
+            )
+        return connection
+
+    def _get_info(self: Self, id_: int) -> MovieInfo | None:
+        row = self._connection.execute(
+            "SELECT title, original_title, rating, votes FROM titles WHERE id = ?",
+            (id_,),
+        ).fetchone()
+        if row is None:
+            return None
+        title, original_title, rating, votes = row
+        return MovieInfo(
+            title=title,
+            original_title=original_title,
+            imdb_rating=rating,
+            imdb_votes=votes,
+            imdb_url=f"http://www.imdb.com/title/tt{id_:07d}/",
+        )
+
+    def _search(self: Self, titles: list[str], year: int | None) -> MovieInfo | None:
+        query = (
+            "SELECT titles.id, titles.year FROM names JOIN titles USING (id)"
+            " WHERE names.name = ?"
+        )
+        params: tuple[int, ...] = ()
+        if year is not None:
+            query += " AND titles.year > ? AND titles.year < ?"
+            params = (year - MAX_YEAR_DIFFERENCE, year + MAX_YEAR_DIFFERENCE)
+        query += " ORDER BY titles.votes DESC"
+        best = None
+        for title in titles:
+            for id_, _year in self._connection.execute(query, (title, *params)):
+                year_difference = abs(_year - year) if year is not None else 0
+                if best is None or year_difference < best[1]:
+                    best = id_, year_difference
+        if best is None:
+            return None
+        if best[1]:
+            logging.warning(
+                "Could not find exact match for %s (%s) but found tt%07d",
+                titles,
+                year,
+                best[0],
+            )
+        return self._get_info(best[0])
+
+    def _has_name(self: Self, id_: int, titles: list[str]) -> bool:
+        placeholders = ", ".join("?" * len(titles))
+        query = f"SELECT 1 FROM names WHERE id = ? AND name IN ({placeholders})"  # noqa: S608
+        return self._connection.execute(query, (id_, *titles)).fetchone() is not None
+
+    def get_movie(
+        self: Self, imdb_id: str, titles: list[str], year: int
+    ) -> MovieInfo | None:
+        """Get a movie by IMDb id, searching instead if its titles do not match."""
+        _titles = [normalize(t) for t in titles]
+        id_ = int(imdb_id)
+        info = self._get_info(id_)
+        if info is not None and not self._has_name(id_, _titles):
+            logging.warning("Mismatched titles: %s %s", info.title, titles)
+            info = None
+        if info is None:
+            info = self._search(_titles, year)
+        if info is None and self.fallback is not None:
+            return self.fallback.get_movie(imdb_id, titles, year)
+        return info
+
+    def search_movie(
+        self: Self, titles: list[str], year: int | None = None
+    ) -> MovieInfo | None:
+        """Search a movie by its titles and year."""
+        info = self._search([normalize(t) for t in titles], year)
+        if info is None and self.fallback is not None:
+            return self.fallback.search_movie(titles, year)
+        return info
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the IMDb dataset index.")
+    parser.add_argument("directory", type=Path, help="directory of the TSV datasets")
+    parser.add_argument("--path", type=Path, default=INDEX_PATH, help="index file")
+    parser.add_argument(
+        "--ratings-only",
+        action="store_true",
+        help="only refresh the ratings and votes of an existing index",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.ratings_only:
+        refresh_ratings(args.directory, args.path)
+    else:
+        build(args.directory, args.path)
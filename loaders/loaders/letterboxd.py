@@ -1,81 +1,368 @@
+import asyncio
+import hashlib
 import json
 import logging
+import os
+import re
+from collections.abc import Iterable, Iterator
 from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
 from urllib import parse
-from xml.etree import ElementTree
 
-from .bs4 import get_href, load_beautiful_soup
+from lxml.html import HtmlElement
+
+from orm.connection import scoped_connection
+from orm.models import (
+    LetterboxdFilm,
+    LetterboxdList,
+    LetterboxdRating,
+    ListEntry,
+    Movie,
+    MovieStatus,
+    WantToWatch,
+    Watched,
+    database,
+)
+
+from . import metrics
+from .cache import afetch, fetch
+from .extract import get_href, parse_document, select, select_one
+from .session import AsyncSession
 
 USER = "alexiszam"
-LIST_TYPES = ["films", "watchlist"]
+LISTS = {"films": Watched, "watchlist": WantToWatch}
+USER_CONCURRENCY = 4
+FILM_CONCURRENCY = 8
+FILM_NEGATIVE_TTL = timedelta(days=1)
+FULL_SYNC_INTERVAL = timedelta(days=1)
+RATING_CONCURRENCY = 8
+RATING_MAX_AGE = timedelta(
+    hours=float(os.environ.get("LETTERBOXD_RATING_MAX_AGE_HOURS", "72"))
+)
 
 BASE_URL = "https://letterboxd.com/"
 
+_IMDB_LINK = select("//a[starts-with(@href, 'http://www.imdb.com/title/tt')]")
+_PAGE_LINKS = select("//li//a[starts-with(@href, $prefix)]")
+_FILMS = select("//li//div[starts-with(@data-target-link, '/film/')]")
+# The JSON-LD of a film page, inside a CDATA section commented out for scripts.
+_LINKED_DATA = re.compile(
+    rb'<script type="application/ld\+json">.*?(\{.*?\})\s*'
+    rb"(?:/\*.*?\*/\s*)?</script>",
+    re.DOTALL,
+)
+
+
+def _parse_document(body: bytes, page: str) -> HtmlElement:
+    with metrics.timed("parse", page=page):
+        return parse_document(body)
+
 
 def get_imdb_id(url: str) -> str | None:
-    soup = load_beautiful_soup(url)
-    anchor = soup.select_one("a[href^='http://www.imdb.com/title/tt']")
-    if not anchor:
+    anchor = select_one(_IMDB_LINK, _parse_document(fetch(url), "letterboxd_film"))
+    if anchor is None:
         logging.error("IMDb anchor not found in %s", url)
         return None
     return "/".join(get_href(anchor).split("/")[:-1]) + "/"
 
 
-def get_num_pages(user: str, list_name: str) -> int:
-    user_url = parse.urljoin(BASE_URL, f"{user}/")
-    url = parse.urljoin(user_url, f"{list_name}/")
-    soup = load_beautiful_soup(url)
-    anchors = soup.select(f"li a[href^='/{user}/{list_name}/page/']")
+def _get_list_url(user: str, list_name: str, page: int = 1) -> str:
+    url = parse.urljoin(BASE_URL, f"{user}/{list_name}/")
+    return parse.urljoin(url, f"page/{page}/") if page > 1 else url
+
+
+def _get_num_pages(document: HtmlElement, user: str, list_name: str) -> int:
+    anchors = _PAGE_LINKS(document, prefix=f"/{user}/{list_name}/page/")
     if not anchors:
         return 1
-    return int(anchors[-1].text)
+    return int(anchors[-1].text_content())
 
 
-def get_films_paginated(user: str, list_name: str, page: int) -> list[str]:
-    user_url = parse.urljoin(BASE_URL, f"{user}/")
-    url = parse.urljoin(parse.urljoin(user_url, f"{list_name}/page/"), str(page))
-    soup = load_beautiful_soup(url)
-    divs = soup.select("li div[data-target-link^='/film/']")
-    return [parse.urljoin(BASE_URL, str(div["data-target-link"])) for div in divs]
+def _get_film_url(slug: str) -> str:
+    return parse.urljoin(BASE_URL, f"film/{slug}/")
 
 
-def get_films(user: str, list_name: str) -> list[str]:
-    num_pages = get_num_pages(user, list_name)
-    with ThreadPoolExecutor() as executor:
-        filmss = executor.map(
-            lambda page: get_films_paginated(user, list_name, page),
-            range(1, num_pages + 1),
-        )
-        return [film for films in filmss for film in films]
+def _get_slugs(document: HtmlElement) -> list[str]:
+    # Film links look like /film/<slug>/.
+    return [div.get("data-target-link").split("/")[2] for div in _FILMS(document)]
+
+
+def get_slugs_paginated(user: str, list_name: str, page: int) -> list[str]:
+    body = fetch(_get_list_url(user, list_name, page))
+    return _get_slugs(_parse_document(body, "letterboxd_list"))
+
 
+def _iter_slugs(
+    user: str, list_name: str, slugs: list[str], num_pages: int
+) -> Iterator[list[str]]:
+    """Yield the film slugs of a list page by page, from those of its first page."""
+    yield slugs
+    for page in range(2, num_pages + 1):
+        yield get_slugs_paginated(user, list_name, page)
 
-def get_list(user: str, list_name: str) -> list[str | None]:
-    urls = get_films(user, list_name)
-    with ThreadPoolExecutor() as executor:
-        return list(executor.map(get_imdb_id, urls))
 
+def get_imdb_urls(slugs: list[str]) -> list[str]:
+    """Get the IMDb URLs of Letterboxd films, only fetching the pages of new ones.
 
-def letterboxd() -> list[tuple[str, list[str | None]]]:
-    with ThreadPoolExecutor() as executor:
-        imdb_ids = executor.map(lambda list_name: get_list(USER, list_name), LIST_TYPES)
-    return list(zip(LIST_TYPES, imdb_ids, strict=True))
+    Films stored without an IMDb URL, e.g. from an error page, are fetched again
+    once they are older than `FILM_NEGATIVE_TTL`.
+    """
+    fetched_after = datetime.now(tz=UTC).replace(tzinfo=None) - FILM_NEGATIVE_TTL
+    with scoped_connection(database):
+        imdb_urls = dict(
+            LetterboxdFilm.select(LetterboxdFilm.slug, LetterboxdFilm.imdb_url)
+            .where(
+                LetterboxdFilm.slug.in_(slugs)
+                & (
+                    LetterboxdFilm.imdb_url.is_null(is_null=False)
+                    | (LetterboxdFilm.fetched_at > fetched_after)
+                )
+            )
+            .tuples()
+        )
+    missing = [slug for slug in dict.fromkeys(slugs) if slug not in imdb_urls]
+    metrics.count("letterboxd_films", len(imdb_urls), source="stored")
+    metrics.count("letterboxd_films", len(missing), source="fetched")
+    if missing:
+        with ThreadPoolExecutor(FILM_CONCURRENCY) as executor:
+            fetched = dict(
+                zip(
+                    missing,
+                    executor.map(get_imdb_id, map(_get_film_url, missing)),
+                    strict=True,
+                )
+            )
+        fetched_at = datetime.now(tz=UTC).replace(tzinfo=None)
+        with (
+            scoped_connection(database),
+            metrics.timed("db_write", table="letterboxdfilm"),
+        ):
+            LetterboxdFilm.insert_many([
+                {"slug": slug, "imdb_url": imdb_url, "fetched_at": fetched_at}
+                for slug, imdb_url in fetched.items()
+            ]).on_conflict(
+                conflict_target=[LetterboxdFilm.slug],
+                preserve=[LetterboxdFilm.imdb_url, LetterboxdFilm.fetched_at],
+            ).execute()
+        imdb_urls |= fetched
+    return [imdb_url for slug in slugs if (imdb_url := imdb_urls[slug])]
+
+
+def _get_digest(num_pages: int, slugs: list[str]) -> str:
+    films = [_get_film_url(slug) for slug in slugs]
+    return hashlib.sha256("\n".join([str(num_pages), *films]).encode()).hexdigest()
 
 
-def parse_with_stdlib(text: str) -> str:
+def _is_unchanged(user: str, list_name: str, num_pages: int, digest: str) -> bool:
+    state = LetterboxdList.get_or_none(
+        (LetterboxdList.user == user) & (LetterboxdList.name == list_name)
+    )
     return (
-        next(ElementTree.fromstring(text).iter("script"))
-        .text.strip()
-        .strip("/*  */")
-        .strip()
+        state is not None
+        and state.num_pages == num_pages
+        and state.digest == digest
+        and datetime.now(tz=UTC) - state.synced_at.replace(tzinfo=UTC)
+        < FULL_SYNC_INTERVAL
     )
 
 
-def get_rating(imdb_id: str) -> tuple[float, int]:
-    url = parse.urljoin(BASE_URL, f"imdb/{imdb_id}")
-    soup = load_beautiful_soup(url)
-    script = str(soup.select_one("script[type='application/ld+json']"))
-    if script is None:
+def sync_list(user: str, list_name: str) -> bool:
+    """Store the IMDb URLs of a user's list, unless its first page is unchanged.
+
+    A list whose page count and first page are as of its last sync is skipped,
+    so a run only fetches the lists that had films added or removed at the top.
+    Every list is still refetched in full once per `FULL_SYNC_INTERVAL`.
+
+    The list is read one page at a time, and only the pages of films not seen
+    in any list before are fetched to find their IMDb URLs.
+    """
+    document = _parse_document(fetch(_get_list_url(user, list_name)), "letterboxd_list")
+    num_pages = _get_num_pages(document, user, list_name)
+    slugs = _get_slugs(document)
+    digest = _get_digest(num_pages, slugs)
+    with scoped_connection(database):
+        unchanged = _is_unchanged(user, list_name, num_pages, digest)
+    if unchanged:
+        logging.info("Skipped unchanged %s of %s", list_name, user)
+        return False
+    imdb_urls: set[str] = set()
+    for page_slugs in _iter_slugs(user, list_name, slugs, num_pages):
+        imdb_urls.update(get_imdb_urls(page_slugs))
+    with (
+        scoped_connection(database),
+        database.atomic(),
+        metrics.timed("db_write", table="listentry"),
+    ):
+        ListEntry.delete().where(
+            (ListEntry.user == user) & (ListEntry.list_name == list_name)
+        ).execute()
+        ListEntry.insert_many([
+            {"user": user, "list_name": list_name, "imdb_url": imdb_url}
+            for imdb_url in imdb_urls
+        ]).execute()
+        LetterboxdList.insert(
+            user=user,
+            name=list_name,
+            num_pages=num_pages,
+            digest=digest,
+            synced_at=datetime.now(tz=UTC).replace(tzinfo=None),
+        ).on_conflict(
+            conflict_target=[LetterboxdList.user, LetterboxdList.name],
+            preserve=[
+                LetterboxdList.num_pages,
+                LetterboxdList.digest,
+                LetterboxdList.synced_at,
+            ],
+        ).execute()
+    logging.info("Synced %d films of %s of %s", len(imdb_urls), list_name, user)
+    return True
+
+
+def link(user: str) -> None:
+    """Link a user's lists to the movies being screened, and their statuses."""
+    with database.atomic():
+        for list_name, model in LISTS.items():
+            model.delete().where(model.user == user).execute()
+            model.insert_from(
+                ListEntry.select(ListEntry.user, ListEntry.imdb_url)
+                .join(Movie, on=ListEntry.imdb_url == Movie.imdb_url)
+                .where((ListEntry.user == user) & (ListEntry.list_name == list_name)),
+                [model.user, model.movie],
+            ).execute()
+        MovieStatus.sync(user)
+
+
+def letterboxd(users: list[str]) -> None:
+    """Sync the lists of many users concurrently, then link them to movies."""
+    with ThreadPoolExecutor(USER_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(sync_list, user, list_name): (user, list_name)
+            for user in users
+            for list_name in LISTS
+        }
+    for future, (user, list_name) in futures.items():
+        if (exception := future.exception()) is not None:
+            logging.error(
+                "Failed to sync %s of %s", list_name, user, exc_info=exception
+            )
+    for user in users:
+        link(user)
+
+
+def _get_rating_url(imdb_id: str) -> str:
+    return parse.urljoin(BASE_URL, f"imdb/{imdb_id}")
+
+
+def _parse_rating(body: bytes, url: str) -> tuple[float, int]:
+    match = _LINKED_DATA.search(body)
+    if match is None:
+        logging.warning("Letterboxd rating not found in %s", url)
+        return 0, 0
+    aggregate_rating = json.loads(match[1]).get("aggregateRating")
+    if aggregate_rating is None:
         logging.warning("Letterboxd rating not found in %s", url)
         return 0, 0
-    aggregate_rating = json.loads(parse_with_stdlib(script))["aggregateRating"]
     return float(aggregate_rating["ratingValue"]), int(aggregate_rating["ratingCount"])
+
+
+def _get_cached_ratings(imdb_ids: Iterable[str]) -> dict[str, tuple[float, int]]:
+    """Get the ratings fetched within `RATING_MAX_AGE`."""
+    fetched_after = datetime.now(tz=UTC).replace(tzinfo=None) - RATING_MAX_AGE
+    with scoped_connection(database):
+        return {
+            imdb_id: (float(rating), votes)
+            for imdb_id, rating, votes in LetterboxdRating.select(
+                LetterboxdRating.imdb_id,
+                LetterboxdRating.rating,
+                LetterboxdRating.votes,
+            )
+            .where(
+                LetterboxdRating.imdb_id.in_(list(imdb_ids))
+                & (LetterboxdRating.fetched_at > fetched_after)
+            )
+            .tuples()
+        }
+
+
+def _set_cached_ratings(ratings: dict[str, tuple[float, int]]) -> None:
+    if not ratings:
+        return
+    fetched_at = datetime.now(tz=UTC).replace(tzinfo=None)
+    with (
+        scoped_connection(database),
+        metrics.timed("db_write", table="letterboxdrating"),
+    ):
+        LetterboxdRating.insert_many([
+            {
+                "imdb_id": imdb_id,
+                "rating": rating,
+                "votes": votes,
+                "fetched_at": fetched_at,
+            }
+            for imdb_id, (rating, votes) in ratings.items()
+        ]).on_conflict(
+            conflict_target=[LetterboxdRating.imdb_id],
+            preserve=[
+                LetterboxdRating.rating,
+                LetterboxdRating.votes,
+                LetterboxdRating.fetched_at,
+            ],
+        ).execute()
+
+
+def _fetch_rating(imdb_id: str) -> tuple[float, int] | None:
+    url = _get_rating_url(imdb_id)
+    try:
+        body = fetch(url)
+        with metrics.timed("parse", page="letterboxd_rating"):
+            return _parse_rating(body, url)
+    except Exception:
+        logging.exception("Failed to get the Letterboxd rating of %s", imdb_id)
+        return None
+
+
+def get_ratings(imdb_ids: Iterable[str]) -> dict[str, tuple[float, int]]:
+    """Get the Letterboxd ratings of many IMDb movies.
+
+    Ratings fetched within `RATING_MAX_AGE` are reused, and the others are
+    fetched `RATING_CONCURRENCY` at a time. Movies whose rating could not be
+    fetched get no votes and are retried on the next call.
+    """
+    imdb_ids = list(dict.fromkeys(imdb_ids))
+    if not imdb_ids:
+        return {}
+    ratings = _get_cached_ratings(imdb_ids)
+    missing = [imdb_id for imdb_id in imdb_ids if imdb_id not in ratings]
+    metrics.count("letterboxd_ratings", len(ratings), source="stored")
+    metrics.count("letterboxd_ratings", len(missing), source="fetched")
+    with ThreadPoolExecutor(RATING_CONCURRENCY) as executor:
+        fetched = {
+            imdb_id: rating
+            for imdb_id, rating in zip(
+                missing, executor.map(_fetch_rating, missing), strict=True
+            )
+            if rating is not None
+        }
+    _set_cached_ratings(fetched)
+    ratings |= fetched
+    return {imdb_id: ratings.get(imdb_id, (0, 0)) for imdb_id in imdb_ids}
+
+
+def get_rating(imdb_id: str) -> tuple[float, int]:
+    return get_ratings([imdb_id])[imdb_id]
+
+
+async def aget_rating(imdb_id: str, session: AsyncSession) -> tuple[float, int]:
+    cached = await asyncio.to_thread(_get_cached_ratings, [imdb_id])
+    if (rating := cached.get(imdb_id)) is not None:
+        return rating
+    url = _get_rating_url(imdb_id)
+    try:
+        body = await afetch(url, session)
+        with metrics.timed("parse", page="letterboxd_rating"):
+            rating = _parse_rating(body, url)
+    except Exception:
+        logging.exception("Failed to get the Letterboxd rating of %s", imdb_id)
+        return 0, 0
+    await asyncio.to_thread(_set_cached_ratings, {imdb_id: rating})
+    return rating
@@ -1,14 +1,143 @@
+"""Geocode addresses, caching their coordinates in the database."""
+
+import logging
+import threading
+from collections.abc import Iterable, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import UTC, datetime
+from functools import cache, partial
 from pathlib import Path
 
 from googlemaps import Client
 
-key = Path("/etc/secrets/maps-api-key").read_text(encoding="utf-8").strip()
+from orm.connection import scoped_connection
+from orm.models import Geocode, Hall, database
+
+from . import metrics
+from .titles import normalize
+
+KEY_PATH = Path("/etc/secrets/maps-api-key")
+CONCURRENCY = 8
+
+_pending: dict[str, Future[tuple[float, float]]] = {}
+_pending_lock = threading.Lock()
 
-CLIENT = Client(key=key)
 
+@cache
+def _get_client() -> Client:
+    """Get the Google Maps client, only reading its key when first needed."""
+    return Client(key=KEY_PATH.read_text(encoding="utf-8").strip())
 
-def get_lat_lng(address: str) -> tuple[float, float]:
-    location = CLIENT.geocode(address=address, components={"country": "GR"})[0][
-        "geometry"
-    ]["location"]
+
+def _geocode(address: str) -> tuple[float, float]:
+    with metrics.timed("geocode"):
+        results = _get_client().geocode(address=address, components={"country": "GR"})
+    location = results[0]["geometry"]["location"]
     return location["lat"], location["lng"]
+
+
+def _get_hall_lat_lngs() -> dict[str, tuple[float, float]]:
+    """Get the known coordinates of the halls by normalized name."""
+    return {
+        normalize(name): (float(lat), float(lng))
+        for name, lat, lng in (
+            Hall.select(Hall.name, Hall.lat, Hall.lng)
+            .where((Hall.lat != 0) | (Hall.lng != 0))
+            .tuples()
+        )
+    }
+
+
+def _set_cached(key: str, lat: float, lng: float) -> None:
+    with metrics.timed("db_write", table="geocode"):
+        Geocode.insert(
+            address=key,
+            lat=lat,
+            lng=lng,
+            geocoded_at=datetime.now(tz=UTC).replace(tzinfo=None),
+        ).on_conflict(
+            conflict_target=[Geocode.address],
+            preserve=[Geocode.lat, Geocode.lng, Geocode.geocoded_at],
+        ).execute()
+
+
+def _lookup(
+    key: str, address: str, halls: Mapping[str, tuple[float, float]] | None
+) -> tuple[float, float]:
+    """Get the coordinates of an address from the cache, the halls or Google."""
+    with scoped_connection(database):
+        geocode = Geocode.get_or_none(Geocode.address == key)
+        if geocode is not None:
+            metrics.count("geocodes", source="stored")
+            return float(geocode.lat), float(geocode.lng)
+        if halls is None:
+            halls = _get_hall_lat_lngs()
+        location = halls.get(key)
+        if location is not None:
+            metrics.count("geocodes", source="hall")
+        else:
+            metrics.count("geocodes", source="google")
+            logging.info("Geocoding %s", address)
+            location = _geocode(address)
+        _set_cached(key, *location)
+        return location
+
+
+def get_lat_lng(
+    address: str, halls: Mapping[str, tuple[float, float]] | None = None
+) -> tuple[float, float]:
+    """Get the coordinates of an address.
+
+    Concurrent lookups of the same normalized address share one lookup. The
+    known coordinates of the halls by normalized name are read if not given.
+    """
+    key = normalize(address)
+    with _pending_lock:
+        future = _pending.get(key)
+        owner = future is None
+        if future is None:
+            future = _pending[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        location = _lookup(key, address, halls)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(location)
+        return location
+    finally:
+        with _pending_lock:
+            del _pending[key]
+
+
+def get_lat_lngs(addresses: Iterable[str]) -> dict[str, tuple[float, float]]:
+    """Get the coordinates of many addresses, each distinct one looked up once."""
+    addresses = list(dict.fromkeys(addresses))
+    if not addresses:
+        return {}
+    with scoped_connection(database):
+        cached = {
+            geocode.address: (float(geocode.lat), float(geocode.lng))
+            for geocode in Geocode.select().where(
+                Geocode.address.in_({normalize(address) for address in addresses})
+            )
+        }
+    missing = [address for address in addresses if normalize(address) not in cached]
+    if not missing:
+        return {address: cached[normalize(address)] for address in addresses}
+    with scoped_connection(database):
+        halls = _get_hall_lat_lngs()
+    with ThreadPoolExecutor(CONCURRENCY) as executor:
+        locations = dict(
+            zip(
+                missing,
+                executor.map(partial(get_lat_lng, halls=halls), missing),
+                strict=True,
+            )
+        )
+    return {
+        address: locations.get(address) or cached[normalize(address)]
+        for address in addresses
+    }
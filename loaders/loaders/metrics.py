@@ -0,0 +1,226 @@
+"""Timers and counters of a loader run.
+
+Instrumented code records into a process-wide registry, which is logged as a
+summary at the end of a run and can be exported as OpenMetrics text.
+"""
+
+import dataclasses
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Self
+
+PREFIX = "loaders"
+PROFILE_INTERVAL = 0.005
+PROFILE_LINES = 30
+
+type _Key = tuple[str, tuple[tuple[str, str], ...]]
+
+
+@dataclasses.dataclass(slots=True)
+class Timer:
+    """Number and durations of timed events."""
+
+    count: int = 0
+    seconds: float = 0
+    max: float = 0
+
+
+_timers: dict[_Key, Timer] = {}
+_counters: dict[_Key, float] = {}
+_lock = threading.Lock()
+
+
+def _get_key(name: str, labels: dict[str, str]) -> _Key:
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    """Record an event that took some seconds."""
+    key = _get_key(name, labels)
+    with _lock:
+        timer = _timers.get(key)
+        if timer is None:
+            timer = _timers[key] = Timer()
+        timer.count += 1
+        timer.seconds += seconds
+        timer.max = max(timer.max, seconds)
+
+
+@contextmanager
+def timed(name: str, **labels: str) -> Iterator[None]:
+    """Record how long a block takes, even if it raises."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at, **labels)
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Add to a counter."""
+    key = _get_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def get_timers() -> dict[_Key, Timer]:
+    """Get a copy of every timer."""
+    with _lock:
+        return {key: dataclasses.replace(timer) for key, timer in _timers.items()}
+
+
+def get_counters() -> dict[_Key, float]:
+    """Get a copy of every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    """Clear every timer and counter."""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    return ",".join(f"{name}={value}" for name, value in labels)
+
+
+def log_summary() -> None:
+    """Log every timer, slowest in total first, then every counter."""
+    timers = sorted(get_timers().items(), key=lambda item: -item[1].seconds)
+    for (name, labels), timer in timers:
+        logging.info(
+            "%s{%s}: %d in %.3fs, %.3fs mean, %.3fs max",
+            name,
+            _format_labels(labels),
+            timer.count,
+            timer.seconds,
+            timer.seconds / timer.count,
+            timer.max,
+        )
+    for (name, labels), value in sorted(get_counters().items()):
+        logging.info("%s{%s}: %g", name, _format_labels(labels), value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_sample(name: str, labels: tuple[tuple[str, str], ...], value: float) -> str:
+    if not labels:
+        return f"{name} {value:g}"
+    pairs = ",".join(f'{label}="{_escape(text)}"' for label, text in labels)
+    return f"{name}{{{pairs}}} {value:g}"
+
+
+def to_openmetrics() -> str:
+    """Export every timer as a summary and every counter, in OpenMetrics text."""
+    lines: list[str] = []
+    timers: dict[str, list[tuple[tuple[tuple[str, str], ...], Timer]]] = {}
+    for (name, labels), timer in sorted(get_timers().items()):
+        timers.setdefault(name, []).append((labels, timer))
+    for name, samples in timers.items():
+        metric = f"{PREFIX}_{name}_seconds"
+        lines.extend((f"# TYPE {metric} summary", f"# UNIT {metric} seconds"))
+        for labels, timer in samples:
+            lines.extend((
+                _format_sample(f"{metric}_count", labels, timer.count),
+                _format_sample(f"{metric}_sum", labels, timer.seconds),
+            ))
+    counters: dict[str, list[tuple[tuple[tuple[str, str], ...], float]]] = {}
+    for (name, labels), value in sorted(get_counters().items()):
+        counters.setdefault(name, []).append((labels, value))
+    for name, values in counters.items():
+        metric = f"{PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(
+            _format_sample(f"{metric}_total", labels, value) for labels, value in values
+        )
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def _get_stack(frame: FrameType | None) -> tuple[str, ...]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+@dataclasses.dataclass(slots=True)
+class Sampler:
+    """Wall-clock sampling profiler of every thread of the process.
+
+    The stacks of all threads, pipeline stages and pools included, are sampled
+    from a background thread. Parsing in worker processes is not covered.
+    """
+
+    interval: float = PROFILE_INTERVAL
+    stacks: Counter[tuple[str, ...]] = dataclasses.field(default_factory=Counter)
+    _stopped: threading.Event = dataclasses.field(
+        init=False, default_factory=threading.Event
+    )
+    _thread: threading.Thread | None = dataclasses.field(init=False, default=None)
+
+    def _run(self: Self) -> None:
+        ident = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread, frame in sys._current_frames().items():  # noqa: SLF001
+                if thread != ident:
+                    self.stacks[_get_stack(frame)] += 1
+
+    def start(self: Self) -> None:
+        """Start sampling."""
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self: Self) -> None:
+        """Stop sampling."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def dump(self: Self, path: Path) -> None:
+        """Write the samples as collapsed stacks, as read by flame graph tools."""
+        with path.open("w", encoding="utf-8") as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{";".join(stack)} {samples}\n")
+
+    def log_summary(self: Self, lines: int = PROFILE_LINES) -> None:
+        """Log the functions most often on the stack, and most often on top."""
+        total: Counter[str] = Counter()
+        own: Counter[str] = Counter()
+        for stack, samples in self.stacks.items():
+            for function in set(stack):
+                total[function] += samples
+            if stack:
+                own[stack[-1]] += samples
+        for function, samples in total.most_common(lines):
+            logging.info("%d samples, %d on top: %s", samples, own[function], function)
+
+
+@contextmanager
+def profiled(path: Path | None) -> Iterator[None]:
+    """Profile a block across threads, dumping its stacks to a path if given."""
+    if path is None:
+        yield
+        return
+    sampler = Sampler()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        sampler.dump(path)
+        logging.info("Dumped profile to %s", path)
+        sampler.log_summary()
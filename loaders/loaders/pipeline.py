@@ -0,0 +1,223 @@
+"""Staged pipeline of worker threads joined by bounded queues."""
+
+import dataclasses
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import Any, Self
+
+QUEUE_SIZE = 64
+BATCH_SIZE = 32
+BATCH_WAIT = 1.0
+
+_DONE = object()
+
+
+def _take(items: "queue.Queue[object]") -> list[object]:
+    """Take the next item off a queue, or none once the queue is closed."""
+    item = items.get()
+    return [] if item is _DONE else [item]
+
+
+@dataclasses.dataclass(slots=True)
+class StageStats:
+    """Counters of a pipeline stage."""
+
+    processed: int = 0
+    dropped: int = 0
+    errors: int = 0
+    seconds: float = 0
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def total(self: Self) -> int:
+        """Get the number of items the stage was given."""
+        return self.processed + self.dropped + self.errors
+
+    @property
+    def throughput(self: Self) -> float:
+        """Get the items processed per second while the stage was active."""
+        if self.started_at is None or self.finished_at is None:
+            return 0
+        elapsed = self.finished_at - self.started_at
+        return self.processed / elapsed if elapsed else 0
+
+
+@dataclasses.dataclass(slots=True)
+class Stage:
+    """Step of a pipeline, applying a function to each item on its own workers.
+
+    The function returns the item to pass on to the next stage, or None to drop
+    it. Failures are logged and counted, and drop the item.
+    """
+
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = QUEUE_SIZE
+    stats: StageStats = dataclasses.field(init=False, default_factory=StageStats)
+    _lock: threading.Lock = dataclasses.field(
+        init=False, default_factory=threading.Lock
+    )
+
+    def work(
+        self: Self, inbox: "queue.Queue[object]", emit: Callable[[object], None]
+    ) -> None:
+        """Apply the stage to items off a queue until it is closed."""
+        while items := _take(inbox):
+            for result in self._apply(items):
+                emit(result)
+
+    def _call(self: Self, items: list[object]) -> list[object | None]:
+        return [self.function(item) for item in items]
+
+    def _apply(self: Self, items: list[object]) -> list[object]:
+        started_at = time.monotonic()
+        try:
+            results = self._call(items)
+        except Exception:
+            logging.exception("Stage %s failed on %s", self.name, items)
+            results = None
+        finished_at = time.monotonic()
+        with self._lock:
+            if self.stats.started_at is None:
+                self.stats.started_at = started_at
+            self.stats.finished_at = finished_at
+            self.stats.seconds += finished_at - started_at
+            if results is None:
+                self.stats.errors += len(items)
+                return []
+            for result in results:
+                if result is None:
+                    self.stats.dropped += 1
+                else:
+                    self.stats.processed += 1
+        return [result for result in results if result is not None]
+
+
+@dataclasses.dataclass(slots=True)
+class BatchStage(Stage):
+    """Stage applying its function to batches of items instead of one at a time.
+
+    The function takes a list of items and returns the list of their results,
+    None for the items to drop. A batch is sent once it is full, once the items
+    stop coming for `wait` seconds or once the stage has been given all items.
+    """
+
+    batch_size: int = BATCH_SIZE
+    wait: float = BATCH_WAIT
+
+    def work(
+        self: Self, inbox: "queue.Queue[object]", emit: Callable[[object], None]
+    ) -> None:
+        """Apply the stage to batches of items off a queue until it is closed."""
+        while items := self._take_batch(inbox):
+            for result in self._apply(items):
+                emit(result)
+
+    def _take_batch(self: Self, items: "queue.Queue[object]") -> list[object]:
+        batch = _take(items)
+        while batch and len(batch) < self.batch_size:
+            try:
+                item = items.get(timeout=self.wait)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                # Leave the end of the queue to be seen again by this worker.
+                items.put(_DONE)
+                break
+            batch.append(item)
+        return batch
+
+    def _call(self: Self, items: list[object]) -> list[object | None]:
+        results = self.function(items)
+        if len(results) != len(items):
+            msg = f"Stage {self.name} returned {len(results)} of {len(items)} items"
+            raise ValueError(msg)
+        return results
+
+
+@dataclasses.dataclass(slots=True)
+class Pipeline:
+    """Stages run concurrently, each feeding the next through a bounded queue.
+
+    A full queue blocks the stage before it, so a slow stage slows down the
+    stages feeding it instead of piling up items in memory.
+    """
+
+    stages: list[Stage]
+
+    def run(self: Self, items: Iterable[object]) -> list[Any]:
+        """Pass items through every stage, returning the results of the last."""
+        run = _Run(self.stages)
+        threads = [
+            threading.Thread(target=run.feed, args=(items,), name="pipeline-feed")
+        ] + [
+            threading.Thread(target=run.work, args=(i,), name=f"pipeline-{stage.name}")
+            for i, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return run.results
+
+    def log_stats(self: Self) -> None:
+        """Log the counters of every stage."""
+        for stage in self.stages:
+            logging.info(
+                "%s: %d processed, %d dropped, %d errors, %.1f/s, %.3fs mean",
+                stage.name,
+                stage.stats.processed,
+                stage.stats.dropped,
+                stage.stats.errors,
+                stage.stats.throughput,
+                stage.stats.seconds / stage.stats.total if stage.stats.total else 0,
+            )
+
+
+@dataclasses.dataclass(slots=True)
+class _Run:
+    """Queues and results of one run of a pipeline."""
+
+    stages: list[Stage]
+    queues: list["queue.Queue[object]"] = dataclasses.field(init=False)
+    remaining: list[int] = dataclasses.field(init=False)
+    results: list[Any] = dataclasses.field(init=False, default_factory=list)
+    lock: threading.Lock = dataclasses.field(init=False, default_factory=threading.Lock)
+
+    def __post_init__(self: Self) -> None:
+        self.queues = [queue.Queue(stage.queue_size) for stage in self.stages]
+        self.remaining = [stage.workers for stage in self.stages]
+
+    def close(self: Self, i: int) -> None:
+        """Tell every worker of a stage that no more items are coming."""
+        for _ in range(self.stages[i].workers):
+            self.queues[i].put(_DONE)
+
+    def feed(self: Self, items: Iterable[object]) -> None:
+        """Put items on the queue of the first stage, then close it."""
+        try:
+            for item in items:
+                self.queues[0].put(item)
+        except Exception:
+            logging.exception("Failed to list the items of the pipeline")
+        finally:
+            self.close(0)
+
+    def work(self: Self, i: int) -> None:
+        """Run a worker of a stage, closing the next stage after its last one."""
+        last_stage = i + 1 == len(self.stages)
+        emit = self.results.append if last_stage else self.queues[i + 1].put
+        try:
+            self.stages[i].work(self.queues[i], emit)
+        finally:
+            with self.lock:
+                self.remaining[i] -= 1
+                last = not self.remaining[i]
+            if last and not last_stage:
+                self.close(i + 1)
@@ -0,0 +1,28 @@
+"""Bounded task scheduling on the event loop."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+
+
+async def run_bounded[T](
+    function: Callable[[T], Awaitable[object]], items: Iterable[T], limit: int
+) -> None:
+    """Await a coroutine per item, at most `limit` at a time.
+
+    Items are pulled lazily by `limit` workers, so memory stays bounded by the
+    number of coroutines in flight rather than the number of items. Failures
+    are logged and do not stop the remaining items.
+    """
+    iterator = iter(items)
+
+    async def worker() -> None:
+        for item in iterator:
+            try:
+                await function(item)
+            except Exception:
+                logging.exception("Failed %s", item)
+
+    async with asyncio.TaskGroup() as task_group:
+        for _ in range(limit):
+            task_group.create_task(worker())
@@ -0,0 +1,315 @@
+"""Shared HTTP session with per-host pooling, rate limiting and backoff."""
+
+import asyncio
+import dataclasses
+import logging
+import random
+import threading
+import time
+from collections.abc import Mapping
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from typing import Self
+from urllib import parse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+TIMEOUT = (3.05, 27)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+TOO_MANY_REQUESTS = 429
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class HostLimits:
+    """Connection and rate limits of a host."""
+
+    rate: float
+    burst: int
+    connections: int
+
+
+DEFAULT_LIMITS = HostLimits(rate=5, burst=5, connections=4)
+LIMITS = {
+    "www.athinorama.gr": HostLimits(rate=10, burst=20, connections=16),
+    "letterboxd.com": HostLimits(rate=4, burst=8, connections=8),
+    "cinobo.com": HostLimits(rate=2, burst=2, connections=2),
+}
+
+
+@dataclasses.dataclass(slots=True)
+class TokenBucket:
+    """Token bucket rate limiter."""
+
+    rate: float
+    capacity: float
+    tokens: float = dataclasses.field(init=False)
+    updated_at: float = dataclasses.field(init=False, default_factory=time.monotonic)
+    lock: threading.Lock = dataclasses.field(init=False, default_factory=threading.Lock)
+
+    def __post_init__(self: Self) -> None:
+        self.tokens = self.capacity
+
+    def _take(self: Self) -> float:
+        """Take a token, or return how long to wait for one."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self: Self) -> None:
+        """Block until a token is available and take it."""
+        while wait := self._take():
+            time.sleep(wait)
+
+    async def acquire_async(self: Self) -> None:
+        """Wait until a token is available and take it."""
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+    def pause(self: Self, seconds: float) -> None:
+        """Hold back every caller for some seconds, e.g. after a 429."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+@dataclasses.dataclass(slots=True)
+class HostStats:
+    """Request counters of a host."""
+
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+
+@dataclasses.dataclass(slots=True)
+class _Host:
+    name: str
+    limits: HostLimits
+    bucket: TokenBucket
+    semaphore: threading.BoundedSemaphore
+    stats: HostStats = dataclasses.field(default_factory=HostStats)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def record(self: Self, num_bytes: int, seconds: float) -> None:
+        with self.lock:
+            self.stats.requests += 1
+            self.stats.bytes += num_bytes
+            self.stats.seconds += seconds
+        metrics.observe("http_request", seconds, host=self.name)
+        metrics.count("http_received_bytes", num_bytes, host=self.name)
+
+    def record_error(self: Self) -> None:
+        with self.lock:
+            self.stats.errors += 1
+        metrics.count("http_errors", host=self.name)
+
+    def retry(
+        self: Self,
+        url: str,
+        attempt: int,
+        status: int | None = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> float:
+        """Count a retry and return how long to back off before it."""
+        delay = (_retry_after(headers) if headers is not None else None) or _backoff(
+            attempt
+        )
+        logging.warning(
+            "%s for %s, retrying in %.1fs", status or "Connection error", url, delay
+        )
+        if status == TOO_MANY_REQUESTS:
+            self.bucket.pause(delay)
+        with self.lock:
+            self.stats.retries += 1
+        metrics.count("http_retries", host=self.name)
+        metrics.observe("http_backoff", delay, host=self.name)
+        return delay
+
+
+_HOSTS: dict[str, _Host] = {}
+_HOSTS_LOCK = threading.Lock()
+
+
+def _get_host(url: str) -> _Host:
+    hostname = parse.urlparse(url).hostname or ""
+    with _HOSTS_LOCK:
+        if (host := _HOSTS.get(hostname)) is None:
+            limits = LIMITS.get(hostname, DEFAULT_LIMITS)
+            host = _HOSTS[hostname] = _Host(
+                name=hostname,
+                limits=limits,
+                bucket=TokenBucket(rate=limits.rate, capacity=limits.burst),
+                semaphore=threading.BoundedSemaphore(limits.connections),
+            )
+        return host
+
+
+def _retry_after(headers: Mapping[str, str]) -> float | None:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(
+            0.0, (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt) * random.uniform(0.5, 1)  # noqa: S311
+
+
+class Session:
+    """Thread-safe HTTP session shared across loaders."""
+
+    def __init__(self: Self) -> None:
+        self._session = requests.Session()
+        self._mounted: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _mount(self: Self, url: str, limits: HostLimits) -> None:
+        parts = parse.urlparse(url)
+        prefix = f"{parts.scheme}://{parts.netloc}/"
+        with self._lock:
+            if prefix in self._mounted:
+                return
+            self._session.mount(
+                prefix,
+                HTTPAdapter(
+                    pool_connections=1, pool_maxsize=limits.connections, pool_block=True
+                ),
+            )
+            self._mounted.add(prefix)
+
+    def get(
+        self: Self, url: str, headers: dict[str, str] | None = None
+    ) -> requests.Response:
+        """Send a GET request, waiting for the host's rate limit and retrying."""
+        host = _get_host(url)
+        self._mount(url, host.limits)
+        attempt = 0
+        while True:
+            host.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with host.semaphore:
+                    response = self._session.get(url, headers=headers, timeout=TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                host.record_error()
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = host.retry(url, attempt)
+            else:
+                host.record(len(response.content), time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    return response
+                delay = host.retry(url, attempt, response.status_code, response.headers)
+            time.sleep(delay)
+            attempt += 1
+
+
+class AsyncSession:
+    """HTTP session for the event loop, sharing the hosts' rate limits.
+
+    Its client and connection limits belong to the event loop it is used on,
+    so a session is created for each run and closed after it.
+    """
+
+    def __init__(self: Self) -> None:
+        self._client: httpx.AsyncClient | None = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self: Self) -> httpx.AsyncClient:
+        """Get the client, creating it on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+                limits=httpx.Limits(max_connections=None),
+            )
+        return self._client
+
+    async def get(
+        self: Self, url: str, headers: dict[str, str] | None = None
+    ) -> httpx.Response:
+        """Send a GET request, waiting for the host's rate limit and retrying."""
+        host = _get_host(url)
+        if (semaphore := self._semaphores.get(host.name)) is None:
+            semaphore = self._semaphores[host.name] = asyncio.Semaphore(
+                host.limits.connections
+            )
+        attempt = 0
+        while True:
+            await host.bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                async with semaphore:
+                    response = await self.client.get(url, headers=headers)
+            except httpx.TransportError:
+                host.record_error()
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = host.retry(url, attempt)
+            else:
+                host.record(len(response.content), time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    return response
+                delay = host.retry(url, attempt, response.status_code, response.headers)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self: Self) -> None:
+        """Close the client's connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self: Self) -> Self:
+        return self
+
+    async def __aexit__(self: Self, *args: object) -> None:
+        await self.aclose()
+
+
+SESSION = Session()
+
+
+def stats() -> dict[str, HostStats]:
+    """Get the request counters of every host."""
+    with _HOSTS_LOCK:
+        return {
+            hostname: dataclasses.replace(host.stats)
+            for hostname, host in _HOSTS.items()
+        }
+
+
+def log_stats() -> None:
+    """Log the request counters of every host."""
+    for hostname, host_stats in stats().items():
+        logging.info(
+            "%s: %d requests, %d retries, %d errors, %.1f MB, %.3fs mean latency",
+            hostname,
+            host_stats.requests,
+            host_stats.retries,
+            host_stats.errors,
+            host_stats.bytes / 1e6,
+            host_stats.seconds / host_stats.requests if host_stats.requests else 0,
+        )
@@ -0,0 +1,115 @@
+"""Fuzzy title matching over a BK-tree of normalized titles."""
+
+import dataclasses
+import string
+from collections.abc import Iterable
+from typing import Self
+
+from rapidfuzz.distance import Levenshtein
+
+_PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+
+def normalize(title: str) -> str:
+    """Lowercase a title and strip its punctuation and extra whitespace."""
+    return " ".join(title.lower().translate(_PUNCTUATION).split())
+
+
+@dataclasses.dataclass(slots=True)
+class _Node[T]:
+    title: str
+    items: list[T]
+    children: dict[int, "_Node[T]"] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass(slots=True)
+class TitleIndex[T]:
+    """Index of values by title, queried by Levenshtein distance.
+
+    Titles are normalized and stored in a BK-tree, so a bounded query only
+    compares the title against the nodes whose distance to their parent can
+    still be within the bound.
+    """
+
+    _root: _Node[T] | None = dataclasses.field(init=False, default=None)
+    _exact: dict[str, list[T]] = dataclasses.field(init=False, default_factory=dict)
+
+    @classmethod
+    def from_titles(cls, titles: Iterable[tuple[str, T]]) -> Self:
+        """Build an index of `(title, value)` pairs."""
+        index = cls()
+        for title, value in titles:
+            index.add(title, value)
+        return index
+
+    def add(self: Self, title: str, value: T) -> None:
+        """Index a value by its title."""
+        title = normalize(title)
+        if (values := self._exact.get(title)) is not None:
+            values.append(value)
+            return
+        node = _Node(title, [value])
+        self._exact[title] = node.items
+        if self._root is None:
+            self._root = node
+            return
+        parent = self._root
+        while True:
+            distance = Levenshtein.distance(title, parent.title)
+            if (child := parent.children.get(distance)) is None:
+                parent.children[distance] = node
+                return
+            parent = child
+
+    def match(
+        self: Self, title: str, max_distance: int | None = None
+    ) -> list[tuple[T, int]]:
+        """Get the values within a distance of a title, nearest first."""
+        title = normalize(title)
+        if max_distance == 0 or self._root is None:
+            return [(value, 0) for value in self._exact.get(title, [])]
+        matches: list[tuple[T, int]] = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            distance = Levenshtein.distance(title, node.title)
+            if max_distance is None or distance <= max_distance:
+                matches.extend((value, distance) for value in node.items)
+            nodes.extend(
+                child
+                for child_distance, child in node.children.items()
+                if max_distance is None
+                or abs(child_distance - distance) <= max_distance
+            )
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def nearest(
+        self: Self, title: str, max_distance: int | None = None
+    ) -> tuple[T, int] | None:
+        """Get the value nearest to a title and its distance, if within bound.
+
+        The bound shrinks to the best distance found so far, pruning more of the
+        tree as the search goes on.
+        """
+        title = normalize(title)
+        if (values := self._exact.get(title)) is not None:
+            return values[0], 0
+        best = None
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = Levenshtein.distance(title, node.title)
+            if max_distance is None or distance <= max_distance:
+                best = node.items[0], distance
+                max_distance = distance - 1
+            nodes.extend(
+                child
+                for child_distance, child in node.children.items()
+                if max_distance is None
+                or abs(child_distance - distance) <= max_distance
+            )
+        return best
+
+    def __len__(self: Self) -> int:
+        return len(self._exact)
@@ -0,0 +1,114 @@
+import asyncio
+import dataclasses
+import os
+import threading
+from collections.abc import Iterator
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import ClassVar
+
+import pytest
+
+from loaders import cache
+from loaders.cache import Cache, afetch, fetch
+from loaders.session import AsyncSession
+
+
+class _Handler(BaseHTTPRequestHandler):
+    body = b"<html>v1</html>"
+    etag = '"v1"'
+    requests: ClassVar[list[dict[str, str]]] = []
+
+    def do_GET(self) -> None:  # noqa: N802
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture()
+def server() -> Iterator[str]:
+    _Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/page"
+    httpd.shutdown()
+
+
+def test_fresh_entry_skips_request(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(cache.TTLS, "127.0.0.1", timedelta(hours=1))
+    c = Cache(tmp_path)
+    assert fetch(server, c) == b"<html>v1</html>"
+    assert fetch(server, c) == b"<html>v1</html>"
+    assert len(_Handler.requests) == 1
+
+
+def test_stale_entry_is_revalidated(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(cache.TTLS, "127.0.0.1", timedelta(0))
+    c = Cache(tmp_path)
+    assert fetch(server, c) == b"<html>v1</html>"
+    assert fetch(server, c) == b"<html>v1</html>"
+    assert len(_Handler.requests) == 2
+    assert _Handler.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_changed_page_is_replaced(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(cache.TTLS, "127.0.0.1", timedelta(0))
+    c = Cache(tmp_path)
+    fetch(server, c)
+    monkeypatch.setattr(_Handler, "body", b"<html>v2</html>")
+    monkeypatch.setattr(_Handler, "etag", '"v2"')
+    assert fetch(server, c) == b"<html>v2</html>"
+    entry = c.get(server)
+    assert entry is not None
+    assert entry.etag == '"v2"'
+
+
+def test_afetch_revalidates_like_fetch(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(cache.TTLS, "127.0.0.1", timedelta(0))
+    c = Cache(tmp_path)
+
+    async def main() -> list[bytes]:
+        async with AsyncSession() as session:
+            return [await afetch(server, session, c), await afetch(server, session, c)]
+
+    assert asyncio.run(main()) == [b"<html>v1</html>"] * 2
+    assert _Handler.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_collect_deletes_stale_entries_and_unreferenced_bodies(tmp_path: Path) -> None:
+    c = Cache(tmp_path)
+    c.put("https://a/", b"v1")
+    c.put("https://b/", b"v1")
+    c.put("https://a/", b"v2")
+    stale = c.put("https://c/", b"v3")
+    c._write(dataclasses.replace(stale, fetched_at=0))  # noqa: SLF001
+    # Files written during a collection are kept, so backdate these.
+    for path in tmp_path.rglob("*"):
+        os.utime(path, (0, 0))
+    assert c.collect(timedelta(days=1)) == (1, 1)
+    for url, body in (("https://a/", b"v2"), ("https://b/", b"v1")):
+        entry = c.get(url)
+        assert entry is not None
+        assert c.read(entry) == body
+    assert c.get("https://c/") is None
+    assert len(list(tmp_path.glob("bodies/*/*"))) == 2
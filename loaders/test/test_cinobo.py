@@ -0,0 +1,59 @@
+from collections.abc import Iterator
+from datetime import date, time
+
+import pytest
+from peewee import SqliteDatabase
+
+from loaders import cinobo
+from loaders.cinobo import get_candidates, update_movie_places
+from orm.geo import GridIndex
+from orm.models import Hall, Movie, MoviePlace
+
+MODELS = [Hall, Movie, MoviePlace]
+HALLS = {"a": (37.98, 23.73), "b": (37.981, 23.73), "c": (38.2, 23.73)}
+
+
+@pytest.fixture()
+def database(monkeypatch: pytest.MonkeyPatch) -> Iterator[SqliteDatabase]:
+    database = SqliteDatabase(":memory:")
+    monkeypatch.setattr(cinobo, "database", database)
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        for url, (lat, lng) in HALLS.items():
+            Hall.create(url=url, name=url, lat=lat, lng=lng, open_air=False)
+        Movie.create(
+            url="m",
+            title="Vertigo",
+            rating=8.3,
+            votes=1,
+            critics_rating=5,
+            critics_votes=1,
+            imdb_url="tt0052357",
+        )
+        for hall, cinobo_pass in (("a", False), ("b", False), ("c", True)):
+            MoviePlace.create(
+                movie="m",
+                hall=hall,
+                date=date(2024, 8, 1),
+                time=time(21),
+                dubbed=False,
+                cinobo_pass=cinobo_pass,
+            )
+        yield database
+
+
+def test_get_candidates() -> None:
+    halls = GridIndex.from_points((url, *location) for url, location in HALLS.items())
+    assert get_candidates(halls, 37.9802, 23.73) == ["a", "b"]
+    assert get_candidates(halls, 38.1, 23.73) == ["c"]
+
+
+@pytest.mark.usefixtures("database")
+def test_update_movie_places() -> None:
+    showtimes = [
+        ("tt0052357", "B", date(2024, 8, 1), time(21)),
+        ("tt0052357", "B", date(2024, 8, 2), time(21)),
+    ]
+    assert update_movie_places(showtimes, {"B": ["b", "a"]}) == 1
+    marked = MoviePlace.select(MoviePlace.hall).where(MoviePlace.cinobo_pass)
+    assert [place.hall_id for place in marked] == ["b"]
@@ -0,0 +1,67 @@
+from datetime import date, time
+
+import pytest
+
+from loaders.athinorama import Loader, MovieLoader, MoviePage, MoviePlacesLoader
+from loaders.extract import get_executor, get_href, get_text, parse_document
+
+MOVIE_PAGE = b"""
+<div class="review-title">
+  <h1> Vertigo </h1>
+  <span class="original-title">Vertigo/Sueurs froides</span>
+  <span class="year">1958</span>
+</div>
+<div class="critic"><div><span>4,5</span></div></div>
+<div class="critic"><div><span>3,5</span></div></div>
+<a class="imdb" href="https://www.imdb.com/title/tt0052357/">IMDb</a>
+<a id="eventPlacesLink" href="/cinema/movie/places/vertigo">Places</a>
+"""
+
+PLACES_PAGE = """
+<div class="item-image poster-image"><a href="/cinema/movie/vertigo">V</a></div>
+<div class="item card-item">
+  <h2 class="item-title"><a href="/cinema/halls/aigli">Αίγλη</a></h2>
+  <div class="inner"><span>Πέμ.</span> <b>21.00</b></div>
+</div>
+<div class="item"><div class="inner">Πέμ. 20.00</div></div>
+""".encode()
+
+
+def test_get_text() -> None:
+    document = parse_document(b"<p> a <b> b </b>\n c </p>")
+    assert get_text(document) == "abc"
+    assert get_text(document, separator=" ") == "a b c"
+
+
+def test_empty_document() -> None:
+    assert not get_text(parse_document(b""))
+
+
+def test_get_href() -> None:
+    document = parse_document(b'<a href="/a">a</a><b>b</b>')
+    assert get_href(document.find(".//a")) == "/a"
+    with pytest.raises(KeyError):
+        get_href(document.find(".//b"))
+
+
+def test_parse_movie() -> None:
+    assert MovieLoader._parse(MOVIE_PAGE) == MoviePage(  # noqa: SLF001
+        titles=["Vertigo", "Vertigo", "Sueurs froides"],
+        year=1958,
+        critics_rating=4,
+        critics_votes=2,
+        imdb_id="0052357",
+        places_path="/cinema/movie/places/vertigo",
+    )
+
+
+def test_parse_in_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    loader = MoviePlacesLoader("/cinema/movie/places/vertigo")
+    with get_executor(1) as executor:
+        monkeypatch.setattr(Loader, "executor", executor)
+        movie, rows = loader._extract(PLACES_PAGE)  # noqa: SLF001
+    assert movie == "https://www.athinorama.gr/cinema/movie/vertigo"
+    assert [(row["hall"], row["date"].weekday(), row["time"]) for row in rows] == [
+        ("https://www.athinorama.gr/cinema/halls/aigli", 3, time(21))
+    ]
+    assert all(isinstance(row["date"], date) for row in rows)
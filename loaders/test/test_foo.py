@@ -0,0 +1,110 @@
+import logging
+import re
+from collections.abc import Callable
+from datetime import datetime, time, timedelta
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from loaders.foo import (
+    ANNOTATED_DAYTIMES,
+    DAY,
+    DAY_SEP,
+    DAYS,
+    DAYS_LIST,
+    TIME,
+    TIMES,
+    last_thursday,
+    parse_all,
+    parse_datetimes,
+)
+
+TOKENS = [
+    *DAYS_LIST,
+    "Πέμ,",
+    "Τρα",
+    "-",
+    ", ",
+    " & ",
+    " ",
+    "  ",
+    "\n",
+    ": ",
+    "/ ",
+    "13.00",
+    "22.10",
+    "00.05",
+    "24.00",
+    "20:30",
+    "19.70",
+    "μεταγλ.",
+    "με υπότιτλους",
+]
+
+
+def _parse_datetimes(datetimes: str) -> list[tuple[datetime, bool]]:
+    """Parse datetimes as the original implementation did."""
+    datetimes = " ".join(datetimes.replace(": ", "").split())
+    _datetimes = []
+    for dts, sub in re.findall(ANNOTATED_DAYTIMES, datetimes):
+        for days, times in re.findall(f"({DAYS}) ({TIMES})", dts):
+            _days = []
+            _day = None
+            for day_sep, day in re.findall(f"({DAY_SEP})?({DAY})", days):
+                if day_sep == "-":
+                    if _day is None:
+                        logging.error("Malformed day range")
+                        continue
+                    for i in range(DAYS_LIST.index(_day) + 1, DAYS_LIST.index(day)):
+                        _days.append(DAYS_LIST[i])  # noqa: PERF401
+                    _days.append(day)
+                else:
+                    _days.append(day)
+                _day = day
+            for day in _days:
+                for t in re.findall(f"{TIME}", times):
+                    offset = DAYS_LIST.index(day)
+                    d = last_thursday + timedelta(days=offset)
+                    t_ = datetime.strptime(t, "%H.%M").astimezone()
+                    dt = datetime.combine(d, t_.time())
+                    dubbed = sub == "μεταγλ."
+                    _datetimes.append((dt, dubbed))
+    return _datetimes
+
+
+def _outcome(datetimes: str, parse: Callable[[str], object]) -> object:
+    try:
+        return parse(datetimes)
+    except ValueError:
+        return ValueError
+
+
+def test_parse_datetimes() -> None:
+    datetimes = (
+        "Σάβ.-Κυρ. 15.15/ 17.30, "
+        "Δευτ. 13.00 μεταγλ., "
+        "Τετ.-Παρ. 22.10 με υπότιτλους"
+    )
+    assert [
+        ((dt - datetime.combine(last_thursday, time())), dubbed)
+        for dt, dubbed in parse_datetimes(datetimes)
+    ] == [
+        (timedelta(days=2, hours=15, minutes=15), True),
+        (timedelta(days=2, hours=17, minutes=30), True),
+        (timedelta(days=3, hours=15, minutes=15), True),
+        (timedelta(days=3, hours=17, minutes=30), True),
+        (timedelta(days=4, hours=13), True),
+        (timedelta(days=6, hours=22, minutes=10), False),
+        (timedelta(days=1, hours=22, minutes=10), False),
+    ]
+
+
+def test_parse_all() -> None:
+    datetimess = ["Πέμ. 20.00", "Πέμ.  20.00", "Παρ. 21.00"]
+    assert parse_all(datetimess) == [_parse_datetimes(d) for d in datetimess]
+
+
+@given(st.lists(st.sampled_from(TOKENS) | st.text(max_size=2), max_size=24))
+def test_matches_the_original(tokens: list[str]) -> None:
+    datetimes = "".join(tokens)
+    assert _outcome(datetimes, parse_datetimes) == _outcome(datetimes, _parse_datetimes)
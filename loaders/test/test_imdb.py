@@ -0,0 +1,70 @@
+from collections.abc import Iterator
+from datetime import timedelta
+
+import pytest
+from peewee import SqliteDatabase
+
+from loaders import imdb
+from loaders.imdb import MovieInfo, invalidate, search_movie
+from orm.models import ImdbResolution
+
+INFO = MovieInfo(
+    title="Perfect Days",
+    original_title=None,
+    imdb_rating=7.9,
+    imdb_votes=1000,
+    imdb_url="http://www.imdb.com/title/tt27503384/",
+)
+
+
+@pytest.fixture()
+def calls(monkeypatch: pytest.MonkeyPatch) -> Iterator[list[list[str]]]:
+    calls: list[list[str]] = []
+
+    def _search_movie(titles: list[str], year: int | None = None) -> MovieInfo | None:
+        calls.append(titles)
+        return INFO if "Perfect Days" in titles else None
+
+    monkeypatch.setattr(imdb, "_search_movie", _search_movie)
+    database = SqliteDatabase(":memory:")
+    monkeypatch.setattr(imdb, "database", database)
+    with database.bind_ctx([ImdbResolution]):
+        database.create_tables([ImdbResolution])
+        yield calls
+
+
+def test_resolution_is_cached(calls: list[list[str]]) -> None:
+    assert search_movie(["Perfect Days"], 2023) == INFO
+    assert search_movie(["perfect days!"], 2023) == INFO
+    assert len(calls) == 1
+
+
+def test_negative_resolution_expires(
+    calls: list[list[str]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    assert search_movie(["Unknown"], 2023) is None
+    assert search_movie(["Unknown"], 2023) is None
+    assert len(calls) == 1
+    monkeypatch.setattr(imdb, "NEGATIVE_TTL", timedelta(0))
+    assert search_movie(["Unknown"], 2023) is None
+    assert len(calls) == 2
+
+
+def test_invalidate(calls: list[list[str]]) -> None:
+    search_movie(["Perfect Days"], 2023)
+    search_movie(["Unknown"], 2023)
+    assert invalidate(negative=True) == 1
+    assert invalidate(title="Perfect Days") == 1
+    search_movie(["Perfect Days"], 2023)
+    assert len(calls) == 3
+
+
+@pytest.mark.usefixtures("calls")
+def test_invalidate_matches_whole_titles() -> None:
+    for titles in (["It"], ["It Follows"], ["Up", "It"], ["Sit"]):
+        search_movie(titles, 2014)
+    assert invalidate(title="it!") == 2
+    assert sorted(resolution.titles for resolution in ImdbResolution.select()) == [
+        "it follows",
+        "sit",
+    ]
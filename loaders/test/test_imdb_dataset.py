@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import pytest
+
+from loaders.imdb import MovieInfo
+from loaders.imdb_dataset import Index, build, refresh_ratings
+
+DATASETS = Path(__file__).parent / "assets" / "imdb-dataset"
+
+
+class FakeResolver:
+    def get_movie(  # noqa: PLR6301
+        self, imdb_id: str, titles: list[str], year: int
+    ) -> MovieInfo | None:
+        return None
+
+    def search_movie(  # noqa: PLR6301
+        self, titles: list[str], year: int | None = None
+    ) -> MovieInfo | None:
+        return MovieInfo(
+            title=titles[0],
+            original_title=None,
+            imdb_rating=0,
+            imdb_votes=0,
+            imdb_url="http://www.imdb.com/title/tt0000001/",
+        )
+
+
+@pytest.fixture()
+def index(tmp_path: Path) -> Index:
+    path = tmp_path / "imdb.sqlite3"
+    build(DATASETS, path)
+    return Index(path)
+
+
+@pytest.mark.parametrize(
+    ("titles", "year", "imdb_id"),
+    [
+        (["Τέλειες μέρες", "Perfect Days"], 2023, "27503384"),
+        (["Perfect Days"], 2011, "1550312"),
+        (["Καημένα πλάσματα"], 2023, "14230458"),
+        (["Anatomie d'une chute"], 2024, "17009710"),
+        (["Δεσμώτης του ιλίγγου", "Vertigo"], 1958, "0052357"),
+        (["VERTIGO!"], None, "0052357"),
+    ],
+)
+def test_search_movie(
+    index: Index, titles: list[str], year: int | None, imdb_id: str
+) -> None:
+    info = index.search_movie(titles, year)
+    assert info is not None
+    assert info.imdb_id == f"tt{imdb_id}"
+
+
+def test_search_movie_skips_other_types_and_years(index: Index) -> None:
+    assert index.search_movie(["Η Τέλεια Χημεία"], 2008) is None
+    assert index.search_movie(["Poor Things"], 2019) is None
+
+
+def test_get_movie(index: Index) -> None:
+    info = index.get_movie("17009710", ["Ανατομία μιας πτώσης"], 2023)
+    assert info == MovieInfo(
+        title="Anatomy of a Fall",
+        original_title="Anatomie d'une chute",
+        imdb_rating=7.7,
+        imdb_votes=200000,
+        imdb_url="http://www.imdb.com/title/tt17009710/",
+    )
+
+
+def test_get_movie_with_mismatched_titles_searches(index: Index) -> None:
+    info = index.get_movie("0110005", ["Καημένα πλάσματα"], 2023)
+    assert info is not None
+    assert info.imdb_id == "tt14230458"
+
+
+def test_fallback(index: Index) -> None:
+    index.fallback = FakeResolver()
+    info = index.search_movie(["Unknown"], 2024)
+    assert info is not None
+    assert info.title == "Unknown"
+
+
+def test_refresh_ratings(index: Index, tmp_path: Path) -> None:
+    (tmp_path / "title.ratings.tsv").write_text(
+        "tconst\taverageRating\tnumVotes\ntt0052357\t8.4\t500000\n", encoding="utf-8"
+    )
+    refresh_ratings(tmp_path, index.path)
+    info = index.search_movie(["Vertigo"], 1958)
+    assert info is not None
+    assert (info.imdb_rating, info.imdb_votes) == (8.4, 500000)
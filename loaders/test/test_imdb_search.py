@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+from typing import Any, ClassVar
+
+import pytest
+from imdb.Movie import Movie
+
+from loaders import imdb
+
+CORPUS = json.loads(
+    (Path(__file__).parent / "assets" / "imdb-search.json").read_text(encoding="utf-8")
+)
+
+
+class FakeCinemagoer:
+    fetched: ClassVar[list[str]] = []
+
+    def __init__(self, **_: object) -> None:
+        pass
+
+    def search_movie(self, title: str) -> list[Movie]:  # noqa: PLR6301
+        return [
+            Movie(movieID=result["movieID"], data=result)
+            for result in CORPUS["search"].get(title, [])
+        ]
+
+    def get_movie(self, movie_id: str) -> Movie:  # noqa: PLR6301
+        FakeCinemagoer.fetched.append(movie_id)
+        return Movie(movieID=movie_id, data=CORPUS["movies"][movie_id])
+
+
+@pytest.fixture(autouse=True)
+def _cinemagoer(monkeypatch: pytest.MonkeyPatch) -> None:
+    FakeCinemagoer.fetched = []
+    monkeypatch.setattr(imdb, "Cinemagoer", FakeCinemagoer)
+
+
+@pytest.mark.parametrize("case", CORPUS["cases"], ids=lambda case: case["titles"][0])
+def test_resolution(case: dict[str, Any]) -> None:
+    info = imdb._search_movie(case["titles"], case["year"])  # noqa: SLF001
+    if case["expected"] is None:
+        assert info is None
+    else:
+        assert info is not None
+        assert info.imdb_url == f"http://www.imdb.com/title/tt{case["expected"]}/"
+
+
+def test_fetches_at_most_top_k_per_title() -> None:
+    imdb._search_movie(["Vertigo"], 1958)  # noqa: SLF001
+    assert 1 <= len(FakeCinemagoer.fetched) <= imdb.TOP_K
+
+
+def test_skips_candidates_outside_year_window() -> None:
+    imdb._search_movie(["Unknown Film"], 2024)  # noqa: SLF001
+    assert FakeCinemagoer.fetched == []
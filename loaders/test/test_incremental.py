@@ -0,0 +1,204 @@
+import asyncio
+from collections.abc import Iterator
+from datetime import date, time
+from pathlib import Path
+
+import pytest
+from peewee import SqliteDatabase
+
+from loaders import athinorama
+from loaders.athinorama import (
+    AsyncRun,
+    HallLoader,
+    Loader,
+    MovieLoader,
+    get_pipeline,
+    load_all,
+)
+from loaders.imdb import MovieInfo
+from loaders.scheduler import run_bounded
+from loaders.session import AsyncSession
+from orm.models import CrawlState, Hall, Movie, MoviePlace
+
+MODELS = [CrawlState, Hall, Movie, MoviePlace]
+
+HALL_PAGE = """
+<div class="review-title">
+  <h1>{name}</h1>
+  <div class="infos-item"><nav>
+    <a href="https://maps.google.com/?destination=37.98 23.73">Map</a>
+  </nav></div>
+</div>
+"""
+
+MOVIE_PAGE = """
+<div class="review-title">
+  <h1>Movie</h1>
+  <span class="year">2024</span>
+</div>
+"""
+
+
+def load(loader: Loader, *, incremental: bool = False) -> None:
+    load_all([loader], get_pipeline(), incremental=incremental)
+
+
+@pytest.fixture()
+def pages(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[dict[str, str]]:
+    pages: dict[str, str] = {}
+    database = SqliteDatabase(tmp_path / "test.db")
+    monkeypatch.setattr(athinorama, "fetch", lambda url: pages[url].encode())
+
+    async def afetch(url: str, session: AsyncSession) -> bytes:
+        await asyncio.sleep(0)
+        return pages[url].encode()
+
+    monkeypatch.setattr(athinorama, "afetch", afetch)
+    monkeypatch.setattr(athinorama, "database", database)
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        yield pages
+
+
+def test_unchanged_page_is_skipped(
+    pages: dict[str, str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    loader = HallLoader("/cinema/halls/a")
+    pages[loader.url] = HALL_PAGE.format(name="A")
+    load(loader, incremental=True)
+    HallLoader.writer.flush()
+    writes = []
+    monkeypatch.setattr(HallLoader, "_write", lambda _, page: writes.append(page))
+    load(loader, incremental=True)
+    assert writes == []
+    pages[loader.url] = HALL_PAGE.format(name="B")
+    load(loader, incremental=True)
+    assert [page.name for page in writes] == ["B"]
+
+
+def test_reload_upserts(pages: dict[str, str]) -> None:
+    loader = HallLoader("/cinema/halls/a")
+    pages[loader.url] = HALL_PAGE.format(name="A")
+    load(loader)
+    pages[loader.url] = HALL_PAGE.format(name="B")
+    load(loader)
+    HallLoader.writer.flush()
+    assert [hall.name for hall in Hall.select()] == ["B"]
+
+
+def test_prune_deletes_screenings_of_gone_halls(pages: dict[str, str]) -> None:
+    kept, gone = HallLoader("/cinema/halls/a"), HallLoader("/cinema/halls/b")
+    for loader in (kept, gone):
+        pages[loader.url] = HALL_PAGE.format(name=loader.name)
+        load(loader, incremental=True)
+    HallLoader.writer.flush()
+    movie = Movie.create(
+        url="m",
+        title="M",
+        rating=0,
+        votes=0,
+        critics_rating=0,
+        critics_votes=0,
+        imdb_url="i",
+    )
+    for loader in (kept, gone):
+        MoviePlace.create(
+            movie=movie,
+            hall=loader.url,
+            date=date(2024, 1, 1),
+            time=time(20),
+            dubbed=False,
+            cinobo_pass=False,
+        )
+    HallLoader.prune([kept])
+    assert [place.hall_id for place in MoviePlace.select()] == [kept.url]
+    assert [state.url for state in CrawlState.select()] == [kept.url]
+
+
+def test_pipeline_skips_unchanged_pages(
+    pages: dict[str, str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    loaders = [HallLoader(f"/cinema/halls/{name}") for name in "ab"]
+    for loader in loaders:
+        pages[loader.url] = HALL_PAGE.format(name=loader.name)
+    pipeline = get_pipeline()
+    load_all(loaders, pipeline, incremental=True)
+    HallLoader.writer.flush()
+    assert sorted(hall.name for hall in Hall.select()) == [
+        "/cinema/halls/a",
+        "/cinema/halls/b",
+    ]
+    writes = []
+    monkeypatch.setattr(HallLoader, "_write", lambda _, page: writes.append(page))
+    load_all(loaders, pipeline, incremental=True)
+    assert writes == []
+    assert pipeline.stages[-1].stats.processed == 4
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_unresolved_movie_is_retried(
+    pages: dict[str, str], monkeypatch: pytest.MonkeyPatch, *, use_async: bool
+) -> None:
+    info = MovieInfo(
+        title="Movie",
+        original_title=None,
+        imdb_rating=7,
+        imdb_votes=10,
+        imdb_url="http://www.imdb.com/title/tt1/",
+    )
+    results = [None, info]
+    searches = []
+
+    def search_movie(titles: list[str], year: int | None = None) -> MovieInfo | None:
+        searches.append((titles, year))
+        return results.pop(0)
+
+    monkeypatch.setattr(MovieLoader.resolver, "search_movie", search_movie)
+    monkeypatch.setattr(
+        athinorama, "get_ratings", lambda ids: dict.fromkeys(ids, (0.0, 0))
+    )
+
+    async def aget_rating(_: str, session: AsyncSession) -> tuple[float, int]:
+        return 0.0, 0
+
+    monkeypatch.setattr(athinorama, "aget_rating", aget_rating)
+    loader = MovieLoader("/cinema/movie/a")
+    pages[loader.url] = MOVIE_PAGE
+
+    def load_movie() -> None:
+        if use_async:
+            asyncio.run(loader.aload(AsyncRun(AsyncSession()), incremental=True))
+        else:
+            load(loader, incremental=True)
+
+    load_movie()
+    MovieLoader.writer.flush()
+    assert list(CrawlState.select()) == []
+    load_movie()
+    MovieLoader.writer.flush()
+    assert len(searches) == 2
+    assert [movie.title for movie in Movie.select()] == ["Movie"]
+    assert [state.url for state in CrawlState.select()] == [loader.url]
+
+
+def test_aload_skips_unchanged_pages(
+    pages: dict[str, str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    loaders = [HallLoader(f"/cinema/halls/{name}") for name in "abc"]
+    for loader in loaders:
+        pages[loader.url] = HALL_PAGE.format(name=loader.name)
+
+    async def aload(loader: Loader) -> None:
+        await loader.aload(AsyncRun(AsyncSession()), incremental=True)
+
+    def aload_all() -> None:
+        asyncio.run(run_bounded(aload, loaders, 2))
+        HallLoader.writer.flush()
+
+    aload_all()
+    assert Hall.select().count() == 3
+    writes = []
+    monkeypatch.setattr(HallLoader, "_write", lambda _, page: writes.append(page))
+    pages[loaders[0].url] = HALL_PAGE.format(name="A")
+    aload_all()
+    assert [page.name for page in writes] == ["A"]
@@ -0,0 +1,200 @@
+import asyncio
+from collections.abc import Iterator
+from datetime import timedelta
+
+import pytest
+from peewee import SqliteDatabase
+
+from loaders import letterboxd
+from loaders.letterboxd import aget_rating, get_imdb_urls, get_ratings, link, sync_list
+from loaders.session import AsyncSession
+from orm.models import (
+    LetterboxdFilm,
+    LetterboxdList,
+    LetterboxdRating,
+    ListEntry,
+    Movie,
+    MovieStatus,
+    User,
+    WantToWatch,
+    Watched,
+)
+
+MODELS = [
+    LetterboxdFilm,
+    LetterboxdList,
+    LetterboxdRating,
+    ListEntry,
+    Movie,
+    MovieStatus,
+    User,
+    WantToWatch,
+    Watched,
+]
+LIST_URL = "https://letterboxd.com/user/watchlist/"
+
+LIST_PAGE = """
+<ul>{films}</ul>
+<ul>{pages}</ul>
+"""
+FILM = '<li><div data-target-link="/film/{slug}/"></div></li>'
+PAGE = '<li><a href="/user/watchlist/page/{page}/">{page}</a></li>'
+FILM_PAGE = '<a href="http://www.imdb.com/title/tt{imdb_id}/maindetails">IMDb</a>'
+RATING_PAGE = """
+<script type="application/ld+json">
+/* <![CDATA[ */
+{{"@type":"Movie","aggregateRating":{{"ratingValue":{rating},"ratingCount":{votes}}}}}
+/* ]]> */
+</script>
+<script>var x = {{}};</script>
+"""
+
+
+def _list_page(slugs: list[str], num_pages: int) -> str:
+    return LIST_PAGE.format(
+        films="".join(FILM.format(slug=slug) for slug in slugs),
+        pages="".join(PAGE.format(page=page) for page in range(2, num_pages + 1)),
+    )
+
+
+@pytest.fixture()
+def fetched() -> list[str]:
+    return []
+
+
+@pytest.fixture()
+def pages(
+    monkeypatch: pytest.MonkeyPatch, fetched: list[str]
+) -> Iterator[dict[str, str]]:
+    pages = {
+        f"https://letterboxd.com/film/{slug}/": FILM_PAGE.format(imdb_id=imdb_id)
+        for slug, imdb_id in (("a", "1"), ("b", "2"), ("c", "3"))
+    }
+    database = SqliteDatabase(":memory:")
+
+    def fetch(url: str) -> bytes:
+        fetched.append(url)
+        return pages[url].encode()
+
+    monkeypatch.setattr(letterboxd, "fetch", fetch)
+    monkeypatch.setattr(letterboxd, "database", database)
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        User.create(letterboxd_id="user")
+        yield pages
+
+
+def _entries() -> set[str]:
+    return {entry.imdb_url for entry in ListEntry.select()}
+
+
+def test_unchanged_list_is_skipped(pages: dict[str, str], fetched: list[str]) -> None:
+    pages[LIST_URL] = _list_page(["a"], 2)
+    pages[LIST_URL + "page/2/"] = _list_page(["b"], 2)
+    assert sync_list("user", "watchlist")
+    assert _entries() == {
+        "http://www.imdb.com/title/tt1/",
+        "http://www.imdb.com/title/tt2/",
+    }
+    fetched.clear()
+    assert not sync_list("user", "watchlist")
+    assert fetched == [LIST_URL]
+
+
+def test_changed_first_page_is_resynced(pages: dict[str, str]) -> None:
+    pages[LIST_URL] = _list_page(["a"], 1)
+    sync_list("user", "watchlist")
+    pages[LIST_URL] = _list_page(["c", "a"], 1)
+    assert sync_list("user", "watchlist")
+    assert _entries() == {
+        "http://www.imdb.com/title/tt1/",
+        "http://www.imdb.com/title/tt3/",
+    }
+
+
+def test_only_new_films_are_fetched(pages: dict[str, str], fetched: list[str]) -> None:
+    pages[LIST_URL] = _list_page(["a", "b"], 1)
+    pages["https://letterboxd.com/film/d/"] = "<p>No IMDb link</p>"
+    sync_list("user", "watchlist")
+    fetched.clear()
+    pages[LIST_URL] = _list_page(["c", "d"], 2)
+    pages[LIST_URL + "page/2/"] = _list_page(["a", "d"], 2)
+    assert sync_list("user", "watchlist")
+    assert sorted(fetched) == [
+        "https://letterboxd.com/film/c/",
+        "https://letterboxd.com/film/d/",
+        LIST_URL,
+        LIST_URL + "page/2/",
+    ]
+    assert _entries() == {
+        "http://www.imdb.com/title/tt1/",
+        "http://www.imdb.com/title/tt3/",
+    }
+    fetched.clear()
+    pages[LIST_URL] = _list_page(["d"], 1)
+    assert sync_list("user", "watchlist")
+    assert fetched == [LIST_URL]
+
+
+def test_films_without_imdb_url_are_refetched(
+    pages: dict[str, str], fetched: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pages["https://letterboxd.com/film/d/"] = "<p>Error</p>"
+    assert get_imdb_urls(["a", "d"]) == ["http://www.imdb.com/title/tt1/"]
+    fetched.clear()
+    assert get_imdb_urls(["a", "d"]) == ["http://www.imdb.com/title/tt1/"]
+    assert fetched == []
+    pages["https://letterboxd.com/film/d/"] = FILM_PAGE.format(imdb_id="4")
+    monkeypatch.setattr(letterboxd, "FILM_NEGATIVE_TTL", timedelta(0))
+    assert get_imdb_urls(["a", "d"]) == [
+        "http://www.imdb.com/title/tt1/",
+        "http://www.imdb.com/title/tt4/",
+    ]
+    assert fetched == ["https://letterboxd.com/film/d/"]
+
+
+def test_link_only_keeps_screened_movies(pages: dict[str, str]) -> None:
+    pages[LIST_URL] = _list_page(["a", "b"], 1)
+    sync_list("user", "watchlist")
+    Movie.create(
+        url="m",
+        title="m",
+        rating=0,
+        votes=0,
+        critics_rating=0,
+        critics_votes=0,
+        imdb_url="http://www.imdb.com/title/tt2/",
+    )
+    link("user")
+    assert [row.movie_id for row in WantToWatch.select()] == [
+        "http://www.imdb.com/title/tt2/"
+    ]
+    assert MovieStatus.select().count() == 1
+
+
+def test_ratings_are_cached(
+    pages: dict[str, str], fetched: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pages["https://letterboxd.com/imdb/tt1"] = RATING_PAGE.format(rating=4.2, votes=10)
+    pages["https://letterboxd.com/imdb/tt2"] = "<html></html>"
+    assert get_ratings(["tt1", "tt2", "tt1"]) == {"tt1": (4.2, 10), "tt2": (0, 0)}
+    assert get_ratings(["tt1", "tt3"]) == {"tt1": (4.2, 10), "tt3": (0, 0)}
+    assert sorted(fetched) == [
+        "https://letterboxd.com/imdb/tt1",
+        "https://letterboxd.com/imdb/tt2",
+        "https://letterboxd.com/imdb/tt3",
+    ]
+    fetched.clear()
+    pages["https://letterboxd.com/imdb/tt1"] = RATING_PAGE.format(rating=4, votes=11)
+    monkeypatch.setattr(letterboxd, "RATING_MAX_AGE", timedelta(0))
+    assert get_ratings(["tt1"]) == {"tt1": (4, 11)}
+    assert fetched == ["https://letterboxd.com/imdb/tt1"]
+
+
+def test_failed_async_rating_has_no_votes(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def afetch(url: str, session: AsyncSession) -> bytes:
+        raise OSError(url)
+
+    monkeypatch.setattr(letterboxd, "afetch", afetch)
+    monkeypatch.setattr(letterboxd, "_get_cached_ratings", lambda _: {})
+    assert asyncio.run(aget_rating("tt1", AsyncSession())) == (0, 0)
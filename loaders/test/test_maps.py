@@ -0,0 +1,81 @@
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from peewee import SqliteDatabase
+
+from loaders import maps
+from orm.models import Geocode, Hall
+
+MODELS = [Geocode, Hall]
+
+
+class Client:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.addresses: list[str] = []
+        self.lock = threading.Lock()
+
+    def geocode(self, address: str, components: dict[str, str]) -> list[dict]:
+        with self.lock:
+            self.addresses.append(address)
+        time.sleep(0.05)
+        location = {"lat": 37.98, "lng": 23.73}
+        return [{"geometry": {"location": location}}]
+
+
+@pytest.fixture()
+def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Client]:
+    database = SqliteDatabase(tmp_path / "test.db")
+    client = Client("key")
+    monkeypatch.setattr(maps, "database", database)
+    monkeypatch.setattr(maps, "_get_client", lambda: client)
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        yield client
+
+
+def test_geocodes_are_cached(client: Client) -> None:
+    assert maps.get_lat_lng("Cine Paris") == (37.98, 23.73)
+    assert maps.get_lat_lng("cine  paris.") == (37.98, 23.73)
+    assert client.addresses == ["Cine Paris"]
+
+
+def test_halls_are_a_fallback(client: Client) -> None:
+    Hall.create(url="h", name="Cine Paris", lat=38, lng=23.7, open_air=True)
+    assert maps.get_lat_lng("CINE PARIS") == (38, 23.7)
+    assert client.addresses == []
+
+
+def test_concurrent_lookups_are_shared(client: Client) -> None:
+    with ThreadPoolExecutor(4) as executor:
+        locations = list(executor.map(maps.get_lat_lng, ["Cine Paris"] * 4))
+    assert locations == [(37.98, 23.73)] * 4
+    assert client.addresses == ["Cine Paris"]
+
+
+def test_batch(client: Client) -> None:
+    maps.get_lat_lng("Cine Paris")
+    locations = maps.get_lat_lngs(["Cine Paris", "Aigli", "aigli"])
+    assert set(locations) == {"Cine Paris", "Aigli", "aigli"}
+    assert client.addresses == ["Cine Paris", "Aigli"]
+
+
+def test_batch_reads_the_halls_once(
+    client: Client, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    Hall.create(url="h", name="Cine Paris", lat=38, lng=23.7, open_air=True)
+    reads = []
+    get_hall_lat_lngs = maps._get_hall_lat_lngs  # noqa: SLF001
+
+    def read_halls() -> dict[str, tuple[float, float]]:
+        reads.append(1)
+        return get_hall_lat_lngs()
+
+    monkeypatch.setattr(maps, "_get_hall_lat_lngs", read_halls)
+    locations = maps.get_lat_lngs(["CINE PARIS", "Aigli"])
+    assert locations == {"CINE PARIS": (38, 23.7), "Aigli": (37.98, 23.73)}
+    assert reads == [1]
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from loaders import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset() -> Iterator[None]:
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_timed_records_failures() -> None:
+    with metrics.timed("parse", page="movie"):
+        pass
+    with pytest.raises(ValueError), metrics.timed("parse", page="movie"):  # noqa: PT011
+        raise ValueError
+    timer = metrics.get_timers()["parse", (("page", "movie"),)]
+    assert timer.count == 2
+    assert timer.max <= timer.seconds
+
+
+def test_to_openmetrics() -> None:
+    metrics.observe("http_request", 0.5, host="letterboxd.com")
+    metrics.observe("http_request", 0.25, host="letterboxd.com")
+    metrics.count("imdb_attempts", call="search_movie")
+    metrics.count("imdb_attempts", 2, call="search_movie")
+    metrics.count("resolutions", found="true", source='a "b"')
+    assert metrics.to_openmetrics() == (
+        "# TYPE loaders_http_request_seconds summary\n"
+        "# UNIT loaders_http_request_seconds seconds\n"
+        'loaders_http_request_seconds_count{host="letterboxd.com"} 2\n'
+        'loaders_http_request_seconds_sum{host="letterboxd.com"} 0.75\n'
+        "# TYPE loaders_imdb_attempts counter\n"
+        'loaders_imdb_attempts_total{call="search_movie"} 3\n'
+        "# TYPE loaders_resolutions counter\n"
+        'loaders_resolutions_total{found="true",source="a \\"b\\""} 1\n'
+        "# EOF\n"
+    )
+
+
+def test_profiled_samples_every_thread(tmp_path: Path) -> None:
+    path = tmp_path / "run.folded"
+    stopped = threading.Event()
+
+    def _spin() -> None:
+        while not stopped.is_set():
+            pass
+
+    with metrics.profiled(path):
+        thread = threading.Thread(target=_spin)
+        thread.start()
+        time.sleep(0.1)
+        stopped.set()
+        thread.join()
+    stacks = path.read_text(encoding="utf-8").splitlines()
+    assert any("_spin" in stack for stack in stacks)
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from loaders.pipeline import BatchStage, Pipeline, Stage
+
+
+def _fail_on_three(item: int) -> int:
+    if item == 3:
+        raise ValueError(item)
+    return item
+
+
+def test_run() -> None:
+    pipeline = Pipeline([
+        Stage("double", lambda item: item * 2, workers=4),
+        Stage("odd", lambda item: item if item % 4 else None, workers=2),
+        Stage("decrement", lambda item: item - 1),
+    ])
+    assert sorted(pipeline.run(range(10))) == [1, 5, 9, 13, 17]
+    stats = [stage.stats for stage in pipeline.stages]
+    assert [(s.processed, s.dropped, s.errors) for s in stats] == [
+        (10, 0, 0),
+        (5, 5, 0),
+        (5, 0, 0),
+    ]
+
+
+def test_errors_are_counted() -> None:
+    pipeline = Pipeline([Stage("fail", _fail_on_three, workers=2)])
+    assert sorted(pipeline.run(range(5))) == [0, 1, 2, 4]
+    assert pipeline.stages[0].stats.errors == 1
+
+
+def test_queues_are_bounded() -> None:
+    fed = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def feed() -> object:
+        for item in range(100):
+            with lock:
+                fed.append(item)
+            yield item
+
+    def block(item: int) -> int:
+        release.wait()
+        return item
+
+    pipeline = Pipeline([Stage("block", block, queue_size=2)])
+    thread = threading.Thread(target=pipeline.run, args=(feed(),))
+    thread.start()
+    time.sleep(0.1)
+    with lock:
+        # One item is held by the worker, two are queued, one waits on the queue.
+        assert len(fed) == 4
+    release.set()
+    thread.join()
+    assert pipeline.stages[0].stats.processed == 100
+
+
+def test_batches() -> None:
+    batches = []
+
+    def odd(items: list[int]) -> list[int | None]:
+        batches.append(len(items))
+        return [item if item % 2 else None for item in items]
+
+    pipeline = Pipeline([
+        Stage("identity", lambda item: item, workers=4),
+        BatchStage("odd", odd, batch_size=8, wait=0.1),
+    ])
+    assert sorted(pipeline.run(range(20))) == list(range(1, 20, 2))
+    assert sum(batches) == 20
+    assert max(batches) <= 8
+    stats = pipeline.stages[1].stats
+    assert (stats.processed, stats.dropped) == (10, 10)
+
+
+def test_empty() -> None:
+    pipeline = Pipeline([Stage("a", str), Stage("b", str, workers=3)])
+    assert pipeline.run([]) == []
@@ -0,0 +1,72 @@
+import asyncio
+from collections.abc import Iterator
+
+import pytest
+
+from loaders.scheduler import run_bounded
+
+
+def test_at_most_limit_items_run_at_once() -> None:
+    running = 0
+    peak = 0
+    done = []
+
+    async def function(item: int) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        done.append(item)
+
+    asyncio.run(run_bounded(function, range(10), 3))
+    assert peak == 3
+    assert sorted(done) == list(range(10))
+
+
+def test_items_are_pulled_lazily() -> None:
+    pulled = []
+
+    def items() -> Iterator[int]:
+        for item in range(10):
+            pulled.append(item)
+            yield item
+
+    async def function(item: int) -> None:
+        assert len(pulled) <= item + 2
+        await asyncio.sleep(0)
+
+    asyncio.run(run_bounded(function, items(), 2))
+    assert pulled == list(range(10))
+
+
+def test_failures_are_logged_and_do_not_stop_other_items(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    done = []
+
+    async def function(item: int) -> None:
+        await asyncio.sleep(0)
+        if item == 1:
+            raise ValueError(item)
+        done.append(item)
+
+    asyncio.run(run_bounded(function, range(4), 2))
+    assert sorted(done) == [0, 2, 3]
+    assert [record.message for record in caplog.records] == ["Failed 1"]
+    assert caplog.records[0].exc_info is not None
+
+
+def test_cancellation_stops_every_item() -> None:
+    started = []
+
+    async def function(item: int) -> None:
+        started.append(item)
+        await asyncio.sleep(60)
+
+    async def main() -> None:
+        await asyncio.wait_for(run_bounded(function, range(10), 2), 0.05)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(main())
+    assert started == [0, 1]
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+import pytest
+
+from loaders import session
+from loaders.session import AsyncSession, HostLimits, Session, TokenBucket
+
+
+class _Clock:
+    """Stand-in for the `time` module of the session, sleeping instantly."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _Handler(BaseHTTPRequestHandler):
+    replies: ClassVar[list[tuple[int, dict[str, str]]]] = []
+    requests = 0
+    running = 0
+    peak = 0
+    delay = 0.0
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:  # noqa: N802
+        cls = type(self)
+        with cls.lock:
+            cls.requests += 1
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+            status, headers = cls.replies.pop(0) if cls.replies else (200, {})
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.running -= 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture()
+def server(monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    monkeypatch.setattr(_Handler, "replies", [])
+    monkeypatch.setattr(_Handler, "requests", 0)
+    monkeypatch.setattr(_Handler, "peak", 0)
+    monkeypatch.setattr(session, "_HOSTS", {})
+    # Rates in powers of two keep the fake clock's arithmetic exact.
+    monkeypatch.setitem(
+        session.LIMITS, "127.0.0.1", HostLimits(rate=4, burst=4, connections=4)
+    )
+    monkeypatch.setattr(session.random, "uniform", lambda _, b: b)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/page"
+    httpd.shutdown()
+
+
+@pytest.fixture()
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    clock = _Clock()
+    post_init = TokenBucket.__post_init__
+
+    def start_at_clock(bucket: TokenBucket) -> None:
+        post_init(bucket)
+        bucket.updated_at = clock.now
+
+    monkeypatch.setattr(session, "time", clock)
+    monkeypatch.setattr(TokenBucket, "__post_init__", start_at_clock)
+    return clock
+
+
+def test_bucket_refills_at_rate(clock: _Clock) -> None:
+    bucket = TokenBucket(rate=2, capacity=2)
+    take = bucket._take  # noqa: SLF001
+    assert [take(), take(), take()] == [0, 0, 0.5]
+    clock.now += 0.5
+    assert take() == 0
+    clock.now += 10
+    assert [take(), take(), take()] == [0, 0, 0.5]
+
+
+def test_bucket_pause_holds_back_callers(clock: _Clock) -> None:
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.pause(3)
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(3.5)
+
+
+def test_retry_after() -> None:
+    retry_after = session._retry_after  # noqa: SLF001
+    in_a_minute = format_datetime(datetime.now(UTC) + timedelta(minutes=1), usegmt=True)
+    assert retry_after({"Retry-After": "120"}) == 120
+    assert retry_after({"Retry-After": in_a_minute}) == pytest.approx(60, abs=2)
+    assert retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
+    assert retry_after({"Retry-After": "soon"}) is None
+    assert retry_after({}) is None
+
+
+def test_backoff_is_capped(monkeypatch: pytest.MonkeyPatch) -> None:
+    backoff = session._backoff  # noqa: SLF001
+    monkeypatch.setattr(session.random, "uniform", lambda _, b: b)
+    assert backoff(0) == session.BACKOFF_BASE
+    assert backoff(2) == 4 * session.BACKOFF_BASE
+    assert backoff(20) == session.BACKOFF_MAX
+
+
+@pytest.mark.usefixtures("clock")
+def test_retries_server_errors_and_too_many_requests(server: str) -> None:
+    _Handler.replies = [(503, {}), (429, {"Retry-After": "7"})]
+    response = Session().get(server)
+    assert response.status_code == 200
+    assert _Handler.requests == 3
+    host = session.stats()["127.0.0.1"]
+    assert (host.requests, host.retries, host.errors) == (3, 2, 0)
+
+
+def test_too_many_requests_pauses_the_host(server: str, clock: _Clock) -> None:
+    _Handler.replies = [(429, {"Retry-After": "7"})]
+    Session().get(server)
+    # The retry waits out Retry-After, then for the paused bucket to refill.
+    assert clock.sleeps == [7, 0.25]
+
+
+@pytest.mark.usefixtures("clock")
+def test_last_response_is_returned_once_retries_run_out(
+    server: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(session, "MAX_RETRIES", 2)
+    _Handler.replies = [(500, {})] * 5
+    assert Session().get(server).status_code == 500
+    assert _Handler.requests == 3
+
+
+@pytest.mark.usefixtures("clock")
+def test_client_errors_are_not_retried(server: str) -> None:
+    _Handler.replies = [(404, {})]
+    assert Session().get(server).status_code == 404
+    assert _Handler.requests == 1
+
+
+def test_connections_are_limited_per_host(
+    server: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setitem(
+        session.LIMITS, "127.0.0.1", HostLimits(rate=1000, burst=1000, connections=2)
+    )
+    monkeypatch.setattr(_Handler, "delay", 0.05)
+    http = Session()
+    threads = [threading.Thread(target=http.get, args=(server,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _Handler.requests == 6
+    assert _Handler.peak == 2
+
+
+def test_async_session_retries(server: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(session, "BACKOFF_BASE", 0.01)
+    _Handler.replies = [(502, {})]
+
+    async def main() -> int:
+        http = AsyncSession()
+        try:
+            return (await http.get(server)).status_code
+        finally:
+            await http.aclose()
+
+    assert asyncio.run(main()) == 200
+    assert _Handler.requests == 2
@@ -0,0 +1,57 @@
+import random
+import string
+
+from rapidfuzz.distance import Levenshtein
+
+from loaders.titles import TitleIndex, normalize
+
+TITLES = [
+    "Perfect Days",
+    "Perfect Day",
+    "Poor Things",
+    "Vertigo",
+    "Τέλειες μέρες",
+    "Καημένα πλάσματα",
+]
+
+
+def test_normalize() -> None:
+    assert normalize("  Anatomie d'une  Chute! ") == "anatomie dune chute"
+
+
+def test_match_is_bounded_and_sorted() -> None:
+    index = TitleIndex.from_titles((title, title) for title in TITLES)
+    assert index.match("perfect days!", 1) == [("Perfect Days", 0), ("Perfect Day", 1)]
+    assert index.match("Perfect Dys", 0) == []
+
+
+def test_nearest() -> None:
+    index = TitleIndex.from_titles((title, title) for title in TITLES)
+    assert index.nearest("Τέλειες μερες", 2) == ("Τέλειες μέρες", 1)
+    assert index.nearest("Vertigo Sea", 2) is None
+    assert index.nearest("Vertigo Sea") == ("Vertigo", 4)
+
+
+def test_duplicate_titles_keep_every_value() -> None:
+    index = TitleIndex.from_titles([("Vertigo", 1958), ("VERTIGO", 1994)])
+    assert len(index) == 1
+    assert index.match("Vertigo", 0) == [(1958, 0), (1994, 0)]
+
+
+def test_match_agrees_with_a_linear_scan() -> None:
+    rng = random.Random(0)
+    titles = [
+        "".join(rng.choices(string.ascii_lowercase[:4], k=rng.randint(1, 8)))
+        for _ in range(500)
+    ]
+    index = TitleIndex.from_titles((title, title) for title in titles)
+    for query in titles[:50]:
+        expected = {
+            title for title in titles if Levenshtein.distance(query, title) <= 2
+        }
+        assert {title for title, _ in index.match(query, 2)} == expected
+        nearest = index.nearest(query + "x")
+        assert nearest is not None
+        assert nearest[1] == min(
+            Levenshtein.distance(query + "x", title) for title in titles
+        )
@@ -0,0 +1,21 @@
+"""Scoped database connections for worker threads."""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from peewee import Database
+
+
+@contextmanager
+def scoped_connection(database: Database) -> Iterator[None]:
+    """Hold a connection for a block, releasing it after if the block opened it.
+
+    Pooled connections are per thread and only go back to the pool on close, so
+    worker threads scope their queries with this. Unlike `connection_context`,
+    a connection the thread already had open is left open.
+    """
+    if not database.is_closed():
+        yield
+        return
+    with database.connection_context():
+        yield
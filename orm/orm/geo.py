@@ -0,0 +1,126 @@
+"""Spatial index of points on the earth, queried by great-circle distance."""
+
+import dataclasses
+import math
+from collections.abc import Iterable
+from typing import Self
+
+EARTH_RADIUS = 6371.0088
+CELL_SIZE = 0.05
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Get the great-circle distance of two points in kilometres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+@dataclasses.dataclass(slots=True)
+class GridIndex[T]:
+    """Index of values by location, bucketed in cells of `cell_size` degrees.
+
+    A radius query only measures the points of the cells overlapping the
+    bounding box of its circle, so its cost depends on how many points are
+    near the location rather than on the size of the index.
+    """
+
+    cell_size: float = CELL_SIZE
+    _cells: dict[tuple[int, int], list[T]] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    _points: dict[T, tuple[float, float]] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+
+    @classmethod
+    def from_points(
+        cls, points: Iterable[tuple[T, float, float]], cell_size: float = CELL_SIZE
+    ) -> Self:
+        """Build an index of `(value, lat, lng)` points."""
+        index = cls(cell_size)
+        for value, lat, lng in points:
+            index.add(value, lat, lng)
+        return index
+
+    @property
+    def _num_columns(self: Self) -> int:
+        return math.ceil(360 / self.cell_size)
+
+    def _get_cell(self: Self, lat: float, lng: float) -> tuple[int, int]:
+        return (
+            math.floor(lat / self.cell_size),
+            math.floor((lng + 180) / self.cell_size) % self._num_columns,
+        )
+
+    def add(self: Self, value: T, lat: float, lng: float) -> None:
+        """Index a value at a location."""
+        lat, lng = float(lat), float(lng)
+        self._points[value] = lat, lng
+        self._cells.setdefault(self._get_cell(lat, lng), []).append(value)
+
+    def distance(self: Self, value: T, lat: float, lng: float) -> float:
+        """Get the distance of an indexed value to a location in kilometres."""
+        return haversine(*self._points[value], lat, lng)
+
+    def _get_candidates(self: Self, lat: float, lng: float, radius: float) -> list[T]:
+        """Get the values of the cells overlapping the bounding box of a circle."""
+        lat_span = math.degrees(radius / EARTH_RADIUS)
+        cos = math.cos(math.radians(min(abs(lat) + lat_span, 90)))
+        sin = math.sin(radius / EARTH_RADIUS / 2)
+        min_row = math.floor((lat - lat_span) / self.cell_size)
+        max_row = math.floor((lat + lat_span) / self.cell_size)
+        if sin < cos * math.sin(math.radians(90 - self.cell_size)):
+            lng_span = math.degrees(2 * math.asin(sin / cos))
+            min_column = self._get_cell(lat, lng - lng_span)[1]
+            num_columns = math.floor(2 * lng_span / self.cell_size) + 2
+        else:
+            # The circle spans every longitude, or nearly so.
+            min_column, num_columns = 0, self._num_columns
+        if (max_row - min_row + 1) * num_columns > len(self._cells):
+            return list(self._points)
+        return [
+            value
+            for row in range(min_row, max_row + 1)
+            for column in range(min_column, min_column + num_columns)
+            for value in self._cells.get((row, column % self._num_columns), ())
+        ]
+
+    def within(
+        self: Self, lat: float, lng: float, radius: float | None = None
+    ) -> list[tuple[T, float]]:
+        """Get the values within a radius in kilometres of a location, nearest first."""
+        candidates = (
+            list(self._points)
+            if radius is None
+            else self._get_candidates(lat, lng, radius)
+        )
+        matches = [(value, self.distance(value, lat, lng)) for value in candidates]
+        if radius is not None:
+            matches = [match for match in matches if match[1] <= radius]
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def nearest(
+        self: Self, lat: float, lng: float, max_distance: float | None = None
+    ) -> tuple[T, float] | None:
+        """Get the value nearest to a location and its distance, if within bound.
+
+        The search radius starts at one cell and doubles until a value is found.
+        """
+        radius = math.radians(self.cell_size) * EARTH_RADIUS
+        while self._points:
+            if max_distance is not None:
+                radius = min(radius, max_distance)
+            if matches := self.within(lat, lng, radius):
+                return matches[0]
+            if radius == max_distance or radius >= math.pi * EARTH_RADIUS:
+                return None
+            radius *= 2
+        return None
+
+    def __len__(self: Self) -> int:
+        return len(self._points)
@@ -1,21 +1,43 @@
+import os
+from datetime import UTC, datetime
+from enum import StrEnum
 from pathlib import Path
+from typing import Any
 
 from peewee import (
+    AutoField,
     BooleanField,
     CharField,
+    CompositeKey,
     DateField,
+    DateTimeField,
     DecimalField,
     ForeignKeyField,
     IntegerField,
     Model,
     PostgresqlDatabase,
     TimeField,
+    Value,
 )
+from playhouse.pool import PooledPostgresqlDatabase
+
+MAX_CONNECTIONS = int(os.environ.get("DATABASE_MAX_CONNECTIONS", "20"))
+STALE_TIMEOUT = 300
+POOL_TIMEOUT = 10
 
 password = Path("/etc/secrets/postgres-password").read_text(encoding="utf-8").strip()
 
-database = PostgresqlDatabase(
-    "postgres", user="postgres", password=password, host="database", port=5432
+# Connections go back to the pool on close(); callers that hold one per
+# thread should scope it with orm.connection.scoped_connection().
+database = PooledPostgresqlDatabase(
+    "postgres",
+    user="postgres",
+    password=password,
+    host="database",
+    port=5432,
+    max_connections=MAX_CONNECTIONS,
+    stale_timeout=STALE_TIMEOUT,
+    timeout=POOL_TIMEOUT,
 )
 
 
@@ -57,6 +79,12 @@ class MoviePlace(BaseModel):
     dubbed = BooleanField()
     cinobo_pass = BooleanField()
 
+    class Meta:
+        indexes = (
+            (("date", "time"), False),
+            (("movie", "hall", "date", "time"), False),
+        )
+
 
 class User(BaseModel):
     """User data."""
@@ -70,9 +98,276 @@ class Watched(BaseModel):
     user = ForeignKeyField(User)
     movie = ForeignKeyField(Movie, field="imdb_url")
 
+    class Meta:
+        indexes = ((("user", "movie"), False),)
+
 
 class WantToWatch(BaseModel):
     """Film user wants to watch."""
 
     user = ForeignKeyField(User)
     movie = ForeignKeyField(Movie, field="imdb_url")
+
+    class Meta:
+        indexes = ((("user", "movie"), False),)
+
+
+class LetterboxdList(BaseModel):
+    """Fingerprint of a user's Letterboxd list as of its last sync."""
+
+    user = ForeignKeyField(User)
+    name = CharField()
+    num_pages = IntegerField()
+    digest = CharField()
+    synced_at = DateTimeField()
+
+    class Meta:
+        primary_key = CompositeKey("user", "name")
+
+
+class LetterboxdFilm(BaseModel):
+    """IMDb URL of a Letterboxd film, or none if its page does not link to IMDb."""
+
+    slug = CharField(primary_key=True)
+    imdb_url = CharField(null=True)
+    fetched_at = DateTimeField()
+
+
+class ListEntry(BaseModel):
+    """IMDb URL of a film in a user's Letterboxd list, whether screened or not."""
+
+    user = ForeignKeyField(User)
+    list_name = CharField()
+    imdb_url = CharField(index=True)
+
+    class Meta:
+        primary_key = CompositeKey("user", "list_name", "imdb_url")
+
+
+class Status(StrEnum):
+    """Status of a movie for a user."""
+
+    WATCHED = "watched"
+    WANT_TO_WATCH = "want_to_watch"
+    UNLISTED = "unlisted"
+
+
+class MovieStatus(BaseModel):
+    """Status of a movie in a user's lists, unlisted if there is none."""
+
+    user = ForeignKeyField(User)
+    movie = ForeignKeyField(Movie, field="imdb_url")
+    status = CharField(choices=[(status, status) for status in Status])
+
+    class Meta:
+        primary_key = CompositeKey("user", "movie")
+
+    @classmethod
+    def sync(cls, user: User | str) -> None:
+        """Rebuild the statuses of a user, or Letterboxd id, from their lists.
+
+        A movie both watched and in the watchlist counts as watched.
+        """
+        fields = [cls.user, cls.movie, cls.status]
+        with cls._meta.database.atomic():
+            cls.delete().where(cls.user == user).execute()
+            cls.insert_from(
+                WantToWatch.select(
+                    WantToWatch.user,
+                    WantToWatch.movie,
+                    Value(Status.WANT_TO_WATCH.value),
+                )
+                .where(WantToWatch.user == user)
+                .distinct(),
+                fields,
+            ).execute()
+            cls.insert_from(
+                Watched.select(Watched.user, Watched.movie, Value(Status.WATCHED.value))
+                .where(Watched.user == user)
+                .distinct(),
+                fields,
+            ).on_conflict(
+                conflict_target=[cls.user, cls.movie],
+                update={cls.status: Status.WATCHED.value},
+            ).execute()
+
+
+class CrawlState(BaseModel):
+    """Fingerprint of a crawled page as of its last load."""
+
+    url = CharField(primary_key=True)
+    digest = CharField()
+    parent = CharField(null=True, index=True)
+    crawled_at = DateTimeField()
+
+
+class ImdbResolution(BaseModel):
+    """IMDb movie resolved from a movie's titles and year, or none if not found."""
+
+    key = CharField(primary_key=True)
+    titles = CharField()
+    year = IntegerField(null=True)
+    title = CharField(null=True)
+    original_title = CharField(null=True)
+    imdb_rating = DecimalField(null=True)
+    imdb_votes = IntegerField(null=True)
+    imdb_url = CharField(null=True)
+    resolved_at = DateTimeField()
+
+
+class Geocode(BaseModel):
+    """Coordinates of an address, keyed by the normalized address."""
+
+    address = CharField(primary_key=True)
+    lat = DecimalField()
+    lng = DecimalField()
+    geocoded_at = DateTimeField()
+
+
+class LetterboxdRating(BaseModel):
+    """Letterboxd rating of an IMDb movie, as of when it was fetched."""
+
+    imdb_id = CharField(primary_key=True)
+    rating = DecimalField()
+    votes = IntegerField()
+    fetched_at = DateTimeField()
+
+
+class DataVersion(BaseModel):
+    """Version of the loaded data, bumped after every load."""
+
+    id = IntegerField(primary_key=True, default=1)
+    version = IntegerField(default=0)
+    updated_at = DateTimeField()
+
+    @classmethod
+    def get_version(cls) -> int:
+        """Get the current version, 0 if the data was never loaded."""
+        row = cls.get_or_none(cls.id == 1)
+        return row.version if row is not None else 0
+
+    @classmethod
+    def bump(cls) -> int:
+        """Increment the version and return it."""
+        now = datetime.now(tz=UTC).replace(tzinfo=None)
+        cls.insert(version=1, updated_at=now).on_conflict(
+            conflict_target=[cls.id],
+            update={cls.version: cls.version + 1, cls.updated_at: now},
+        ).execute()
+        return cls.get_version()
+
+
+class Screening(BaseModel):
+    """Movie place flattened with its movie and hall, ranked by score.
+
+    On PostgreSQL this is a materialized view, refreshed by the loader, so the
+    listing query reads one indexed relation and needs no join or sort.
+    """
+
+    id = AutoField()
+    movie = CharField()
+    hall = CharField()
+    date = DateField()
+    time = TimeField()
+    dubbed = BooleanField()
+    cinobo_pass = BooleanField()
+    title = CharField()
+    original_title = CharField(null=True)
+    imdb_url = CharField()
+    rating = DecimalField()
+    votes = IntegerField()
+    critics_rating = DecimalField()
+    critics_votes = IntegerField()
+    hall_name = CharField()
+    lat = DecimalField()
+    lng = DecimalField()
+    open_air = BooleanField()
+    score = DecimalField()
+
+    class Meta:
+        table_name = "screening"
+        indexes = ((("date", "time"), False),)
+
+    @classmethod
+    def _select(cls) -> Any:  # noqa: ANN401
+        return (
+            MoviePlace.select(
+                MoviePlace.id,
+                MoviePlace.movie.alias("movie"),
+                MoviePlace.hall.alias("hall"),
+                MoviePlace.date,
+                MoviePlace.time,
+                MoviePlace.dubbed,
+                MoviePlace.cinobo_pass,
+                Movie.title,
+                Movie.original_title,
+                Movie.imdb_url,
+                Movie.rating,
+                Movie.votes,
+                Movie.critics_rating,
+                Movie.critics_votes,
+                Hall.name.alias("hall_name"),
+                Hall.lat,
+                Hall.lng,
+                Hall.open_air,
+                (
+                    Movie.rating * Movie.rating
+                    + Movie.critics_rating * Movie.critics_rating * 4
+                ).alias("score"),
+            )
+            .join(Movie)
+            .switch(MoviePlace)
+            .join(Hall)
+        )
+
+    @classmethod
+    def create_view(cls, *, replace: bool = False) -> None:
+        """Create the view and its indexes, or a table outside PostgreSQL.
+
+        An existing view is kept, unless it is replaced after its query or
+        fields changed.
+        """
+        database = cls._meta.database
+        if not isinstance(database, PostgresqlDatabase):
+            if replace:
+                cls.drop_table()
+            cls.create_table()
+            return
+        table_name = cls._meta.table_name
+        sql, params = cls._select().sql()
+        with database.atomic():
+            if replace:
+                database.execute_sql(f"DROP MATERIALIZED VIEW IF EXISTS {table_name}")
+            database.execute_sql(
+                f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table_name} AS {sql}", params
+            )
+            database.execute_sql(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_id"
+                f" ON {table_name} (id)"
+            )
+            cls._schema.create_indexes()
+
+    @classmethod
+    def refresh(cls) -> None:
+        """Recompute the screenings from the movie places."""
+        database = cls._meta.database
+        if isinstance(database, PostgresqlDatabase):
+            database.execute_sql(
+                f"REFRESH MATERIALIZED VIEW CONCURRENTLY {cls._meta.table_name}"
+            )
+            return
+        with database.atomic():
+            cls.delete().execute()
+            cls.insert_from(
+                cls._select(), [field.name for field in cls._meta.sorted_fields]
+            ).execute()
+
+
+Screening.add_index(
+    Screening.score.desc(),
+    Screening.movie,
+    Screening.hall,
+    Screening.date,
+    Screening.time,
+    name="screening_score",
+)
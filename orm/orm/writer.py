@@ -0,0 +1,163 @@
+"""Buffered batch writer for model rows."""
+
+import dataclasses
+import logging
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import Any, Self
+
+from peewee import Database, Field, IntegrityError, Model, ModelDelete, sort_models
+
+from .connection import scoped_connection
+
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 5.0
+
+type _Key = tuple[type[Model], tuple[str, ...], tuple[str, ...]]
+
+
+@dataclasses.dataclass(slots=True)
+class BatchWriter:
+    """Buffer rows by model and insert them with multi-row statements.
+
+    Rows are flushed once `batch_size` rows are buffered or `flush_interval`
+    seconds have passed since the last flush, in a single transaction and in
+    foreign key order. The interval is only checked when a row is added, so
+    callers must `flush` once they are done, or use the writer as a context
+    manager. Rows with a conflict target are upserted. Queued deletes
+    run first in the same transaction, so rows replacing deleted ones are never
+    half written.
+
+    `on_flush` is called with the number of rows and seconds of every flush.
+    """
+
+    batch_size: int = BATCH_SIZE
+    flush_interval: float = FLUSH_INTERVAL
+    on_flush: Callable[[int, float], None] | None = None
+    _batches: dict[_Key, list[dict[str, Any]]] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    _deletes: list[ModelDelete] = dataclasses.field(init=False, default_factory=list)
+    _size: int = dataclasses.field(init=False, default=0)
+    _flushed_at: float = dataclasses.field(init=False, default_factory=time.monotonic)
+    _lock: threading.RLock = dataclasses.field(
+        init=False, default_factory=threading.RLock
+    )
+
+    def add(
+        self: Self,
+        model: type[Model],
+        row: dict[str, Any],
+        conflict_target: Sequence[Field] = (),
+    ) -> None:
+        """Buffer a row, flushing if the batch is full or due."""
+        key = (model, tuple(field.name for field in conflict_target), tuple(row))
+        with self._lock:
+            self._batches.setdefault(key, []).append(row)
+            self._size += 1
+            if (
+                self._size >= self.batch_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+            ):
+                self.flush()
+
+    def delete(self: Self, query: ModelDelete) -> None:
+        """Queue a delete to run before the rows of the next flush.
+
+        Rows of the model buffered earlier are flushed first, so the delete
+        does not remove them.
+        """
+        with self._lock:
+            if any(key[0] is query.model for key in self._batches):
+                self.flush()
+            self._deletes.append(query)
+
+    def flush(self: Self) -> None:
+        """Run every queued delete and insert every buffered row.
+
+        If the transaction fails for another reason than an integrity error,
+        the rows and deletes are buffered again for the next flush.
+        """
+        with self._lock:
+            batches, self._batches, self._size = self._batches, {}, 0
+            deletes, self._deletes = self._deletes, []
+            self._flushed_at = time.monotonic()
+            if not batches and not deletes:
+                return
+            models = {key[0] for key in batches} | {query.model for query in deletes}
+            order = {model: i for i, model in enumerate(sort_models(models))}
+            started_at = time.perf_counter()
+            keys = sorted(batches, key=lambda key: order[key[0]])
+            database = next(iter(models))._meta.database  # noqa: SLF001
+            # Flushes happen on whichever thread fills the batch, so the
+            # thread's pooled connection is released once the rows are in.
+            with scoped_connection(database):
+                try:
+                    _write(database, deletes, [(key, batches[key]) for key in keys])
+                except Exception:
+                    self._requeue(batches, deletes)
+                    raise
+            num_rows = sum(len(rows) for rows in batches.values())
+            logging.debug("Flushed %d rows", num_rows)
+            if self.on_flush is not None:
+                self.on_flush(num_rows, time.perf_counter() - started_at)
+
+    def _requeue(
+        self: Self,
+        batches: dict[_Key, list[dict[str, Any]]],
+        deletes: list[ModelDelete],
+    ) -> None:
+        for key, rows in batches.items():
+            self._batches.setdefault(key, [])[:0] = rows
+            self._size += len(rows)
+        self._deletes[:0] = deletes
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *args: object) -> None:
+        self.flush()
+
+
+def _write(
+    database: Database,
+    deletes: list[ModelDelete],
+    batches: list[tuple[_Key, list[dict[str, Any]]]],
+) -> None:
+    try:
+        with database.atomic():
+            for query in deletes:
+                query.execute()
+            for key, rows in batches:
+                _insert(key, rows).execute()
+    except IntegrityError:
+        logging.warning("Batch insert failed, inserting rows one by one")
+        _write_rows(deletes, batches)
+
+
+def _write_rows(
+    deletes: list[ModelDelete], batches: list[tuple[_Key, list[dict[str, Any]]]]
+) -> None:
+    """Run the deletes, then insert rows one at a time, skipping invalid ones."""
+    for query in deletes:
+        query.execute()
+    for key, rows in batches:
+        for row in rows:
+            try:
+                _insert(key, [row]).execute()
+            except IntegrityError:
+                logging.exception("Failed to insert %s", row)
+
+
+def _insert(key: _Key, rows: list[dict[str, Any]]) -> Any:  # noqa: ANN401
+    model, conflict_target, fields = key
+    query = model.insert_many(rows)
+    if not conflict_target:
+        return query
+    return query.on_conflict(
+        conflict_target=[getattr(model, name) for name in conflict_target],
+        preserve=[
+            getattr(model, name) for name in fields if name not in conflict_target
+        ],
+    )
@@ -0,0 +1,21 @@
+from peewee import SqliteDatabase
+
+from orm.connection import scoped_connection
+
+
+def test_closes_connections_it_opens() -> None:
+    database = SqliteDatabase(":memory:")
+    with scoped_connection(database):
+        assert not database.is_closed()
+        with scoped_connection(database):
+            pass
+        assert not database.is_closed()
+    assert database.is_closed()
+
+
+def test_keeps_open_connections() -> None:
+    database = SqliteDatabase(":memory:")
+    database.connect()
+    with scoped_connection(database):
+        pass
+    assert not database.is_closed()
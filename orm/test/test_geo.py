@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from orm.geo import GridIndex, haversine
+
+ATHENS = 37.98, 23.73
+
+
+def test_haversine() -> None:
+    assert haversine(*ATHENS, *ATHENS) == 0
+    # Athens to Thessaloniki.
+    assert haversine(*ATHENS, 40.64, 22.94) == pytest.approx(303.5, abs=0.1)
+
+
+@pytest.mark.parametrize(
+    ("center", "spread", "radius"),
+    [(ATHENS, 0.2, 3), (ATHENS, 0.2, 50), ((0, 179.9), 1, 40), ((89.9, 0), 1, 30)],
+)
+def test_within_matches_brute_force(
+    center: tuple[float, float], spread: float, radius: float
+) -> None:
+    rng = random.Random(0)
+    points = [
+        (
+            i,
+            max(-90, min(90, center[0] + rng.uniform(-spread, spread))),
+            (center[1] + rng.uniform(-spread, spread) + 180) % 360 - 180,
+        )
+        for i in range(500)
+    ]
+    index = GridIndex.from_points(points)
+    for _, lat, lng in points[:20]:
+        expected = sorted(
+            i for i, _lat, _lng in points if haversine(lat, lng, _lat, _lng) <= radius
+        )
+        assert sorted(i for i, _ in index.within(lat, lng, radius)) == expected
+
+
+def _nearest_key(index: GridIndex[str], lat: float, lng: float) -> str | None:
+    nearest = index.nearest(lat, lng)
+    return nearest[0] if nearest is not None else None
+
+
+def test_nearest() -> None:
+    index = GridIndex.from_points([("a", 37.98, 23.73), ("b", 38.3, 23.73)])
+    assert _nearest_key(index, 38.2, 23.73) == "b"
+    assert index.nearest(*ATHENS) == ("a", 0)
+    assert _nearest_key(index, 40.64, 22.94) == "b"
+    assert index.nearest(40.64, 22.94, max_distance=10) is None
+    assert GridIndex().nearest(*ATHENS) is None
@@ -0,0 +1,123 @@
+from collections.abc import Iterator
+from datetime import date, time
+
+import pytest
+from peewee import SqliteDatabase
+
+from orm.models import (
+    DataVersion,
+    Hall,
+    Movie,
+    MoviePlace,
+    MovieStatus,
+    Screening,
+    Status,
+    User,
+    WantToWatch,
+    Watched,
+)
+
+
+@pytest.fixture()
+def database() -> Iterator[SqliteDatabase]:
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx([DataVersion]):
+        database.create_tables([DataVersion])
+        yield database
+
+
+def test_data_version(database: SqliteDatabase) -> None:
+    assert DataVersion.get_version() == 0
+    assert DataVersion.bump() == 1
+    assert DataVersion.bump() == 2
+    assert DataVersion.get_version() == 2
+
+
+def test_screening_refresh() -> None:
+    models = [Hall, Movie, MoviePlace, Screening]
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx(models):
+        database.create_tables(models[:-1])
+        Screening.create_view()
+        Movie.create(
+            url="m",
+            title="Vertigo",
+            rating=8,
+            votes=1,
+            critics_rating=4,
+            critics_votes=1,
+            imdb_url="i",
+        )
+        Hall.create(url="h", name="Hall", lat=1, lng=2, open_air=True)
+        MoviePlace.create(
+            movie="m",
+            hall="h",
+            date=date(2024, 8, 1),
+            time=time(21),
+            dubbed=False,
+            cinobo_pass=True,
+        )
+        Screening.refresh()
+        screening = Screening.get()
+        assert (screening.title, screening.hall_name, screening.score) == (
+            "Vertigo",
+            "Hall",
+            8 * 8 + (2 * 4) ** 2,
+        )
+
+
+def test_screening_view_is_kept_unless_replaced() -> None:
+    models = [Hall, Movie, MoviePlace, Screening]
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx(models):
+        database.create_tables(models[:-1])
+        Screening.create_view()
+        Movie.create(
+            url="m",
+            title="Vertigo",
+            rating=8,
+            votes=1,
+            critics_rating=4,
+            critics_votes=1,
+            imdb_url="i",
+        )
+        Hall.create(url="h", name="Hall", lat=1, lng=2, open_air=True)
+        MoviePlace.create(
+            movie="m",
+            hall="h",
+            date=date(2024, 8, 1),
+            time=time(21),
+            dubbed=False,
+            cinobo_pass=True,
+        )
+        Screening.refresh()
+        Screening.create_view()
+        assert Screening.select().count() == 1
+        Screening.create_view(replace=True)
+        assert Screening.select().count() == 0
+
+
+def test_movie_status_sync() -> None:
+    models = [Movie, MovieStatus, User, WantToWatch, Watched]
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx(models):
+        database.create_tables(models)
+        for imdb_url in ("a", "b", "c"):
+            Movie.create(
+                url=imdb_url,
+                title=imdb_url,
+                rating=0,
+                votes=0,
+                critics_rating=0,
+                critics_votes=0,
+                imdb_url=imdb_url,
+            )
+        user = User.create(letterboxd_id="user")
+        Watched.create(user=user, movie="a")
+        WantToWatch.create(user=user, movie="a")
+        WantToWatch.create(user=user, movie="b")
+        MovieStatus.create(user=user, movie="c", status=Status.WATCHED)
+        MovieStatus.sync(user)
+        assert {
+            (status.movie_id, status.status) for status in MovieStatus.select()
+        } == {("a", Status.WATCHED), ("b", Status.WANT_TO_WATCH)}
@@ -0,0 +1,107 @@
+from collections.abc import Iterator
+
+import pytest
+from peewee import OperationalError, SqliteDatabase
+
+from orm.models import Hall, Movie, MoviePlace
+from orm.writer import BatchWriter
+
+MODELS = [Hall, Movie, MoviePlace]
+
+
+@pytest.fixture()
+def database() -> Iterator[SqliteDatabase]:
+    database = SqliteDatabase(":memory:", pragmas={"foreign_keys": 1})
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        yield database
+
+
+def _hall(name: str) -> dict[str, object]:
+    return {"url": "h", "name": name, "lat": 0, "lng": 0, "open_air": False}
+
+
+def test_flushes_in_foreign_key_order(database: SqliteDatabase) -> None:
+    with BatchWriter() as writer:
+        writer.add(
+            MoviePlace,
+            {
+                "movie": "m",
+                "hall": "h",
+                "date": "2024-01-01",
+                "time": "20:00",
+                "dubbed": False,
+                "cinobo_pass": False,
+            },
+        )
+        writer.add(Hall, _hall("A"))
+        writer.add(
+            Movie,
+            {
+                "url": "m",
+                "title": "M",
+                "rating": 0,
+                "votes": 0,
+                "critics_rating": 0,
+                "critics_votes": 0,
+                "imdb_url": "i",
+            },
+        )
+        assert MoviePlace.select().count() == 0
+    assert MoviePlace.select().count() == 1
+
+
+def test_upserts_on_conflict(database: SqliteDatabase) -> None:
+    with BatchWriter() as writer:
+        writer.add(Hall, _hall("A"), conflict_target=[Hall.url])
+    with BatchWriter() as writer:
+        writer.add(Hall, _hall("B"), conflict_target=[Hall.url])
+    assert [hall.name for hall in Hall.select()] == ["B"]
+
+
+def test_flushes_when_batch_is_full(database: SqliteDatabase) -> None:
+    writer = BatchWriter(batch_size=1)
+    writer.add(Hall, _hall("A"))
+    assert Hall.select().count() == 1
+
+
+def test_falls_back_to_row_inserts(database: SqliteDatabase) -> None:
+    with BatchWriter() as writer:
+        writer.add(Hall, _hall("A"))
+        writer.add(Hall, _hall("B"))
+    assert [hall.name for hall in Hall.select()] == ["A"]
+
+
+def test_reports_flushes(database: SqliteDatabase) -> None:
+    flushes = []
+    writer = BatchWriter(on_flush=lambda rows, _: flushes.append(rows))
+    writer.add(Hall, _hall("A"))
+    writer.flush()
+    writer.flush()
+    assert flushes == [1]
+
+
+def test_deletes_before_inserting(database: SqliteDatabase) -> None:
+    Hall.create(**_hall("A"))
+    with BatchWriter() as writer:
+        writer.delete(Hall.delete().where(Hall.url == "h"))
+        writer.add(Hall, _hall("B"))
+        assert [hall.name for hall in Hall.select()] == ["A"]
+    assert [hall.name for hall in Hall.select()] == ["B"]
+
+
+def test_requeues_failed_flushes(
+    database: SqliteDatabase, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    writer = BatchWriter()
+    writer.add(Hall, _hall("A"))
+
+    def atomic() -> None:
+        raise OperationalError
+
+    with monkeypatch.context() as patch:
+        patch.setattr(database, "atomic", atomic)
+        with pytest.raises(OperationalError):
+            writer.flush()
+    writer.flush()
+    assert [hall.name for hall in Hall.select()] == ["A"]